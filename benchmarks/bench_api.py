@@ -0,0 +1,258 @@
+"""End-to-end benchmarks of CLI commands against the local mock Okta API in mock_okta.py.
+
+Starts the mock server, then runs each scenario in its own process so peak RSS is per scenario:
+
+    login        the device authorization flow, from an empty token cache to an access token
+    list-users   'list user all'            list-groups  'list group all'     list-apps  'list app all'
+    search-users 'list user all --search ...', one department (a fifth of the users) selected by the server
+    membership   'list group all --with-members'
+    create-user  'create user --from users.csv' with --create-users rows
+
+Every listing renders as NDJSON into a line counter, so 'records' is what the CLI actually wrote. Each scenario
+runs --runs times and reports throughput (records/sec over all runs), p50/p99 per-run latency and peak RSS.
+Server options (latency, page size, dataset size, 429 injection) are passed through to the mock, e.g.
+
+    python benchmarks/bench_api.py --users 20000 --latency 40 --jitter 20 --throttle-rate 0.01 --runs 5
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+MOCK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_okta.py")
+
+SCENARIOS = {
+    "login": None,
+    "list-users": "list user all --output ndjson",
+    "list-groups": "list group all --output ndjson",
+    "list-apps": "list app all --output ndjson",
+    "search-users": "list user all --output ndjson --search 'profile.department eq \"Finance\"'",
+    "membership": "list group all --with-members --output ndjson",
+    "create-user": "create user --from {path}"
+}
+
+MOCK_OPTIONS = ("users", "groups", "apps", "members", "page_size", "latency", "jitter", "rate_limit", "window",
+                "throttle_rate", "throttle_reset", "device_polls", "seed")
+
+
+class LineCounter:
+    """sys.stdout stand-in that counts the lines written to it and throws them away"""
+
+    def __init__(self):
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count("\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+def peak_rss_kib():
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def write_users_file(path, run, count):
+    with open(path, "w") as users_file:
+        users_file.write("login,firstName,lastName,email\n")
+        for number in range(count):
+            login = f"bench{run}-{number}@example.com"
+            users_file.write(f"{login},Bench{number},Run{run},{login}\n")
+
+
+def run_scenario(name, url, runs, create_users, prefetch):
+    import main
+
+    main.oktaOrgUrl = url
+    main.clientId = "bench-cli"
+    main.prefetchDepth = prefetch
+
+    latencies = []
+    records = 0
+    errors = []
+
+    stdout = sys.stdout
+    sink = LineCounter()
+    sys.stdout = sink
+
+    try:
+        if name == "login":
+            baseline = peak_rss_kib()
+
+            for run in range(runs):
+                main.forget_token()
+
+                started = time.perf_counter()
+                token = main.runtime.run(main.okta_login(None))
+                latencies.append(time.perf_counter() - started)
+
+                if token is None:
+                    errors.append("login failed")
+                else:
+                    records += 1
+        else:
+            main.clientConfig = {'authorizationMode': 'Bearer', 'orgUrl': main.org_base_url(), 'token': "bench"}
+            main.runtime.run(main.connect())
+            cli = main.OktaCLI()
+            baseline = peak_rss_kib()
+
+            for run in range(runs):
+                line = SCENARIOS[name]
+
+                if name == "create-user":
+                    path = os.path.join(os.environ["HOME"], f"users-{run}.csv")
+                    write_users_file(path, run, create_users)
+                    line = line.format(path=path)
+
+                run_errors = []
+                main.commandErrors.set(run_errors)
+                sink.lines = 0
+
+                started = time.perf_counter()
+                cli.onecmd(line)
+                latencies.append(time.perf_counter() - started)
+
+                errors.extend(run_errors)
+                records += create_users - len(run_errors) if name == "create-user" else sink.lines
+    finally:
+        sys.stdout = stdout
+        main.runtime.close()
+
+    print(json.dumps({"scenario": name, "runs": runs, "records": records, "latencies": latencies,
+                      "errors": errors[:10], "error_count": len(errors), "baseline_rss_kib": baseline,
+                      "peak_rss_kib": peak_rss_kib()}))
+
+
+def free_port():
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+
+def start_mock(args, port):
+    command = [sys.executable, MOCK, "--port", str(port), "--device-interval", "0"]
+    for option in MOCK_OPTIONS:
+        command += ["--" + option.replace("_", "-"), str(getattr(args, option))]
+
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 60
+
+    # building a large dataset takes a moment; wait until the server answers
+    while True:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=1).close()
+            return server
+        except OSError:
+            if server.poll() is not None or time.time() > deadline:
+                server.kill()
+                raise RuntimeError("The mock Okta server did not start")
+            time.sleep(0.1)
+
+
+def mock_stats(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stats", timeout=5) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI commands against a local mock Okta API")
+    parser.add_argument('--scenarios', default=",".join(SCENARIOS),
+                        help=f"Comma-separated scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--runs', type=int, default=5, help="Runs per scenario")
+    parser.add_argument('--create-users', type=int, default=200, help="Rows in the create-user file")
+    parser.add_argument('--prefetch', type=int, default=2, help="Pages of read-ahead for listings (main.py -p)")
+    parser.add_argument('--json', action="store_true", help="Print the results as JSON instead of a table")
+
+    # passed through to mock_okta.py
+    parser.add_argument('--users', type=int, default=5000, help="Users in the mock org")
+    parser.add_argument('--groups', type=int, default=50, help="Groups in the mock org")
+    parser.add_argument('--apps', type=int, default=50, help="Apps in the mock org")
+    parser.add_argument('--members', type=int, default=500, help="Members per group")
+    parser.add_argument('--page-size', type=int, default=200, help="Largest page the mock returns")
+    parser.add_argument('--latency', type=float, default=20, help="Server latency per request, in ms")
+    parser.add_argument('--jitter', type=float, default=10, help="Random extra latency per request, up to this many ms")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requests per bucket per window (0 for no limit)")
+    parser.add_argument('--window', type=float, default=60, help="Rate limit window, in seconds")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="Fraction of requests answered with a 429")
+    parser.add_argument('--throttle-reset', type=float, default=1, help="Seconds until an injected 429 resets")
+    parser.add_argument('--device-polls', type=int, default=2, help="Token polls before a device login is approved")
+    parser.add_argument('--seed', type=int, default=0)
+
+    parser.add_argument('--child', choices=tuple(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_scenario(args.child, args.url, args.runs, args.create_users, args.prefetch)
+        return
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    port = free_port()
+    server = start_mock(args, port)
+    results = []
+
+    try:
+        for name in scenarios:
+            with tempfile.TemporaryDirectory() as home:
+                env = dict(os.environ, HOME=home, OKTA_TESTING_TESTINGDISABLEHTTPSCHECK="True")
+                command = [sys.executable, __file__, "--child", name, "--url", f"http://127.0.0.1:{port}",
+                           "--runs", str(args.runs), "--create-users", str(args.create_users),
+                           "--prefetch", str(args.prefetch)]
+
+                completed = subprocess.run(command, env=env, capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise RuntimeError(f"Scenario {name} failed:\n{completed.stderr}")
+
+                results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        stats = mock_stats(port)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.json:
+        print(json.dumps({"results": results, "server": stats}, indent=2))
+        return
+
+    print(f"{'scenario':<12} {'runs':>5} {'records':>9} {'records/s':>10} {'p50 ms':>9} {'p99 ms':>9} "
+          f"{'peak RSS MiB':>13} {'+MiB':>6} {'errors':>7}")
+    for result in results:
+        latencies = result["latencies"]
+        throughput = result["records"] / sum(latencies) if sum(latencies) else 0
+        print(f"{result['scenario']:<12} {result['runs']:>5} {result['records']:>9} {throughput:>10.1f} "
+              f"{percentile(latencies, 50) * 1000:>9.1f} {percentile(latencies, 99) * 1000:>9.1f} "
+              f"{result['peak_rss_kib'] / 1024:>13.1f} "
+              f"{(result['peak_rss_kib'] - result['baseline_rss_kib']) / 1024:>6.1f} {result['error_count']:>7}")
+
+    for result in results:
+        for message in result["errors"]:
+            print(f"{result['scenario']}: {message}")
+
+    print(f"\nmock server: {stats['requests']} requests, {stats['throttled']} answered 429 "
+          f"({stats['injected']} injected)")
+
+
+if __name__ == "__main__":
+    main()
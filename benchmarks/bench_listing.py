@@ -0,0 +1,141 @@
+"""Per-record CPU time and peak RSS of rendering 'list user all' pages.
+
+Compares the okta.models hydration path ('models', what the SDK's list_users returns) against the raw JSON
+path used by the CLI ('raw'). Each mode runs in its own process so the peak RSS numbers don't bleed into
+each other. Both render through main.RowWriter into /dev/null, so only parsing and hydration differ.
+
+    python benchmarks/bench_listing.py --records 100000
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+PAGE_SIZE = 200
+
+
+def build_page(page_number):
+    users = []
+
+    for index in range(PAGE_SIZE):
+        number = page_number * PAGE_SIZE + index
+        users.append({
+            "id": f"00u{number:017d}",
+            "status": "ACTIVE",
+            "created": "2021-04-01T16:45:06.000Z",
+            "activated": "2021-04-01T16:45:07.000Z",
+            "statusChanged": "2021-04-01T16:45:07.000Z",
+            "lastLogin": "2022-11-02T09:10:11.000Z",
+            "lastUpdated": "2022-11-02T09:10:11.000Z",
+            "passwordChanged": "2021-04-01T16:45:07.000Z",
+            "type": {"id": "oty1a2b3c4d5e6f7g8h9"},
+            "profile": {
+                "firstName": f"First{number}",
+                "lastName": f"Last{number}",
+                "mobilePhone": None,
+                "secondEmail": None,
+                "login": f"user{number}@example.com",
+                "email": f"user{number}@example.com",
+                "department": "Engineering",
+                "title": "Engineer",
+                "city": "San Francisco"
+            },
+            "credentials": {
+                "password": {},
+                "provider": {"type": "OKTA", "name": "OKTA"}
+            },
+            "_links": {
+                "self": {"href": f"https://example.okta.com/api/v1/users/00u{number:017d}"}
+            }
+        })
+
+    return json.dumps(users)
+
+
+def run_mode(mode, records):
+    from main import RowWriter
+
+    if mode == "models":
+        import okta.models as models
+
+    rendered = 0
+    cpu_seconds = 0.0
+
+    with open(os.devnull, "w") as sink:
+        writer = RowWriter("user", stream=sink)
+
+        for number in range(max(1, records // PAGE_SIZE)):
+            text = build_page(number)
+            started = time.process_time()
+
+            body = json.loads(text)
+
+            if mode == "models":
+                body = [models.User(item) for item in body]
+
+            for user in body:
+                writer.write(user)
+
+            writer.flush()
+            rendered += len(body)
+            cpu_seconds += time.process_time() - started
+
+        # heap high-water mark of handling one page, measured outside the timed loop since tracemalloc is slow
+        text = build_page(0)
+        tracemalloc.start()
+
+        body = json.loads(text)
+        if mode == "models":
+            body = [models.User(item) for item in body]
+        for user in body:
+            writer.write(user)
+        writer.flush()
+
+        page_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak // 1024
+
+    print(json.dumps({"mode": mode, "records": rendered, "cpu_seconds": cpu_seconds, "peak_rss_kib": peak,
+                      "page_heap_kib": page_peak // 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark okta.models hydration against the raw JSON listing path")
+    parser.add_argument('--records', type=int, default=50000, help="Number of user records to render")
+    parser.add_argument('--mode', choices=("models", "raw"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.records)
+        return
+
+    results = {}
+    for mode in ("models", "raw"):
+        output = subprocess.run([sys.executable, __file__, "--mode", mode, "--records", str(args.records)],
+                                check=True, capture_output=True, text=True).stdout
+        results[mode] = json.loads(output.strip().splitlines()[-1])
+
+    print(f"{'mode':<8} {'records':>9} {'cpu s':>8} {'us/record':>10} {'peak RSS MiB':>13} {'page heap KiB':>14}")
+    for mode, result in results.items():
+        per_record = result["cpu_seconds"] * 1e6 / result["records"]
+        print(f"{mode:<8} {result['records']:>9} {result['cpu_seconds']:>8.2f} {per_record:>10.1f} "
+              f"{result['peak_rss_kib'] / 1024:>13.1f} {result['page_heap_kib']:>14}")
+
+    models_result, raw_result = results["models"], results["raw"]
+    print(f"\nraw path: {models_result['cpu_seconds'] / raw_result['cpu_seconds']:.1f}x less CPU, "
+          f"{(models_result['peak_rss_kib'] - raw_result['peak_rss_kib']) / 1024:.1f} MiB lower peak RSS, "
+          f"{models_result['page_heap_kib'] / max(1, raw_result['page_heap_kib']):.1f}x smaller per-page heap")
+
+
+if __name__ == "__main__":
+    main()
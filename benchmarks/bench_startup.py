@@ -0,0 +1,109 @@
+"""Startup time of the CLI: '--help', and time-to-prompt for a login that is served from the token cache.
+
+The cached-token launch runs against a throwaway HOME holding an unexpired token, so it makes no network calls
+and measures only imports, argument parsing and setup. The slowest imports of '--help' are listed from
+'python -X importtime'. Pass --max-help-ms/--max-prompt-ms to fail (exit 1) when a median exceeds a budget,
+e.g. as a regression guard in CI.
+
+    python benchmarks/bench_startup.py --runs 10 --max-help-ms 400 --max-prompt-ms 600
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main.py")
+
+ORG = "startup-bench.okta.invalid"
+CLIENT_ID = "0oastartupbench00000"
+
+
+def time_help():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, MAIN, "--help"], check=True, stdout=subprocess.DEVNULL)
+    return (time.perf_counter() - started) * 1000
+
+
+def time_to_prompt(home):
+    """Milliseconds from launch until the '>>' prompt is written"""
+    env = dict(os.environ, HOME=home)
+
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, MAIN, "-l", ORG, "-c", CLIENT_ID], env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    output = b""
+    while b">>" not in output:
+        chunk = os.read(process.stdout.fileno(), 4096)
+        if not chunk:
+            raise RuntimeError("The CLI exited before showing the prompt: " + output.decode(errors="replace"))
+        output += chunk
+
+    elapsed = (time.perf_counter() - started) * 1000
+
+    process.communicate(b"exit\n")
+    return elapsed
+
+
+def slowest_imports(count):
+    result = subprocess.run([sys.executable, "-X", "importtime", MAIN, "--help"], check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # only top-level imports; nested ones are already part of their parent's cumulative time
+        if name.startswith("  "):
+            continue
+
+        imports.append((int(cumulative_us), name.strip()))
+
+    return sorted(imports, reverse=True)[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time")
+    parser.add_argument('--runs', type=int, default=10, help="Launches per measurement")
+    parser.add_argument('--max-help-ms', type=float, help="Fail if the median '--help' time exceeds this")
+    parser.add_argument('--max-prompt-ms', type=float, help="Fail if the median time-to-prompt exceeds this")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as home:
+        cache_dir = os.path.join(home, ".okta", "cli")
+        os.makedirs(cache_dir)
+
+        with open(os.path.join(cache_dir, "tokens.json"), "w") as cache_file:
+            json.dump({f"{ORG}|{CLIENT_ID}": {"access_token": "startup-bench", "refresh_token": None,
+                                              "expires_at": time.time() + 3600, "scope": None}}, cache_file)
+
+        help_times = [time_help() for run in range(args.runs)]
+        prompt_times = [time_to_prompt(home) for run in range(args.runs)]
+
+    print(f"{'measurement':<16} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+    for name, times in (("--help", help_times), ("time to prompt", prompt_times)):
+        print(f"{name:<16} {statistics.median(times):>10.1f} {min(times):>8.1f} {max(times):>8.1f}")
+
+    print("\nslowest top-level imports for --help:")
+    for cumulative_us, name in slowest_imports(8):
+        print(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+    failed = False
+    if args.max_help_ms is not None and statistics.median(help_times) > args.max_help_ms:
+        print(f"\n--help median exceeds the {args.max_help_ms:.0f} ms budget")
+        failed = True
+    if args.max_prompt_ms is not None and statistics.median(prompt_times) > args.max_prompt_ms:
+        print(f"\ntime to prompt median exceeds the {args.max_prompt_ms:.0f} ms budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
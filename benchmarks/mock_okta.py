@@ -0,0 +1,590 @@
+"""A local stand-in for the parts of the Okta API that main.py uses, for benchmarking without a live org.
+
+Serves users, groups and apps listings with 'Link: rel="next"' pagination and q/filter/search (evaluated with
+the CLI's own expression parser, rejecting by its own table what the real API rejects), get and create for each,
+user and group profile updates, group members (listed, added and removed), the default user schema (with an ETag),
+app grants, user and group assignments (made and listed), and the OAuth device authorization and token endpoints.
+Every response carries X-Rate-Limit-* headers.
+
+Latency, page sizes and dataset sizes are configurable, and rate limiting can be simulated two ways: a
+per-bucket request budget (--rate-limit), and randomly injected 429s (--throttle-rate).
+
+    python benchmarks/mock_okta.py --port 8765 --users 20000 --latency 30 --throttle-rate 0.01
+
+The CLI reaches it with OKTA_TESTING_TESTINGDISABLEHTTPSCHECK=True and an http:// org URL, e.g.
+'main.py -l http://127.0.0.1:8765 -c bench'. GET /_stats returns request and 429 counts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sys
+import time
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import parse_filter, filter_matches
+
+# what the real API accepts in ?filter= (attribute: operators), kept apart from the CLI's own table so a
+# condition the CLI wrongly sends to the server fails here as it would against Okta
+API_FILTERS = {
+    "user": {"status": ("eq",), "lastUpdated": ("eq", "gt", "ge", "lt", "le"), "id": ("eq",),
+             "profile.login": ("eq",), "profile.email": ("eq",), "profile.firstName": ("eq",),
+             "profile.lastName": ("eq",)},
+    "group": {"id": ("eq",), "type": ("eq",), "lastUpdated": ("eq", "gt", "ge", "lt", "le"),
+              "lastMembershipUpdated": ("eq", "gt", "ge", "lt", "le")},
+    "app": {"status": ("eq",), "name": ("eq",), "user.id": ("eq",), "group.id": ("eq",),
+            "credentials.signing.kid": ("eq",)}
+}
+
+# listings that take ?search=
+API_SEARCH = ("user", "group")
+
+CREATED = "2021-04-01T16:45:06.000Z"
+UPDATED = "2022-11-02T09:10:11.000Z"
+
+USER_SCHEMA = {
+    "id": "#base",
+    "name": "user",
+    "definitions": {
+        "base": {
+            "id": "#base",
+            "type": "object",
+            "properties": {
+                "login": {"title": "Username", "type": "string", "required": True},
+                "firstName": {"title": "First name", "type": "string", "required": True},
+                "lastName": {"title": "Last name", "type": "string", "required": True},
+                "email": {"title": "Primary email", "type": "string", "required": True},
+                "department": {"title": "Department", "type": "string"},
+                "title": {"title": "Title", "type": "string"},
+                "mobilePhone": {"title": "Mobile phone", "type": "string"}
+            },
+            "required": ["login", "firstName", "lastName", "email"]
+        },
+        "custom": {"id": "#custom", "type": "object", "properties": {}, "required": []}
+    }
+}
+
+DEPARTMENTS = ("Engineering", "Sales", "Marketing", "Support", "Finance")
+
+
+def user_id(number):
+    return f"00u{number:017d}"
+
+
+def group_id(number):
+    return f"00g{number:017d}"
+
+
+def app_id(number):
+    return f"0oa{number:017d}"
+
+
+def build_user(base_url, number, profile=None, status="ACTIVE"):
+    return {
+        "id": user_id(number),
+        "status": status,
+        "created": CREATED,
+        "activated": CREATED if status == "ACTIVE" else None,
+        "statusChanged": CREATED,
+        "lastLogin": UPDATED,
+        "lastUpdated": UPDATED,
+        "passwordChanged": CREATED,
+        "type": {"id": "oty1a2b3c4d5e6f7g8h9"},
+        "profile": profile or {
+            "firstName": f"First{number}",
+            "lastName": f"Last{number}",
+            "mobilePhone": None,
+            "secondEmail": None,
+            "login": f"user{number}@example.com",
+            "email": f"user{number}@example.com",
+            "department": DEPARTMENTS[number % len(DEPARTMENTS)],
+            "title": "Engineer"
+        },
+        "credentials": {"password": {}, "provider": {"type": "OKTA", "name": "OKTA"}},
+        "_links": {"self": {"href": f"{base_url}/api/v1/users/{user_id(number)}"}}
+    }
+
+
+def build_group(base_url, number, profile=None):
+    return {
+        "id": group_id(number),
+        "created": CREATED,
+        "lastUpdated": UPDATED,
+        "lastMembershipUpdated": UPDATED,
+        "objectClass": ["okta:user_group"],
+        "type": "OKTA_GROUP",
+        "profile": profile or {"name": f"Group {number}", "description": f"Benchmark group {number}"},
+        "_links": {
+            "self": {"href": f"{base_url}/api/v1/groups/{group_id(number)}"},
+            "users": {"href": f"{base_url}/api/v1/groups/{group_id(number)}/users"}
+        }
+    }
+
+
+def build_app(base_url, number, body=None):
+    body = body or {}
+
+    return {
+        "id": app_id(number),
+        "name": body.get("name", "oidc_client"),
+        "label": body.get("label", f"App {number}"),
+        "status": "ACTIVE",
+        "created": CREATED,
+        "lastUpdated": UPDATED,
+        "signOnMode": body.get("signOnMode", "OPENID_CONNECT"),
+        "settings": body.get("settings", {}),
+        "credentials": body.get("credentials", {}),
+        "_links": {"self": {"href": f"{base_url}/api/v1/apps/{app_id(number)}"}}
+    }
+
+
+def error(status, code, summary, causes=()):
+    return web.json_response({"errorCode": code, "errorSummary": summary, "errorLink": code,
+                              "errorId": f"oae{random.getrandbits(64):016x}",
+                              "errorCauses": [{"errorSummary": cause} for cause in causes]}, status=status)
+
+
+def api_filterable(kind, node):
+    """Whether the API accepts a parsed filter expression: eq or ranges on the attributes above, joined by and/or"""
+    if node[0] in ("and", "or"):
+        return all(api_filterable(kind, child) for child in node[1])
+    if node[0] != "compare":
+        return False
+
+    return node[2] in API_FILTERS[kind].get(node[1], ())
+
+
+class MockOkta:
+    """In-memory org state plus the aiohttp handlers that serve it"""
+
+    def __init__(self, args):
+        self.args = args
+        self.base_url = f"http://{args.host}:{args.port}"
+        self.random = random.Random(args.seed)
+
+        self.users = [build_user(self.base_url, number) for number in range(args.users)]
+        self.groups = [build_group(self.base_url, number) for number in range(args.groups)]
+        self.apps = [build_app(self.base_url, number) for number in range(args.apps)]
+        self.logins = {user["profile"]["login"].lower(): user for user in self.users}
+        self.by_id = {item["id"]: item for item in self.users + self.groups + self.apps}
+
+        # group id -> {user id: user} once a group's members have been changed; app id -> {user or group id: assignment}
+        self.memberships = {}
+        self.app_groups = {}
+        self.app_users = {}
+
+        self.devices = {}
+        self.buckets = {}
+        self.stats = {"requests": 0, "throttled": 0, "injected": 0, "by_endpoint": {}}
+
+    def application(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.add_routes([
+            web.get("/api/v1/users", self.list_users),
+            web.post("/api/v1/users", self.create_user),
+            # the SDK sends some collection requests with a trailing slash
+            web.post("/api/v1/users/", self.create_user),
+            web.get("/api/v1/users/{id}", self.get_user),
+            web.post("/api/v1/users/{id}", self.update_user),
+            web.get("/api/v1/groups", self.list_groups),
+            web.post("/api/v1/groups", self.create_group),
+            web.post("/api/v1/groups/", self.create_group),
+            web.get("/api/v1/groups/{id}", self.get_object),
+            web.put("/api/v1/groups/{id}", self.update_group),
+            web.get("/api/v1/groups/{id}/users", self.list_group_members),
+            web.put("/api/v1/groups/{id}/users/{userId}", self.add_member),
+            web.delete("/api/v1/groups/{id}/users/{userId}", self.remove_member),
+            web.get("/api/v1/apps", self.list_apps),
+            web.post("/api/v1/apps", self.create_app),
+            web.post("/api/v1/apps/", self.create_app),
+            web.get("/api/v1/apps/{id}", self.get_object),
+            web.post("/api/v1/apps/{id}/grants", self.grant_scope),
+            web.get("/api/v1/apps/{id}/users", self.list_app_users),
+            web.post("/api/v1/apps/{id}/users", self.assign_user),
+            web.get("/api/v1/apps/{id}/groups", self.list_app_groups),
+            web.put("/api/v1/apps/{id}/groups/{groupId}", self.assign_group),
+            web.delete("/api/v1/apps/{id}/groups/{groupId}", self.unassign_group),
+            web.get("/api/v1/meta/schemas/user/default", self.user_schema),
+            web.post("/oauth2/v1/device/authorize", self.device_authorize),
+            web.post("/oauth2/v1/token", self.token),
+            web.get("/_stats", self.get_stats)
+        ])
+
+        return app
+
+    @staticmethod
+    def bucket(request):
+        return request.method + " " + re.sub(r"/(00u|00g|0oa)\w+", "/{id}", request.path.rstrip("/"))
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        if request.path == "/_stats":
+            return await handler(request)
+
+        key = self.bucket(request)
+        self.stats["requests"] += 1
+        self.stats["by_endpoint"][key] = self.stats["by_endpoint"].get(key, 0) + 1
+
+        latency = self.args.latency + self.random.uniform(0, self.args.jitter)
+        if latency:
+            await asyncio.sleep(latency / 1000)
+
+        # a fixed window per bucket, like Okta's per-endpoint minute limits
+        now = time.time()
+        window_start, used = self.buckets.get(key, (now, 0))
+        if now - window_start >= self.args.window:
+            window_start, used = now, 0
+
+        limit = self.args.rate_limit or 1000000
+        reset = int(window_start + self.args.window) + 1
+        headers = {"X-Rate-Limit-Limit": str(limit), "X-Rate-Limit-Reset": str(reset)}
+
+        injected = self.args.throttle_rate and self.random.random() < self.args.throttle_rate
+        if used >= limit or injected:
+            self.stats["throttled"] += 1
+            self.stats["injected"] += 1 if injected else 0
+
+            if injected:
+                reset = int(now + self.args.throttle_reset) + 1
+                headers["X-Rate-Limit-Reset"] = str(reset)
+
+            response = error(429, "E0000047", "API call exceeded rate limit due to too many requests.")
+            response.headers.update(headers)
+            response.headers["X-Rate-Limit-Remaining"] = "0"
+            return response
+
+        self.buckets[key] = (window_start, used + 1)
+
+        response = await handler(request)
+        response.headers.update(headers)
+        response.headers["X-Rate-Limit-Remaining"] = str(max(0, limit - used - 1))
+        return response
+
+    def page(self, request, items):
+        """One page of `items` from the 'after' cursor, with a Link header to the next page if there is one"""
+        try:
+            limit = min(int(request.query.get("limit", self.args.page_size)), self.args.page_size)
+            after = int(request.query.get("after", 0))
+        except ValueError:
+            return error(400, "E0000001", "Api validation failed: limit")
+
+        chunk = items[after:after + limit]
+        links = [f'<{request.url}>; rel="self"']
+
+        if after + limit < len(items):
+            query = dict(request.query)
+            query["after"] = str(after + limit)
+            links.append(f'<{request.url.with_query(query)}>; rel="next"')
+
+        return web.Response(text=json.dumps(chunk), content_type="application/json",
+                            headers={"Link": ", ".join(links)})
+
+    def find(self, identifier, kind):
+        item = self.by_id.get(identifier)
+        if item is None and kind == "User":
+            item = self.logins.get(identifier.lower())
+
+        if item is None:
+            return None, error(404, "E0000007", f"Not found: Resource not found: {identifier} ({kind})")
+
+        return item, None
+
+    def select(self, request, kind, items):
+        """The items matching the request's q, filter and search parameters, or an error response"""
+        query = request.query
+
+        if query.get("q"):
+            prefix = query["q"].lower()
+            names = {"user": ("profile.firstName", "profile.lastName", "profile.email"),
+                     "group": ("profile.name",), "app": ("label", "name")}[kind]
+            node = ("or", [("compare", name, "sw", prefix) for name in names])
+            items = [item for item in items if filter_matches(node, item)]
+
+        for parameter in ("filter", "search"):
+            if not query.get(parameter):
+                continue
+
+            try:
+                node = parse_filter(query[parameter])
+            except ValueError as problem:
+                return None, error(400, "E0000031", f"Invalid search criteria: {problem}")
+
+            if parameter == "search" and kind not in API_SEARCH or \
+                    parameter == "filter" and not api_filterable(kind, node):
+                return None, error(400, "E0000031", f"Invalid {parameter} criteria: {query[parameter]}")
+
+            items = [item for item in items if filter_matches(node, item)]
+
+        return items, None
+
+    async def list_users(self, request):
+        return await self.list_kind(request, "user", self.users)
+
+    async def list_groups(self, request):
+        return await self.list_kind(request, "group", self.groups)
+
+    async def list_apps(self, request):
+        return await self.list_kind(request, "app", self.apps)
+
+    async def list_kind(self, request, kind, items):
+        if not any(request.query.get(name) for name in ("q", "filter", "search")):
+            return self.page(request, items)
+
+        items, response = self.select(request, kind, items)
+        return response or self.page(request, items)
+
+    async def get_user(self, request):
+        user, response = self.find(request.match_info["id"], "User")
+        return response or web.json_response(user)
+
+    async def get_object(self, request):
+        kind = "UserGroup" if "/groups/" in request.path else "AppInstance"
+        item, response = self.find(request.match_info["id"], kind)
+        return response or web.json_response(item)
+
+    def members(self, group):
+        """A deterministic slice of the users for each group, wrapping around the user list, until it's changed"""
+        if group["id"] in self.memberships:
+            return list(self.memberships[group["id"]].values())
+
+        number = int(group["id"][3:])
+        count = min(self.args.members, len(self.users))
+        start = number * count % max(1, len(self.users))
+
+        members = self.users[start:start + count]
+        return members + self.users[:count - len(members)]
+
+    async def list_group_members(self, request):
+        group, response = self.find(request.match_info["id"], "UserGroup")
+        return response or self.page(request, self.members(group))
+
+    def member_change(self, request):
+        """The group and user of a membership request, with the group's members made editable"""
+        group, response = self.find(request.match_info["id"], "UserGroup")
+        if response is None:
+            user, response = self.find(request.match_info["userId"], "User")
+        if response is not None:
+            return None, None, response
+
+        if group["id"] not in self.memberships:
+            self.memberships[group["id"]] = {member["id"]: member for member in self.members(group)}
+
+        return self.memberships[group["id"]], user, None
+
+    async def add_member(self, request):
+        members, user, response = self.member_change(request)
+        if response is not None:
+            return response
+
+        members[user["id"]] = user
+        return web.Response(status=204)
+
+    async def remove_member(self, request):
+        members, user, response = self.member_change(request)
+        if response is not None:
+            return response
+
+        members.pop(user["id"], None)
+        return web.Response(status=204)
+
+    async def update_user(self, request):
+        user, response = self.find(request.match_info["id"], "User")
+        if response is not None:
+            return response
+
+        profile = (await request.json()).get("profile") or {}
+        login = profile.get("login", user["profile"]["login"]).lower()
+
+        if login != user["profile"]["login"].lower() and login in self.logins:
+            return error(400, "E0000001", "Api validation failed: login",
+                         ["login: An object with this field already exists in the current organization"])
+
+        del self.logins[user["profile"]["login"].lower()]
+        user["profile"].update(profile)
+        self.logins[login] = user
+
+        return web.json_response(user)
+
+    async def update_group(self, request):
+        group, response = self.find(request.match_info["id"], "UserGroup")
+        if response is not None:
+            return response
+
+        group["profile"] = (await request.json()).get("profile") or {}
+        return web.json_response(group)
+
+    async def create_user(self, request):
+        body = await request.json()
+        profile = body.get("profile") or {}
+        login = (profile.get("login") or "").lower()
+
+        missing = [name for name in USER_SCHEMA["definitions"]["base"]["required"] if not profile.get(name)]
+        if missing:
+            return error(400, "E0000001", "Api validation failed: " + ", ".join(missing),
+                         [f"{name}: The field cannot be left blank." for name in missing])
+
+        if login in self.logins:
+            return error(400, "E0000001", "Api validation failed: login",
+                         ["login: An object with this field already exists in the current organization"])
+
+        status = "STAGED" if request.query.get("activate") == "false" else "ACTIVE"
+        user = build_user(self.base_url, len(self.users), profile, status)
+
+        self.users.append(user)
+        self.logins[login] = user
+        self.by_id[user["id"]] = user
+
+        return web.json_response(user)
+
+    async def create_group(self, request):
+        body = await request.json()
+        group = build_group(self.base_url, len(self.groups), body.get("profile"))
+
+        self.groups.append(group)
+        self.by_id[group["id"]] = group
+        self.memberships[group["id"]] = {}
+
+        return web.json_response(group)
+
+    async def create_app(self, request):
+        app = build_app(self.base_url, len(self.apps), await request.json())
+        app["credentials"].setdefault("oauthClient", {"client_id": app["id"]})
+
+        self.apps.append(app)
+        self.by_id[app["id"]] = app
+
+        return web.json_response(app)
+
+    async def grant_scope(self, request):
+        body = await request.json()
+        return web.json_response({"id": f"oag{random.getrandbits(64):017x}", "status": "ACTIVE",
+                                  "clientId": request.match_info["id"], **body})
+
+    async def assign_user(self, request):
+        app, response = self.find(request.match_info["id"], "AppInstance")
+        if response is not None:
+            return response
+
+        assignment = {**await request.json(), "scope": "USER", "status": "ACTIVE"}
+        self.app_users.setdefault(app["id"], {})[assignment.get("id")] = assignment
+
+        return web.json_response(assignment)
+
+    async def list_app_users(self, request):
+        app, response = self.find(request.match_info["id"], "AppInstance")
+        return response or self.page(request, list(self.app_users.get(app["id"], {}).values()))
+
+    async def list_app_groups(self, request):
+        app, response = self.find(request.match_info["id"], "AppInstance")
+        return response or self.page(request, list(self.app_groups.get(app["id"], {}).values()))
+
+    async def assign_group(self, request):
+        app, response = self.find(request.match_info["id"], "AppInstance")
+        if response is None:
+            group, response = self.find(request.match_info["groupId"], "UserGroup")
+        if response is not None:
+            return response
+
+        assignment = {"id": group["id"], "priority": 0, "lastUpdated": UPDATED, "profile": {},
+                      "_links": {"group": {"href": group["_links"]["self"]["href"]}}}
+        self.app_groups.setdefault(app["id"], {})[group["id"]] = assignment
+
+        return web.json_response(assignment)
+
+    async def unassign_group(self, request):
+        app, response = self.find(request.match_info["id"], "AppInstance")
+        if response is not None:
+            return response
+
+        self.app_groups.get(app["id"], {}).pop(request.match_info["groupId"], None)
+        return web.Response(status=204)
+
+    async def user_schema(self, request):
+        if request.headers.get("If-None-Match") == '"user-schema-v1"':
+            return web.Response(status=304, headers={"ETag": '"user-schema-v1"'})
+
+        return web.json_response(USER_SCHEMA, headers={"ETag": '"user-schema-v1"'})
+
+    async def device_authorize(self, request):
+        form = await request.post()
+        if not form.get("client_id"):
+            return web.json_response({"error": "invalid_client", "error_description": "No client_id"}, status=400)
+
+        device_code = f"dc{random.getrandbits(64):016x}"
+        self.devices[device_code] = {"polls": 0, "client_id": form["client_id"], "scope": form.get("scope")}
+
+        return web.json_response({
+            "device_code": device_code,
+            "user_code": "BENCHMRK",
+            "verification_uri": f"{self.base_url}/activate",
+            "verification_uri_complete": f"{self.base_url}/activate?user_code=BENCHMRK",
+            "expires_in": 600,
+            "interval": self.args.device_interval
+        })
+
+    def issue_token(self, scope):
+        return web.json_response({
+            "token_type": "Bearer",
+            "expires_in": 3600,
+            "access_token": f"at{random.getrandbits(128):032x}",
+            "refresh_token": f"rt{random.getrandbits(128):032x}",
+            "scope": scope
+        })
+
+    async def token(self, request):
+        form = await request.post()
+        grant_type = form.get("grant_type")
+
+        if grant_type == "refresh_token":
+            return self.issue_token(form.get("scope"))
+
+        device = self.devices.get(form.get("device_code"))
+        if device is None:
+            return web.json_response({"error": "invalid_grant", "error_description": "Unknown device code"}, status=400)
+
+        # the user 'approves' the request after a set number of polls
+        device["polls"] += 1
+        if device["polls"] <= self.args.device_polls:
+            return web.json_response({"error": "authorization_pending",
+                                      "error_description": "The device authorization is pending."}, status=400)
+
+        del self.devices[form["device_code"]]
+        return self.issue_token(device["scope"])
+
+    async def get_stats(self, request):
+        return web.json_response(self.stats)
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Serve a mock Okta API for benchmarks")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--users', type=int, default=5000, help="Users in the org")
+    parser.add_argument('--groups', type=int, default=50, help="Groups in the org")
+    parser.add_argument('--apps', type=int, default=50, help="Apps in the org")
+    parser.add_argument('--members', type=int, default=500, help="Members per group")
+    parser.add_argument('--page-size', type=int, default=200, help="Largest page a listing returns, whatever the limit")
+    parser.add_argument('--latency', type=float, default=0, help="Added latency per request, in ms")
+    parser.add_argument('--jitter', type=float, default=0, help="Random extra latency per request, up to this many ms")
+    parser.add_argument('--rate-limit', type=int, default=0, help="Requests per bucket per window (0 for no limit)")
+    parser.add_argument('--window', type=float, default=60, help="Rate limit window, in seconds")
+    parser.add_argument('--throttle-rate', type=float, default=0, help="Fraction of requests answered with a 429")
+    parser.add_argument('--throttle-reset', type=float, default=1, help="Seconds until an injected 429 resets")
+    parser.add_argument('--device-polls', type=int, default=2, help="Token polls before a device login is approved")
+    parser.add_argument('--device-interval', type=int, default=0, help="Polling interval the device flow asks for")
+    parser.add_argument('--seed', type=int, default=0)
+    return parser
+
+
+def main():
+    args = create_parser().parse_args()
+    web.run_app(MockOkta(args).application(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
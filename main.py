@@ -1,62 +1,3102 @@
 import cmd
 import argparse
-import requests
 import json
 import asyncio
 import time
 import os
+import sys
+import io
+import re
+import csv
+import gzip
+import enum
+import collections
+import bisect
+import shlex
+import sqlite3
+import random
+import email.utils
+import contextvars
+import contextlib
+import threading
+import importlib
+from urllib.parse import urlencode, quote, unquote
+
+# okta and aiohttp take most of a second to import, so they are imported where they're first needed;
+# --help, argument errors and a cached-token login reach the prompt without paying for them
+
+
+class RateLimitScheduler:
+    """Paces every request on the shared session by Okta's X-Rate-Limit-* headers.
+
+    Each endpoint bucket's remaining budget is tracked from responses. Once it drops to the reserve, requests to that
+    bucket wait for the reset (plus jitter) instead of drawing 429s. Concurrency across all buckets adapts too: it
+    halves on a 429 and grows back by one while budgets are healthy.
+    """
+
+    def __init__(self, max_concurrency=16, reserve=0.1):
+        self.max_concurrency = max_concurrency
+        self.concurrency = max_concurrency
+        self.reserve = reserve
+        self.in_flight = 0
+        self.slots = asyncio.Condition()
+
+        # bucket -> {"limit", "remaining", "reset"} with reset in local epoch seconds
+        self.buckets = {}
+
+        self.stats = {"throttled": 0, "throttled_seconds": 0.0, "rate_limited": 0}
+
+    @staticmethod
+    def bucket(method, url):
+        segments = url.path.strip("/").split("/")
+
+        # /api/v1/users/{id}/groups: collapse identifiers so e.g. every get_user shares one bucket
+        if segments[:2] == ["api", "v1"] and segments[2:3] != ["meta"]:
+            segments = [segment if position < 3 or position % 2 == 0 else "{id}"
+                        for position, segment in enumerate(segments)]
+
+        # every org has its own limits
+        return f"{method} {url.host}/{'/'.join(segments)}"
+
+    async def acquire(self, key):
+        while True:
+            state = self.buckets.get(key)
+            now = time.time()
+
+            if state is None or now >= state["reset"]:
+                break
+
+            if state["remaining"] > state["limit"] * self.reserve:
+                # count the request against the budget now, so concurrent callers can't all spend the last of it
+                state["remaining"] -= 1
+                break
+
+            delay = state["reset"] - now + random.uniform(0, 1)
+            self.stats["throttled"] += 1
+            self.stats["throttled_seconds"] += delay
+            await asyncio.sleep(delay)
+
+        async with self.slots:
+            await self.slots.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+
+    async def release(self, key, response=None):
+        if response is not None:
+            self.update(key, response.status, response.headers)
+
+        async with self.slots:
+            self.in_flight -= 1
+            self.slots.notify_all()
+
+    def update(self, key, status, headers):
+        limit = self._header(headers, "X-Rate-Limit-Limit")
+        remaining = self._header(headers, "X-Rate-Limit-Remaining")
+        reset = self._header(headers, "X-Rate-Limit-Reset")
+
+        # X-Rate-Limit-Reset is on the server's clock; convert via the Date header so clock skew doesn't matter
+        if reset is not None:
+            try:
+                server_now = email.utils.parsedate_to_datetime(headers["Date"]).timestamp()
+            except (KeyError, TypeError, ValueError):
+                server_now = time.time()
+            reset = time.time() + max(0.0, reset - server_now)
+
+        # a limit and remaining of 0 is Okta's concurrent request limit, which is handled like a 429
+        concurrent_limit = limit == 0 and remaining == 0
+
+        if status == 429 or concurrent_limit:
+            self.stats["rate_limited"] += 1
+            self.concurrency = max(1, self.concurrency // 2)
+
+            state = self.buckets.setdefault(key, {"limit": limit or 1, "remaining": 0, "reset": 0})
+            state["remaining"] = 0
+            state["reset"] = reset if reset is not None else time.time() + 1
+            return
+
+        if limit is None or remaining is None or reset is None:
+            return
+
+        self.buckets[key] = {"limit": limit, "remaining": remaining, "reset": reset}
+
+        if remaining > limit / 2:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        elif remaining < limit * self.reserve * 2:
+            self.concurrency = max(1, self.concurrency - 1)
+
+    @staticmethod
+    def _header(headers, name):
+        values = headers.getall(name, [])
+
+        try:
+            return min(float(value) for value in values) if values else None
+        except ValueError:
+            return None
+
+    async def on_request_start(self, session, context, params):
+        context.bucket = self.bucket(params.method, params.url)
+        await self.acquire(context.bucket)
+        context.acquired = True
+
+    async def on_request_end(self, session, context, params):
+        if getattr(context, "acquired", False):
+            context.acquired = False
+            await self.release(context.bucket, params.response)
+
+    async def on_request_exception(self, session, context, params):
+        if getattr(context, "acquired", False):
+            context.acquired = False
+            await self.release(context.bucket)
+
+
+class SessionRuntime:
+    """One event loop and one keep-alive HTTP connection pool shared by every command in a CLI session"""
+
+    def __init__(self, pool_size=20, keepalive_timeout=75):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.http_session = None
+        self.scheduler = RateLimitScheduler()
+
+        self.stats = {
+            "requests": 0,
+            "new_connections": 0,
+            "reused_connections": 0,
+            "connect_seconds": 0.0
+        }
+
+    def run(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    async def open(self):
+        if self.http_session is None or self.http_session.closed:
+            import aiohttp
+
+            trace_config = aiohttp.TraceConfig()
+            trace_config.on_request_start.append(self._on_request_start)
+            trace_config.on_request_start.append(tracer.on_request_queued)
+            trace_config.on_request_start.append(self.scheduler.on_request_start)
+            trace_config.on_request_start.append(tracer.on_request_start)
+            trace_config.on_request_end.append(self.scheduler.on_request_end)
+            trace_config.on_request_end.append(tracer.on_request_end)
+            trace_config.on_request_end.append(objectCache.on_request_end)
+            trace_config.on_request_exception.append(self.scheduler.on_request_exception)
+            trace_config.on_request_exception.append(tracer.on_request_exception)
+            trace_config.on_response_chunk_received.append(tracer.on_response_chunk_received)
+            trace_config.on_connection_create_start.append(self._on_connection_create_start)
+            trace_config.on_connection_create_end.append(self._on_connection_create_end)
+            trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive_timeout)
+            self.http_session = aiohttp.ClientSession(connector=connector, trace_configs=[trace_config])
+
+        return self.http_session
+
+    async def attach(self, okta_client):
+        """Route all of an OktaClient's requests through the shared session"""
+        session = await self.open()
+        okta_client.get_request_executor().set_session(session)
+
+        return okta_client
+
+    def close(self):
+        if self.http_session is not None and not self.http_session.closed:
+            self.run(self.http_session.close())
+
+        self.run(self.loop.shutdown_asyncgens())
+        self.loop.close()
+
+    def pool_stats(self):
+        stats = dict(self.stats)
+        connections = stats["new_connections"] + stats["reused_connections"]
+
+        stats["reuse_ratio"] = stats["reused_connections"] / connections if connections else 0.0
+        stats["avg_connect_ms"] = stats["connect_seconds"] * 1000 / stats["new_connections"] \
+            if stats["new_connections"] else 0.0
+
+        if self.http_session is not None and not self.http_session.closed:
+            idle = getattr(self.http_session.connector, "_conns", {})
+            stats["idle_connections"] = sum(len(conns) for conns in idle.values())
+        else:
+            stats["idle_connections"] = 0
+
+        return stats
+
+    async def _on_request_start(self, session, context, params):
+        self.stats["requests"] += 1
+
+    async def _on_connection_create_start(self, session, context, params):
+        context.connect_started = time.perf_counter()
+
+    async def _on_connection_create_end(self, session, context, params):
+        self.stats["new_connections"] += 1
+        self.stats["connect_seconds"] += time.perf_counter() - context.connect_started
+
+    async def _on_connection_reuseconn(self, session, context, params):
+        self.stats["reused_connections"] += 1
+
+
+class CommandTrace:
+    """Timing of one command: every HTTP request it sent, named phases, and optionally a cProfile of the command"""
+
+    def __init__(self, command, profile=False):
+        self.command = command
+        self.epoch = time.time()
+        self.started = time.perf_counter()
+        self.seconds = None
+        self.requests = []
+        self.phases = {}
+        self.spans = []
+        self.nested = 0.0
+        self.profiler = None
+
+        if profile:
+            import cProfile
+
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # only one profiler can run at a time, so concurrent batch commands after the first go unprofiled
+                self.profiler = None
+
+    def record_phase(self, name, started, ended=None, exclude=0.0):
+        if ended is None:
+            ended = time.perf_counter()
+
+        seconds, count = self.phases.get(name, (0.0, 0))
+        self.phases[name] = (seconds + ended - started - exclude, count + 1)
+        self.spans.append((name, started, ended))
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+        if self.profiler is not None:
+            self.profiler.disable()
+
+    def totals(self):
+        """Phase totals and per-endpoint HTTP totals, as reported after the command"""
+        endpoints = {}
+
+        for request in self.requests:
+            entry = endpoints.setdefault(request["endpoint"], {"requests": 0, "statuses": {}, "bytes": 0,
+                                                               "latencies": [], "queued_seconds": 0.0})
+            entry["requests"] += 1
+            entry["statuses"][str(request["status"])] = entry["statuses"].get(str(request["status"]), 0) + 1
+            entry["bytes"] += request["bytes"]
+            entry["latencies"].append(request["latency_ms"])
+            entry["queued_seconds"] += request["queued_ms"] / 1000
+
+            if request.get("rate_limit"):
+                entry["rate_limit"] = request["rate_limit"]
+
+        for entry in endpoints.values():
+            latencies = sorted(entry.pop("latencies"))
+            entry["p50_ms"] = latencies[(len(latencies) - 1) // 2]
+            entry["p99_ms"] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+
+        return {
+            "command": self.command,
+            "seconds": round(self.seconds, 4),
+            "phases": {name: {"seconds": round(seconds, 4), "count": count}
+                       for name, (seconds, count) in self.phases.items()},
+            "requests": len(self.requests),
+            "bytes": sum(request["bytes"] for request in self.requests),
+            "endpoints": endpoints
+        }
+
+    def print_summary(self, file):
+        totals = self.totals()
+
+        print(f"--- {self.command}: {self.seconds:.3f}s", file=file)
+
+        if totals["phases"]:
+            print("phases: " + ", ".join(f"{name} {phase['seconds']:.3f}s ({phase['count']})"
+                                         for name, phase in totals["phases"].items()), file=file)
+
+        print(f"http: {totals['requests']} requests, {totals['bytes'] / 1024:.1f} KiB", file=file)
+
+        for endpoint, entry in sorted(totals["endpoints"].items()):
+            statuses = ", ".join(f"{status} x{count}" for status, count in sorted(entry["statuses"].items()))
+            line = (f"  {endpoint}: {entry['requests']} ({statuses}), {entry['bytes'] / 1024:.1f} KiB, "
+                    f"p50 {entry['p50_ms']:.0f} ms, p99 {entry['p99_ms']:.0f} ms")
+
+            if entry["queued_seconds"] >= 0.001:
+                line += f", queued {entry['queued_seconds']:.2f}s"
+            if entry.get("rate_limit"):
+                line += f", rate limit {entry['rate_limit']['remaining']}/{entry['rate_limit']['limit']} left"
+
+            print(line, file=file)
+
+        if self.profiler is not None:
+            import pstats
+
+            print("profile (top 15 by cumulative time):", file=file)
+            pstats.Stats(self.profiler, stream=file).sort_stats("cumulative").print_stats(15)
+
+    def to_json(self):
+        return {
+            **self.totals(),
+            "started_at": self.epoch,
+            "request_log": [{key: value for key, value in request.items() if key not in ("start", "queued")}
+                            for request in self.requests],
+            "spans": [{"phase": name, "start_ms": round((started - self.started) * 1000, 3),
+                       "ms": round((ended - started) * 1000, 3)} for name, started, ended in self.spans]
+        }
+
+    def chrome_events(self, pid):
+        """Chrome trace 'complete' events: the command, its phases and its requests, each on non-overlapping rows"""
+        def microseconds(instant):
+            return round((self.epoch + instant - self.started) * 1e6)
+
+        events = [
+            {"ph": "M", "name": "process_name", "pid": pid, "tid": 0, "args": {"name": self.command}},
+            {"ph": "X", "name": self.command, "cat": "command", "pid": pid, "tid": 0,
+             "ts": microseconds(self.started), "dur": round(self.seconds * 1e6)}
+        ]
+
+        spans = [(started, ended, name, "phase", {}) for name, started, ended in self.spans]
+        spans += [(request["start"], request["start"] + request["latency_ms"] / 1000,
+                   f"{request['method']} {request['path']}", "http",
+                   {key: request.get(key) for key in ("status", "bytes", "queued_ms", "ttfb_ms", "rate_limit")})
+                  for request in self.requests]
+
+        # greedy row assignment: a span goes on the first row that is free by the time it starts
+        rows = []
+        for started, ended, name, category, args in sorted(spans, key=lambda span: span[0]):
+            row = next((number for number, free_at in enumerate(rows) if free_at <= started), len(rows))
+            if row == len(rows):
+                rows.append(0)
+            rows[row] = ended
+
+            events.append({"ph": "X", "name": name, "cat": category, "pid": pid, "tid": row + 1,
+                           "ts": microseconds(started), "dur": round((ended - started) * 1e6), "args": args})
+
+        return events
+
+
+class Tracer:
+    """Opt-in command timing (--trace or 'timing on'): a summary after each command, optionally saved to a file.
+
+    HTTP requests are picked up by aiohttp trace hooks on the shared session and attributed to the command whose
+    task sent them, so concurrent batch commands each get their own requests.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.profile = False
+        self.path = None
+        self.format = "json"
+        self.traces = []
+
+    def enable(self, profile=False, path=None, trace_format="json"):
+        self.enabled = True
+        self.profile = profile
+
+        if path:
+            self.path = path
+            self.format = trace_format
+
+    def disable(self):
+        self.enabled = False
+        self.write()
+
+    def start(self, command):
+        if not self.enabled:
+            return None
+
+        trace = CommandTrace(command, self.profile)
+        activeTrace.set(trace)
+
+        return trace
+
+    def finish(self, trace):
+        activeTrace.set(None)
+        trace.finish()
+
+        if self.path is not None:
+            self.traces.append(trace)
+
+    def write(self):
+        """Write every finished command's trace to the trace file, if there is one"""
+        if self.path is None or not self.traces:
+            return
+
+        if self.format == "chrome":
+            events = [event for pid, trace in enumerate(self.traces, 1) for event in trace.chrome_events(pid)]
+            document = {"traceEvents": events, "displayTimeUnit": "ms"}
+        else:
+            document = {"commands": [trace.to_json() for trace in self.traces]}
+
+        with open(self.path, "w") as trace_file:
+            json.dump(document, trace_file)
+
+        print(f"Wrote {len(self.traces)} command trace(s) to {self.path}", file=sys.stderr)
+        self.traces = []
+
+    async def on_request_queued(self, session, context, params):
+        trace = activeTrace.get()
+        if trace is None:
+            return
+
+        context.trace = trace
+        context.record = {"method": params.method, "endpoint": RateLimitScheduler.bucket(params.method, params.url),
+                          "path": params.url.path, "query": params.url.query_string, "status": None, "bytes": 0,
+                          "queued": time.perf_counter()}
+
+    async def on_request_start(self, session, context, params):
+        # runs after the rate limit scheduler's hook, so time spent held back by it counts as queued, not latency
+        record = getattr(context, "record", None)
+        if record is not None:
+            record["start"] = time.perf_counter()
+            record["queued_ms"] = round((record["start"] - record["queued"]) * 1000, 3)
+
+    async def on_request_end(self, session, context, params):
+        record = getattr(context, "record", None)
+        if record is None:
+            return
+
+        headers = params.response.headers
+        record["status"] = params.response.status
+        record["ttfb_ms"] = record["latency_ms"] = round((time.perf_counter() - record["start"]) * 1000, 3)
+
+        if "X-Rate-Limit-Limit" in headers:
+            record["rate_limit"] = {"limit": headers.get("X-Rate-Limit-Limit"),
+                                    "remaining": headers.get("X-Rate-Limit-Remaining"),
+                                    "reset": headers.get("X-Rate-Limit-Reset")}
+
+        context.trace.requests.append(record)
+
+    async def on_response_chunk_received(self, session, context, params):
+        # the body is read after on_request_end, so latency runs until its last chunk arrives
+        record = getattr(context, "record", None)
+        if record is not None and "start" in record:
+            record["bytes"] += len(params.chunk)
+            record["latency_ms"] = round((time.perf_counter() - record["start"]) * 1000, 3)
+
+    async def on_request_exception(self, session, context, params):
+        record = getattr(context, "record", None)
+        if record is None:
+            return
+
+        record.setdefault("start", record["queued"])
+        record.setdefault("queued_ms", 0.0)
+        record["status"] = type(params.exception).__name__
+        record["ttfb_ms"] = record["latency_ms"] = round((time.perf_counter() - record["start"]) * 1000, 3)
+
+        context.trace.requests.append(record)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a synchronous block as a phase of the traced command; nested phases are subtracted from the outer one.
+
+    Does nothing when tracing is off. Use record_phase() for a span that awaits, since other tasks run meanwhile.
+    """
+    trace = activeTrace.get()
+    if trace is None:
+        yield
+        return
+
+    outer = trace.nested
+    trace.nested = 0.0
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        ended = time.perf_counter()
+        trace.record_phase(name, started, ended, exclude=trace.nested)
+        trace.nested = outer + ended - started
+
+
+def record_phase(name, started):
+    """Record a phase of the traced command from `started` (a time.perf_counter() value) until now"""
+    trace = activeTrace.get()
+    if trace is not None:
+        trace.record_phase(name, started)
+
+
+class ObjectCache:
+    """LRU + TTL cache of the users, groups and apps looked up by ID in this session, as raw API dicts.
+
+    Users are also found by login. Every successful POST, PUT or DELETE on the shared session drops the objects its
+    URL names (PUT /api/v1/groups/{groupId}/users/{userId} drops both), so a cached lookup never outlives a change
+    made from this CLI, whichever command made it.
+    """
+
+    COLLECTIONS = {"users": "user", "groups": "group", "apps": "app"}
+
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # (org, kind, id) -> (expires at, item), least recently used first; logins are only unique within an org
+        self.entries = collections.OrderedDict()
+        self.aliases = {}
+
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def key(self, kind, identifier):
+        org = current_org()[0]
+        return org, kind, self.aliases.get((org, kind, identifier.lower()), identifier)
+
+    def get(self, kind, identifier):
+        key = self.key(kind, identifier)
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[0] <= time.monotonic():
+            self.drop(key)
+            self.stats["expired"] += 1
+            entry = None
+
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.stats["hits"] += 1
+
+        return entry[1]
+
+    def put(self, kind, item):
+        if self.max_entries < 1 or self.ttl <= 0:
+            return
+
+        key = self.key(kind, item["id"])
+        self.entries[key] = (time.monotonic() + self.ttl, item)
+        self.entries.move_to_end(key)
+
+        login = (item.get("profile") or {}).get("login") if kind == "user" else None
+        if login:
+            self.aliases[(key[0], kind, login.lower())] = item["id"]
+
+        self.trim()
+
+    def trim(self):
+        while len(self.entries) > max(0, self.max_entries):
+            self.drop(next(iter(self.entries)))
+            self.stats["evictions"] += 1
+
+    def drop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+
+        login = (entry[1].get("profile") or {}).get("login") if key[1] == "user" else None
+        if login:
+            self.aliases.pop((key[0], key[1], login.lower()), None)
+
+        return True
+
+    def invalidate(self, kind, identifier):
+        if self.drop(self.key(kind, identifier)):
+            self.stats["invalidations"] += 1
+
+    def invalidate_path(self, path):
+        segments = path.strip("/").split("/")
+        if segments[:2] != ["api", "v1"]:
+            return
+
+        # collections and IDs alternate after the version: users/{id}, groups/{id}/users/{id}, ...
+        for collection, identifier in zip(segments[2::2], segments[3::2]):
+            kind = self.COLLECTIONS.get(collection)
+            if kind is not None:
+                self.invalidate(kind, unquote(identifier))
+
+    def clear(self):
+        self.entries.clear()
+        self.aliases.clear()
+
+    async def on_request_end(self, session, context, params):
+        if params.method not in ("GET", "HEAD", "OPTIONS") and params.response.status < 400:
+            self.invalidate_path(params.url.path)
+
+
+runtime = SessionRuntime()
+tracer = Tracer()
+objectCache = ObjectCache()
+
+oktaOrgUrl = None
+clientId = None
+client = None
+clientConfig = None
+prefetchDepth = 2
+orgIndex = None
+userSchemas = {}
+batchMode = False
+
+# per-command state for batch mode; each concurrently running command sees its own values
+commandOutput = contextvars.ContextVar("commandOutput", default=None)
+commandErrors = contextvars.ContextVar("commandErrors", default=None)
+activeTrace = contextvars.ContextVar("activeTrace", default=None)
+# the saved org profile a command fanned out by 'on' is running against
+activeOrg = contextvars.ContextVar("activeOrg", default=None)
+orgClients = {}
+tokenCacheLock = threading.Lock()
+# one refresh at a time when concurrent batch commands find the session's token expiring
+connectLock = asyncio.Lock()
+
+CLI_HOME = os.path.join(os.path.expanduser("~"), ".okta", "cli")
+
+SCHEMA_TTL = 3600
+
+LOGIN_SCOPES = 'openid offline_access okta.users.manage okta.apps.manage okta.groups.manage okta.schemas.read'
+TOKEN_CACHE = os.path.join(CLI_HOME, "tokens.json")
+ORG_PROFILES = os.path.join(CLI_HOME, "orgs.json")
+TOKEN_EXPIRY_MARGIN = 60
+
+REGISTRATION_ORG = "https://okta-devok12.okta.com"
+REGISTRATION_ID = "reg405abrRAkn0TRf5d6"
+REGISTRATION_TIMEOUT = 600
+CLI_APP_SCOPES = ["okta.apps.manage", "okta.users.manage", "okta.groups.manage", "okta.schemas.read"]
+BULK_CONCURRENCY = 8
+# logins or group names looked up per ?search= query; keeps the query string well within URL limits
+LOOKUP_BATCH = 50
+APPLY_ATTEMPTS = 3
+
+# Okta object IDs, told apart from logins and names in 'group add|remove'
+USER_ID = re.compile(r"00u[0-9A-Za-z]{17}")
+GROUP_ID = re.compile(r"00g[0-9A-Za-z]{17}")
+
+# base profile attributes in the order create user prompts for them
+BASE_PROFILE_ATTRIBUTES = [
+    "firstName", "lastName", "email", "login", "middleName", "honorificPrefix", "honorificSuffix", "title",
+    "displayName", "nickName", "profileUrl", "secondEmail", "mobilePhone", "primaryPhone", "streetAddress", "city",
+    "state", "zipCode", "countryCode", "postalAddress", "preferredLanguage", "locale", "timezone", "userType",
+    "employeeNumber", "costCenter", "organization", "division", "department", "managerId", "manager"
+]
+
+OUTPUT_FORMATS = ("table", "ndjson", "csv", "tsv")
+
+# what tab completion offers after each command: (subcommands, flags, options that take a value)
+COMPLETIONS = {
+    "list": (("user", "group", "app"), ("with-members",),
+             ("output", "fields", "from", "concurrency", "q", "filter", "search")),
+    "create": (("user", "group", "app"), (), ("from", "concurrency", "activate", "results")),
+    "find": (("user", "group", "app"), (), ("limit", "output", "fields")),
+    "sync": (("user", "group", "app"), ("full",), ()),
+    "stats": (("user", "group", "app"), (), ("by", "source", "output", "workers", "top", "q", "filter", "search")),
+    "group": (("add", "remove"), ("yes", "resume"), ("users", "source", "concurrency", "results"))
+}
+
+# option values tab completion offers
+OPTION_VALUES = {"output": OUTPUT_FORMATS, "activate": ("true", "false"), "source": ("api", "index")}
+
+# where a single user, group or app is read by ID
+OBJECT_PATHS = {"user": "/api/v1/users/", "group": "/api/v1/groups/", "app": "/api/v1/apps/"}
+
+# output field names mapped to their path in the API's JSON representation
+LIST_FIELDS = {
+    "user": {
+        "id": "id",
+        "status": "status",
+        "created": "created",
+        "activated": "activated",
+        "lastLogin": "lastLogin",
+        "lastUpdated": "lastUpdated",
+        "login": "profile.login",
+        "firstName": "profile.firstName",
+        "lastName": "profile.lastName",
+        "email": "profile.email"
+    },
+    "group": {
+        "id": "id",
+        "type": "type",
+        "created": "created",
+        "lastUpdated": "lastUpdated",
+        "lastMembershipUpdated": "lastMembershipUpdated",
+        "name": "profile.name",
+        "description": "profile.description"
+    },
+    "app": {
+        "id": "id",
+        "name": "name",
+        "label": "label",
+        "status": "status",
+        "signOnMode": "signOnMode",
+        "created": "created",
+        "lastUpdated": "lastUpdated"
+    }
+}
+
+# group members are users; membership rows are the edges of 'list group all --with-members'
+LIST_FIELDS["member"] = LIST_FIELDS["user"]
+LIST_FIELDS["membership"] = {
+    "groupId": "groupId",
+    "userId": "userId",
+    "login": "login"
+}
+
+# the classic human-readable rows, used by the table output when no --fields are given
+TABLE_FORMATS = {
+    "user": "{firstName} {lastName} - {login} - {id}",
+    "group": "{name} - {id}",
+    "app": "{label} - {id}",
+    "member": "{firstName} {lastName} - {login}",
+    "membership": "{groupId} - {userId} - {login}"
+}
+
+
+def parse_options(line, flags=(), aliases=None):
+    """Split a command line into positional words and a dict of --option values; options named in flags take no value.
+
+    aliases maps short options to their long names, e.g. {"-q": "q"}."""
+    words = []
+    options = {}
+
+    try:
+        tokens = shlex.split(line)
+    except ValueError:
+        # an unbalanced quote is part of a value (e.g. o'brien@example.com), not quoting
+        tokens = line.split()
+
+    position = 0
+
+    while position < len(tokens):
+        token = tokens[position]
+
+        if aliases and token in aliases:
+            token = "--" + aliases[token]
+
+        if token.startswith("--") and len(token) > 2:
+            name = token[2:]
+
+            if "=" in name:
+                name, value = name.split("=", 1)
+            elif name in flags:
+                value = True
+            elif position + 1 < len(tokens):
+                position += 1
+                value = tokens[position]
+            else:
+                value = None
+
+            options[name] = value
+        else:
+            words.append(token)
+
+        position += 1
+
+    return words, options
+
+
+def field_path(kind, name):
+    if "." in name:
+        return name
+
+    fields = LIST_FIELDS[kind]
+    if name in fields:
+        return fields[name]
+
+    # anything else on a user or group is taken to be a (custom) profile attribute
+    if kind in ("user", "group", "member"):
+        return "profile." + name
+
+    return name
+
+
+def field_value(record, path):
+    """Read a dotted JSON path from either a raw API dict or an okta.models object"""
+    value = record
+
+    for key in path.split("."):
+        if value is None:
+            return None
+
+        if isinstance(value, dict):
+            value = value.get(key)
+        else:
+            snake_key = re.sub(r"(?<!^)(?=[A-Z])", "_", key).lower()
+            value = getattr(value, snake_key, getattr(value, key, None))
+
+    if isinstance(value, enum.Enum):
+        value = value.value
+
+    return value
+
+
+class RowWriter:
+    """Streams projected rows as table, NDJSON, CSV or TSV through one buffer instead of a print() per row"""
+
+    def __init__(self, kind, output="table", fields=None, stream=None, flush_bytes=65536):
+        self.output = output
+        self.template = None
+
+        if fields is None:
+            if output == "table":
+                self.template = TABLE_FORMATS[kind]
+                fields = re.findall(r"{(\w+)}", self.template)
+            else:
+                fields = list(LIST_FIELDS[kind].keys())
+
+        self.fields = fields
+        self.paths = [field_path(kind, name) for name in fields]
+        self.stream = stream
+        self.flush_bytes = flush_bytes
+        self.rows = 0
+
+        self.buffer = io.StringIO()
+        self.csv_writer = None
+
+        if output == "csv":
+            self.csv_writer = csv.writer(self.buffer, lineterminator="\n")
+        elif output == "tsv":
+            self.csv_writer = csv.writer(self.buffer, delimiter="\t", lineterminator="\n")
+
+    def open(self):
+        if self.output == "table":
+            self.buffer.write("\n")
+        elif self.csv_writer is not None:
+            self.csv_writer.writerow(self.fields)
+
+    def write(self, record):
+        values = [field_value(record, path) for path in self.paths]
+        self.write_values(values)
+
+    def write_values(self, values):
+        if self.output == "ndjson":
+            self.buffer.write(json.dumps(dict(zip(self.fields, values)), default=str) + "\n")
+        elif self.csv_writer is not None:
+            self.csv_writer.writerow([self._flat(value) for value in values])
+        elif self.template is not None:
+            row = {field: ("" if value is None else value) for field, value in zip(self.fields, values)}
+            self.buffer.write(self.template.format(**row) + "\n")
+        else:
+            self.buffer.write(" - ".join(self._flat(value) for value in values) + "\n")
+
+        self.rows += 1
+
+        if self.buffer.tell() >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        stream = self.stream or sys.stdout
+
+        with phase("output"):
+            stream.write(self.buffer.getvalue())
+            stream.flush()
+
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def close(self):
+        if self.output == "table":
+            self.buffer.write("\n")
+
+        self.flush()
+
+    @staticmethod
+    def _flat(value):
+        if value is None:
+            return ""
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, default=str)
+
+        return str(value)
+
+
+def create_row_writer(kind, options):
+    """Build a RowWriter from --output/--fields, or print why the options are invalid and return None"""
+    output = options.get("output") or "table"
+
+    if output not in OUTPUT_FORMATS:
+        print_error(f"Unknown output format '{output}'; valid options are {', '.join(OUTPUT_FORMATS)}\n")
+        return None
+
+    fields = None
+    if options.get("fields"):
+        fields = [field.strip() for field in options["fields"].split(",") if field.strip()]
+
+    return RowWriter(kind, output, fields)
+
+
+FILTER_OPERATORS = ("eq", "ne", "co", "sw", "ew", "gt", "ge", "lt", "le", "pr")
+
+EQUALITY_OPERATORS = ("eq",)
+RANGE_OPERATORS = ("eq", "gt", "ge", "lt", "le")
+
+# attributes each listing API accepts in ?filter=, with the operators it accepts on each (ranges only on the
+# timestamps); other conditions are evaluated on the client
+SERVER_FILTERS = {
+    "user": {"status": EQUALITY_OPERATORS, "lastUpdated": RANGE_OPERATORS, "id": EQUALITY_OPERATORS,
+             "profile.login": EQUALITY_OPERATORS, "profile.email": EQUALITY_OPERATORS,
+             "profile.firstName": EQUALITY_OPERATORS, "profile.lastName": EQUALITY_OPERATORS},
+    "group": {"id": EQUALITY_OPERATORS, "type": EQUALITY_OPERATORS, "lastUpdated": RANGE_OPERATORS,
+              "lastMembershipUpdated": RANGE_OPERATORS},
+    "app": {"status": EQUALITY_OPERATORS, "name": EQUALITY_OPERATORS, "user.id": EQUALITY_OPERATORS,
+            "group.id": EQUALITY_OPERATORS, "credentials.signing.kid": EQUALITY_OPERATORS}
+}
+
+# listings whose API takes ?search=, an expression over any attribute
+SERVER_SEARCH = ("user", "group")
+
+FILTER_TOKEN = re.compile(r'\s*(?:(\()|(\))|("(?:[^"\\]|\\.)*")|([^\s()]+))')
+
+
+def parse_filter(text):
+    """Parse an Okta filter/search expression into a tree of ("and"|"or", [nodes]), ("not", node) and
+    ("compare", attribute, operator, value) tuples; raises ValueError if it isn't valid"""
+    tokens = []
+    position = 0
+
+    while position < len(text.rstrip()):
+        match = FILTER_TOKEN.match(text, position)
+        if match is None:
+            raise ValueError(f"unexpected text at '{text[position:]}'")
+
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+
+    def value(token):
+        if token.startswith('"'):
+            return json.loads(token)
+        if token in ("true", "false", "null"):
+            return json.loads(token)
+
+        try:
+            return float(token) if "." in token else int(token)
+        except ValueError:
+            raise ValueError(f"'{token}' isn't a quoted string, number, true, false or null")
+
+    def expression(position, operator="or"):
+        operand = term if operator == "or" else factor
+        node, position = operand(position)
+        nodes = [node]
+
+        while position < len(tokens) and tokens[position].lower() == operator:
+            node, position = operand(position + 1)
+            nodes.append(node)
+
+        return (nodes[0] if len(nodes) == 1 else (operator, nodes)), position
+
+    def term(position):
+        return expression(position, "and")
+
+    def factor(position):
+        if position >= len(tokens):
+            raise ValueError("the expression ends too early")
+
+        token = tokens[position]
+
+        if token.lower() == "not":
+            node, position = factor(position + 1)
+            return ("not", node), position
+
+        if token == "(":
+            node, position = expression(position + 1)
+            if position >= len(tokens) or tokens[position] != ")":
+                raise ValueError("missing ')'")
+            return node, position + 1
+
+        if position + 1 >= len(tokens) or tokens[position + 1].lower() not in FILTER_OPERATORS:
+            raise ValueError(f"expected an operator ({', '.join(FILTER_OPERATORS)}) after '{token}'")
+
+        operator = tokens[position + 1].lower()
+        if operator == "pr":
+            return ("compare", token, operator, None), position + 2
+
+        if position + 2 >= len(tokens):
+            raise ValueError(f"missing a value after '{token} {operator}'")
+
+        return ("compare", token, operator, value(tokens[position + 2])), position + 3
+
+    if not tokens:
+        raise ValueError("the expression is empty")
+
+    node, position = expression(0)
+    if position < len(tokens):
+        raise ValueError(f"unexpected '{tokens[position]}'")
+
+    return node
+
+
+def filter_to_string(node):
+    kind = node[0]
+
+    if kind == "compare":
+        attribute, operator, value = node[1:]
+        return f"{attribute} {operator}" if operator == "pr" else f"{attribute} {operator} {json.dumps(value)}"
+    if kind == "not":
+        return f"not ({filter_to_string(node[1])})"
+
+    return f" {kind} ".join(f"({filter_to_string(child)})" if child[0] in ("and", "or") else filter_to_string(child)
+                            for child in node[1])
+
+
+def filter_matches(node, record):
+    """Evaluate a parsed filter against a raw API record; string comparisons ignore case, like Okta's"""
+    kind = node[0]
+
+    if kind == "and":
+        return all(filter_matches(child, record) for child in node[1])
+    if kind == "or":
+        return any(filter_matches(child, record) for child in node[1])
+    if kind == "not":
+        return not filter_matches(node[1], record)
+
+    attribute, operator, expected = node[1:]
+    actual = field_value(record, attribute)
+
+    if operator == "pr":
+        return actual not in (None, "", [], {})
+    if actual is None:
+        return operator == "ne" and expected is not None
+    if isinstance(actual, str) and isinstance(expected, str):
+        actual, expected = actual.lower(), expected.lower()
+
+    # multi-valued attributes match if any value does
+    values = actual if isinstance(actual, list) else [actual]
+
+    try:
+        if operator == "eq":
+            return expected in values
+        if operator == "ne":
+            return expected not in values
+        if operator == "co":
+            return any(isinstance(item, str) and expected in item for item in values)
+        if operator == "sw":
+            return any(isinstance(item, str) and item.startswith(expected) for item in values)
+        if operator == "ew":
+            return any(isinstance(item, str) and item.endswith(expected) for item in values)
+        if operator == "gt":
+            return any(item > expected for item in values)
+        if operator == "ge":
+            return any(item >= expected for item in values)
+        if operator == "lt":
+            return any(item < expected for item in values)
+        if operator == "le":
+            return any(item <= expected for item in values)
+    except TypeError:
+        return False
+
+
+def server_filterable(kind, node):
+    if node[0] in ("and", "or"):
+        return all(server_filterable(kind, child) for child in node[1])
+    if node[0] == "not":
+        return False
+
+    return node[2] in SERVER_FILTERS[kind].get(node[1], ())
+
+
+def list_query(kind, options):
+    """Turn -q/--filter/--search into the listing's query parameters plus a predicate for what the API can't do.
+
+    --filter conditions the API supports go to ?filter=. The rest of a top-level 'and' joins --search, which goes to
+    ?search= where the API has it; anything left is checked on each record as the pages stream past. Returns
+    (query parameters, predicate or None) and raises ValueError for an expression that can't be parsed.
+    """
+    query_parameters = {'limit': '200'}
+    search = [parse_filter(options["search"])] if options.get("search") else []
+
+    if options.get("q"):
+        query_parameters['q'] = options["q"]
+
+    pushed = []
+
+    if options.get("filter"):
+        node = parse_filter(options["filter"])
+        conditions = node[1] if node[0] == "and" else [node]
+
+        pushed = [condition for condition in conditions if server_filterable(kind, condition)]
+        search += [condition for condition in conditions if not server_filterable(kind, condition)]
+
+    # the API takes either filter or search, and search can express everything filter can
+    if search and kind in SERVER_SEARCH:
+        search = pushed + search
+        pushed = []
+
+    if pushed:
+        query_parameters['filter'] = filter_to_string(pushed[0] if len(pushed) == 1 else ("and", pushed))
+
+    if not search:
+        return query_parameters, None
+
+    node = search[0] if len(search) == 1 else ("and", search)
+
+    if kind in SERVER_SEARCH:
+        query_parameters['search'] = filter_to_string(node)
+        return query_parameters, None
+
+    print(f"Filtering on '{filter_to_string(node)}' locally, since the {kind}s API can't", file=sys.stderr)
+    return query_parameters, lambda record: filter_matches(node, record)
+
+
+def error_message(err):
+    return getattr(err, "message", None) or str(err)
+
+
+def print_error(err, file=None):
+    """Print an error for the current command; in batch mode this also marks the command as failed"""
+    message = err if isinstance(err, str) else error_message(err)
+    print(message, file=file)
+
+    errors = commandErrors.get()
+    if errors is not None:
+        errors.append(message.strip())
+
+
+class InputRequired(Exception):
+    pass
+
+
+def ask(prompt):
+    """input() for command prompts; batch commands can't be answered interactively, so they fail instead"""
+    if batchMode:
+        raise InputRequired(f"'{prompt.strip()}' needs interactive input, which batch mode can't provide")
+
+    return input(prompt)
+
+
+class CommandOutput:
+    """sys.stdout stand-in that sends each batch command's output to its own buffer, so concurrent commands don't mix"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = commandOutput.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        if commandOutput.get() is None:
+            self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+async def list_raw(path, query_parameters):
+    """Fetch the first page of a listing as plain JSON dicts, skipping okta.models hydration.
+
+    Returns the same (items, resp, err) triple as the SDK's list_* calls; resp.next() keeps returning plain dicts.
+    """
+    executor = current_org()[2].get_request_executor()
+
+    url = path
+    if query_parameters:
+        url += "?" + urlencode(query_parameters)
+
+    started = time.perf_counter()
+
+    request, err = await executor.create_request(method='GET', url=url, body={}, headers={}, oauth=False)
+    if err is not None:
+        return None, None, err
+
+    resp, err = await executor.execute(request)
+    record_phase("fetch", started)
+
+    if err is not None:
+        return None, resp, err
+
+    return resp.get_body(), resp, None
+
+
+def current_org():
+    """(org URL, client ID, OktaClient) for the running command: the saved profile 'on' is running it against,
+    otherwise the org the CLI logged into"""
+    profile = activeOrg.get()
+
+    if profile is None:
+        return oktaOrgUrl, clientId, client
+
+    return profile["org"], profile["client_id"], profile.get("client")
+
+
+async def connect():
+    """Build the OktaClient for the logged-in org the first time a command needs it, and rebuild it whenever the
+    token cache has a newer token: one refreshed here because the old one is about to expire, or one another CLI
+    process refreshed. Raises RuntimeError if the token expired and can't be refreshed."""
+    global client
+
+    if clientConfig is None:
+        return client
+
+    async with connectLock:
+        cached = load_token_cache().get(token_cache_key())
+
+        if cached is not None and cached["expires_at"] - TOKEN_EXPIRY_MARGIN <= time.time():
+            token = await cached_access_token()
+            if token is None:
+                raise RuntimeError("The session's access token has expired and couldn't be refreshed; start the CLI "
+                                   "with -l (or --org) again to log in")
+        else:
+            token = cached["access_token"] if cached is not None else clientConfig["token"]
+
+        if client is None or token != clientConfig["token"]:
+            from okta.client import Client as OktaClient
+
+            clientConfig["token"] = token
+            client = await runtime.attach(OktaClient(clientConfig))
+
+    return client
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(description="Okta Command Line Interface")
+
+    parser.add_argument('-l', '--login', metavar="", help='Log into your Okta org; specify your org URL', required=False)
+    parser.add_argument('-c', '--clientId', metavar="", help="OIDC client ID for CLI app; specify valid client ID", required=False)
+    parser.add_argument('--org', metavar="", help="Log into a saved org profile (see 'orgs') instead of -l/-c",
+                        required=False)
+    parser.add_argument('-r', '--register', metavar="", help="Register for an Okta Developer org; specify your "
+                                                             "developer email address", required=False)
+    parser.add_argument('-b', '--batch', metavar="", help="Run the commands in a script file ('-' for stdin) instead of "
+                                                          "the interactive prompt", required=False)
+    parser.add_argument('-j', '--jobs', metavar="", type=int, default=1,
+                        help="Number of batch commands to run at once (default 1); a 'wait' line in the script "
+                             "waits for everything before it", required=False)
+    parser.add_argument('--batch-format', metavar="", choices=("jsonl", "text"), default="jsonl",
+                        help="Batch results as one JSON object per command (jsonl) or plain command output (text)",
+                        required=False)
+    parser.add_argument('-p', '--prefetch', metavar="", type=int, default=2,
+                        help="Number of pages to fetch ahead of output in 'list * all' (0 disables prefetch)",
+                        required=False)
+    parser.add_argument('--cache-size', metavar="", type=int, default=1000,
+                        help="Number of users, groups and apps looked up by ID to keep in memory (0 disables the "
+                             "cache)", required=False)
+    parser.add_argument('--cache-ttl', metavar="", type=float, default=300,
+                        help="Seconds a cached lookup stays fresh (default 300)", required=False)
+    parser.add_argument('-t', '--trace', metavar="", nargs="?", const="",
+                        help="Time every command (like 'timing on'); optionally save the traces to this file",
+                        required=False)
+    parser.add_argument('--trace-format', metavar="", choices=("json", "chrome"), default="json",
+                        help="Trace file format: json, or chrome for chrome://tracing and Perfetto", required=False)
+    parser.add_argument('--profile', action="store_true", help="Run each command under cProfile (implies --trace)",
+                        required=False)
+    return parser
+
+
+async def prefetch_pages(page, resp, err, depth=None):
+    """Yield (page, error) for a paginated listing while the following pages are fetched in the background.
+
+    At most `depth` pages are held in memory ahead of the consumer, so memory stays flat however large the listing.
+    """
+    if depth is None:
+        depth = prefetchDepth
+
+    if err is not None:
+        yield None, err
+        return
+
+    if depth < 1:
+        yield page, None
+        while resp.has_next():
+            started = time.perf_counter()
+            page, err = await resp.next()
+            record_phase("fetch", started)
+            yield page, err
+            if err is not None:
+                return
+        return
+
+    buffer = asyncio.Queue(maxsize=depth)
+
+    async def fetch():
+        try:
+            while resp.has_next():
+                started = time.perf_counter()
+                next_page, next_err = await resp.next()
+                record_phase("fetch", started)
+                await buffer.put((next_page, next_err))
+                if next_err is not None:
+                    break
+        except Exception as error:
+            await buffer.put((None, error))
+        await buffer.put(None)
+
+    fetcher = asyncio.ensure_future(fetch())
+
+    try:
+        # give the fetcher a turn so page 2 is in flight while page 1 is rendered
+        await asyncio.sleep(0)
+        yield page, None
+
+        while True:
+            # time the consumer spends waiting here is network-bound; with enough read-ahead it is close to zero
+            started = time.perf_counter()
+            entry = await buffer.get()
+            record_phase("wait", started)
+
+            if entry is None:
+                break
+
+            await asyncio.sleep(0)
+            yield entry
+
+            if entry[1] is not None:
+                break
+    finally:
+        fetcher.cancel()
+
+
+async def list_all(kind, path, options):
+    """Stream every page of a listing through a RowWriter, selecting with -q/--filter/--search (see list_query)"""
+    writer = create_row_writer(kind, options)
+    if writer is None:
+        return
+
+    try:
+        query_parameters, predicate = list_query(kind, options)
+    except ValueError as error:
+        print_error(f"Could not parse the filter: {error}\n")
+        return
+
+    writer.open()
+    items, resp, err = await list_raw(path, query_parameters)
+
+    async for items, err in prefetch_pages(items, resp, err):
+        if err is not None:
+            writer.flush()
+            print_error(err)
+            break
+
+        with phase("render"):
+            for item in items if predicate is None else filter(predicate, items):
+                writer.write(item)
+
+        writer.flush()
+
+    writer.close()
+
+
+async def list_group_members(group_id, writer, depth=None):
+    """Stream every page of a group's members to writer; returns (member count, err)"""
+    members, resp, err = await list_raw(f'/api/v1/groups/{group_id}/users', {'limit': '200'})
+    count = 0
+
+    async for members, err in prefetch_pages(members, resp, err, depth):
+        if err is not None:
+            return count, err
+
+        with phase("render"):
+            for member in members:
+                writer.write(member)
+
+        writer.flush()
+        count += len(members)
+
+    return count, None
+
+
+async def list_all_groups(query_parameters=None, predicate=None):
+    """Every group in the org (or those the query and predicate select) as raw JSON, one at a time"""
+    groups, resp, err = await list_raw('/api/v1/groups', query_parameters or {'limit': '200'})
+
+    async for groups, err in prefetch_pages(groups, resp, err):
+        if err is not None:
+            raise RuntimeError(error_message(err))
+
+        for group in groups:
+            if predicate is None or predicate(group):
+                yield group
+
+
+class MembershipWriter:
+    """Adapts member records into (group, user) edge rows of a shared RowWriter"""
+
+    def __init__(self, writer, group_id):
+        self.writer = writer
+        self.group_id = group_id
+
+    def write(self, member):
+        self.writer.write({"groupId": self.group_id, "userId": member["id"],
+                           "login": (member.get("profile") or {}).get("login")})
+
+    def flush(self):
+        self.writer.flush()
+
+
+async def export_group_memberships(options, selected=None, duplicates=0):
+    """Stream group_id,user_id edges for every group (or the selected ones), fetching several groups' members at once.
+
+    A whole-org export defaults to CSV; selected groups keep the usual table default, like any other lookup."""
+    if selected is None:
+        options.setdefault("output", "csv")
+
+    writer = create_row_writer("membership", options)
+    if writer is None:
+        return
+
+    if selected is None:
+        try:
+            query_parameters, predicate = list_query("group", options)
+        except ValueError as error:
+            print_error(f"Could not parse the filter: {error}\n")
+            return
+
+        selected = list_all_groups(query_parameters, predicate)
+
+    concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+    failures = []
+    groups = 0
+    edges = 0
+
+    async def export(group):
+        # one page of read-ahead per group keeps memory flat however many groups are in flight
+        return await list_group_members(group["id"], MembershipWriter(writer, group["id"]), depth=1)
+
+    started = time.perf_counter()
+    writer.open()
+
+    try:
+        async for group, (count, err) in ordered_map(selected, export, concurrency):
+            groups += 1
+            edges += count
+
+            if err is not None:
+                failures.append((group["id"], error_message(err)))
+    except RuntimeError as error:
+        failures.append(("groups", str(error)))
+
+    writer.close()
+
+    # keep the summary out of machine-readable output
+    summary = sys.stdout if writer.output == "table" else sys.stderr
+    for group_id, message in failures:
+        print_error(f"Failed to list members of {group_id}: {message}", file=summary)
+
+    skipped = f", {duplicates} duplicate(s) skipped" if duplicates else ""
+    print(f"Exported {edges} memberships of {groups} groups{skipped} in {time.perf_counter() - started:.1f}s",
+          file=summary)
+
+
+def read_identifiers(identifiers, path=None):
+    """The identifiers given plus those in a file (one per line), each kept once in first-seen order.
+
+    Returns (identifiers, number of duplicates dropped)."""
+    identifiers = list(identifiers)
+
+    if path:
+        with open(path) as identifiers_file:
+            identifiers += [line.strip() for line in identifiers_file
+                            if line.strip() and not line.startswith("#")]
+
+    unique = list(dict.fromkeys(identifiers))
+    return unique, len(identifiers) - len(unique)
+
+
+async def get_raw(path):
+    """Fetch one object as a plain JSON dict; returns (item, err)"""
+    item, resp, err = await list_raw(path, None)
+    return item, err
+
+
+async def get_object(kind, identifier):
+    """A user, group or app by ID (or a user by login) as a raw dict, from the session's cache if it's there.
+
+    Returns (item, err)."""
+    item = objectCache.get(kind, identifier)
+    if item is not None:
+        return item, None
+
+    item, err = await get_raw(OBJECT_PATHS[kind] + quote(identifier, safe="@"))
+    if err is None:
+        objectCache.put(kind, item)
+
+    return item, err
+
+
+async def list_by_ids(kind, identifiers, options):
+    """Look up many users, groups or apps at once and stream them in input order.
+
+    IDs come from the command line and/or --from file; each distinct one is fetched once, up to --concurrency at a
+    time. Users can also be given by login. Groups are listed as membership rows, like one group's 'list group'.
+    """
+    try:
+        identifiers, duplicates = read_identifiers(identifiers, options.get("from"))
+    except OSError as error:
+        print_error(f"Could not read {options['from']}: {error}\n")
+        return
+
+    if kind == "group":
+        await export_group_memberships(options, [{"id": identifier} for identifier in identifiers], duplicates)
+        return
+
+    writer = create_row_writer(kind, options)
+    if writer is None:
+        return
+
+    concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+
+    # keep the summary and per-ID errors out of machine-readable output
+    summary = sys.stdout if writer.output == "table" else sys.stderr
+    found = 0
+
+    async def fetch(identifier):
+        return await get_object(kind, identifier)
+
+    started = time.perf_counter()
+    writer.open()
+
+    async for identifier, (item, err) in ordered_map(identifiers, fetch, concurrency):
+        if err is not None:
+            writer.flush()
+            print_error(f"{identifier}: {error_message(err).strip()}", file=summary)
+            continue
+
+        writer.write(item)
+        found += 1
+
+    writer.close()
+
+    skipped = f", {duplicates} duplicate(s) skipped" if duplicates else ""
+    print(f"Found {found} of {len(identifiers)} {kind}s{skipped} in {time.perf_counter() - started:.1f}s",
+          file=summary)
+
+
+class OrgIndex:
+    """Local SQLite mirror of an org's users, groups and apps for offline lookups"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            login TEXT COLLATE NOCASE,
+            display_name TEXT COLLATE NOCASE,
+            first_name TEXT COLLATE NOCASE,
+            last_name TEXT COLLATE NOCASE,
+            email TEXT COLLATE NOCASE,
+            status TEXT,
+            last_updated TEXT,
+            body TEXT
+        );
+        CREATE INDEX IF NOT EXISTS users_login ON users (login);
+        CREATE INDEX IF NOT EXISTS users_display_name ON users (display_name);
+        CREATE INDEX IF NOT EXISTS users_first_name ON users (first_name);
+        CREATE INDEX IF NOT EXISTS users_last_name ON users (last_name);
+
+        CREATE TABLE IF NOT EXISTS groups (
+            id TEXT PRIMARY KEY,
+            name TEXT COLLATE NOCASE,
+            type TEXT,
+            last_updated TEXT,
+            body TEXT
+        );
+        CREATE INDEX IF NOT EXISTS groups_name ON groups (name);
+
+        CREATE TABLE IF NOT EXISTS apps (
+            id TEXT PRIMARY KEY,
+            label TEXT COLLATE NOCASE,
+            name TEXT,
+            status TEXT,
+            last_updated TEXT,
+            body TEXT
+        );
+        CREATE INDEX IF NOT EXISTS apps_label ON apps (label);
+
+        CREATE TABLE IF NOT EXISTS sync_state (
+            kind TEXT PRIMARY KEY,
+            watermark TEXT,
+            synced_at REAL
+        );
+    """
+
+    # kind: (table, listing path, supports lastUpdated filter, columns to match by prefix)
+    KINDS = {
+        "user": ("users", "/api/v1/users", True, ("login", "display_name", "first_name", "last_name", "email")),
+        "group": ("groups", "/api/v1/groups", True, ("name",)),
+        "app": ("apps", "/api/v1/apps", False, ("label",))
+    }
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.db = sqlite3.connect(path)
+        self.db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def row(kind, item):
+        profile = item.get("profile") or {}
+
+        if kind == "user":
+            first_name = profile.get("firstName")
+            last_name = profile.get("lastName")
+            display_name = " ".join(name for name in (first_name, last_name) if name)
+
+            return (item["id"], profile.get("login"), display_name, first_name, last_name, profile.get("email"),
+                    item.get("status"), item.get("lastUpdated"), json.dumps(item))
+        elif kind == "group":
+            return (item["id"], profile.get("name"), item.get("type"), item.get("lastUpdated"), json.dumps(item))
+
+        return (item["id"], item.get("label"), item.get("name"), item.get("status"), item.get("lastUpdated"),
+                json.dumps(item))
+
+    def watermark(self, kind):
+        found = self.db.execute("SELECT watermark FROM sync_state WHERE kind = ?", (kind,)).fetchone()
+        return found[0] if found else None
+
+    async def sync(self, kind, full=False):
+        """Mirror one object type; returns (rows written, whether the sync was incremental)"""
+        table, path, incremental, columns = self.KINDS[kind]
+
+        watermark = None if full or not incremental else self.watermark(kind)
+        query_parameters = {'limit': '200'}
+        if watermark:
+            query_parameters['filter'] = f'lastUpdated gt "{watermark}"'
+
+        newest = watermark
+        written = 0
+
+        items, resp, err = await list_raw(path, query_parameters)
+
+        # the whole sync is one transaction, so an interrupted run never advances the watermark
+        with self.db:
+            if watermark is None:
+                self.db.execute(f"DELETE FROM {table}")
+
+            async for items, err in prefetch_pages(items, resp, err):
+                if err is not None:
+                    raise RuntimeError(error_message(err))
+
+                with phase("index"):
+                    rows = [self.row(kind, item) for item in items]
+                    if rows:
+                        placeholders = ", ".join("?" * len(rows[0]))
+                        self.db.executemany(f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows)
+
+                for item in items:
+                    if item.get("lastUpdated") and (newest is None or item["lastUpdated"] > newest):
+                        newest = item["lastUpdated"]
+
+                written += len(rows)
+
+            self.db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)", (kind, newest, time.time()))
+
+        return written, watermark is not None
+
+    def find(self, kind, text, limit=50):
+        table, path, incremental, columns = self.KINDS[kind]
+
+        pattern = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        clauses = [f"{column} LIKE ? ESCAPE '\\'" for column in columns]
+        parameters = [pattern] * len(columns)
+
+        # IDs are case sensitive, so match them with a range scan on the primary key
+        clauses.append("(id >= ? AND id < ?)")
+        parameters += [text, text + "\uffff"]
+
+        query = f"SELECT body FROM {table} WHERE {' OR '.join(clauses)} LIMIT ?"
+
+        return [json.loads(body) for body, in self.db.execute(query, parameters + [limit])]
+
+    def lookup(self, kind, names):
+        """Every indexed object whose login, group name or app label is one of names, in any case"""
+        table, path, incremental, columns = self.KINDS[kind]
+        names = list(names)
+        found = []
+
+        # stay under SQLite's limit on bound parameters
+        for start in range(0, len(names), 500):
+            chunk = names[start:start + 500]
+            query = f"SELECT body FROM {table} WHERE {columns[0]} IN ({', '.join('?' * len(chunk))})"
+            found += [json.loads(body) for body, in self.db.execute(query, chunk)]
+
+        return found
+
+    def bodies(self, kind, batch=1000):
+        """Every indexed object's JSON text, in batches, without reading the whole table into memory"""
+        cursor = self.db.execute(f"SELECT body FROM {self.KINDS[kind][0]}")
+
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+
+            yield [body for body, in rows]
+
+    def names(self, kind, prefix, limit=100):
+        """Logins, group names or app labels starting with prefix in any case, by a range scan of the NOCASE index"""
+        table, path, incremental, columns = self.KINDS[kind]
+        column = columns[0]
+
+        query = f"SELECT {column} FROM {table} WHERE {column} >= ? AND {column} < ? ORDER BY {column} LIMIT ?"
+        return [name for name, in self.db.execute(query, (prefix, prefix + "\uffff", limit))]
+
+    def count(self, kind):
+        table = self.KINDS[kind][0]
+        return self.db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+
+def org_slug(org_url=None):
+    return re.sub(r"[^A-Za-z0-9.-]+", "_", org_url or current_org()[0])
+
+
+def org_index_path():
+    return os.path.join(CLI_HOME, "index", org_slug() + ".db")
+
+
+def org_index():
+    """The OrgIndex for the org this session is logged into, opened on first use"""
+    global orgIndex
+
+    path = org_index_path()
+
+    if orgIndex is None or orgIndex.path != path:
+        orgIndex = OrgIndex(path)
+
+    return orgIndex
+
+
+class CompletionIndex:
+    """Logins, group names and app labels for tab completion, as sorted lowercase arrays searched with bisect.
+
+    The arrays are loaded from the local index on a background thread (with its own SQLite connection) the first
+    time they're needed, and again whenever the index file changes, e.g. after a 'sync'. Completion never waits:
+    until the first load is done it range-scans the index, and during a reload it uses the previous arrays.
+    Nothing here calls the org.
+    """
+
+    def __init__(self):
+        # (index path, index version, {kind: (sorted lowercased names, {lowercased name: name} where case differs)})
+        self.loaded = (None, None, {})
+        self.loading = False
+
+    def refresh(self):
+        """Start a background load if the index changed since the last one; False if there's no index yet"""
+        path = org_index_path()
+
+        try:
+            version = os.stat(path).st_mtime_ns
+        except OSError:
+            return False
+
+        if self.loaded[:2] != (path, version) and not self.loading:
+            self.loading = True
+            threading.Thread(target=self.load, args=(path, version), daemon=True).start()
+
+        return True
+
+    def load(self, path, version):
+        try:
+            db = sqlite3.connect(path)
+
+            try:
+                names = {}
+
+                for kind, (table, listing, incremental, columns) in OrgIndex.KINDS.items():
+                    keys = []
+                    cased = {}
+
+                    for name, in db.execute(f"SELECT {columns[0]} FROM {table} WHERE {columns[0]} IS NOT NULL"):
+                        key = name.lower()
+                        keys.append(key)
+                        if key != name:
+                            cased[key] = name
+
+                    keys.sort()
+                    names[kind] = (keys, cased)
+            finally:
+                db.close()
+
+            # one assignment, so a completion running meanwhile sees either the old arrays or the new ones
+            self.loaded = (path, version, names)
+        except sqlite3.Error:
+            pass
+        finally:
+            self.loading = False
+
+    def complete(self, kind, prefix, limit=100):
+        """Up to limit logins, group names or app labels that start with prefix, in any case"""
+        if not self.refresh():
+            return []
+
+        path, version, names = self.loaded
+        if path != org_index_path():
+            return org_index().names(kind, prefix, limit)
+
+        keys, cased = names[kind]
+        prefix = prefix.lower()
+
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + "\uffff", start, min(len(keys), start + limit))
+
+        return list(dict.fromkeys(cased.get(key, key) for key in keys[start:end]))
+
+
+completionIndex = CompletionIndex()
+
+
+def completion_context(line, endidx, flags=()):
+    """Split a line being completed into (positional words before the argument, all words before it, the argument
+    so far, its opening quote or "", where it starts). Quoted arguments may contain spaces: 'list group "Sales Te'."""
+    start = 0
+    quote = ""
+
+    for position, character in enumerate(line[:endidx]):
+        if quote:
+            if character == quote:
+                quote = ""
+        elif character in "\"'":
+            quote = character
+        elif character.isspace():
+            start = position + 1
+
+    try:
+        words = shlex.split(line[:start])[1:]
+    except ValueError:
+        words = line[:start].split()[1:]
+
+    # drop options and their values, like parse_options does
+    positional = []
+    skip = False
+    for word in words:
+        if skip:
+            skip = False
+        elif word.startswith("-"):
+            skip = word.lstrip("-") not in flags
+        else:
+            positional.append(word)
+
+    argument = line[start:endidx]
+    opening = argument[:1] if argument[:1] in ("\"", "'") else ""
+
+    return positional, words, argument[len(opening):], opening, start
+
+
+def completions(candidates, opening, start, begidx):
+    """What readline should put in place of line[begidx:endidx] for each candidate for the argument at start"""
+    replacements = []
+
+    for candidate in candidates:
+        if opening:
+            candidate = opening + candidate + opening
+        elif any(character.isspace() for character in candidate):
+            candidate = f'"{candidate}"'
+
+        replacements.append(candidate[begidx - start:])
+
+    return replacements
 
-import okta.models as models
-from okta.client import Client as OktaClient
 
-loop = asyncio.get_event_loop()
+async def api_request(method, path, body=None, headers=None):
+    """Send one request with the client's credentials straight through the shared session.
 
-oktaOrgUrl = None
-clientId = None
-client = OktaClient()
+    For calls that need per-request headers (e.g. If-None-Match); the SDK's HTTP client merges request headers
+    into its defaults, so they would stick to every later request. Returns (status, response headers, JSON body).
+    """
+    session = await runtime.open()
+    okta_client = current_org()[2]
 
+    url = path if path.startswith("http") else okta_client.get_base_url() + path
+    request_headers = {**okta_client.get_default_headers(), **(headers or {})}
 
-def create_parser():
-    parser = argparse.ArgumentParser(description="Okta Command Line Interface")
+    if body is not None:
+        request_headers["Content-Type"] = "application/json"
+        body = json.dumps(body)
+
+    async with session.request(method, url, data=body, headers=request_headers) as response:
+        text = await response.text()
+        return response.status, response.headers, json.loads(text) if text else None
+
+
+async def http_request(method, url, form=None, body=None):
+    """Send one request outside the SDK (OAuth and registration endpoints) through the shared session, so login
+    and registration get the same keep-alive pool, gzip and rate limit pacing as everything else.
+
+    Sends `form` form-encoded or `body` as JSON. Returns (status, JSON body); status is None if the server could
+    not be reached, with the reason as the body's error_description.
+    """
+    session = await runtime.open()
+    headers = {"Accept": "application/json"}
+
+    if body is not None:
+        headers["Content-Type"] = "application/json"
+        body = json.dumps(body)
+
+    import aiohttp
+
+    try:
+        async with session.request(method, url, data=form if form is not None else body, headers=headers) as response:
+            text = await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        return None, {"error_description": str(error) or type(error).__name__}
+
+    try:
+        return response.status, json.loads(text) if text else {}
+    except ValueError:
+        return response.status, {"error_description": text}
+
+
+def user_schema_attributes(schema):
+    """Work out the (attribute, title) pairs create user prompts for, split into required and optional"""
+    required = []
+    optional = []
+
+    base = schema["definitions"]["base"]
+    for attribute in BASE_PROFILE_ATTRIBUTES:
+        schema_property = base["properties"].get(attribute)
+        if schema_property is None:
+            continue
+
+        if schema_property.get("required") or attribute in base.get("required", []):
+            required.append((attribute, schema_property.get("title", attribute)))
+        else:
+            optional.append((attribute, schema_property.get("title", attribute)))
+
+    custom = schema["definitions"].get("custom", {})
+    for attribute, schema_property in custom.get("properties", {}).items():
+        if schema_property.get("required") or attribute in custom.get("required", []):
+            required.append((attribute, schema_property.get("title", attribute)))
+        else:
+            optional.append((attribute, schema_property.get("title", attribute)))
+
+    return {"required": required, "optional": optional}
+
+
+async def user_schema(refresh=False):
+    """The org's default user schema with its required/optional attributes, cached in memory and on disk.
+
+    Within SCHEMA_TTL the cached copy is used without a request; after that it is revalidated with the ETag.
+    Returns (entry, err), where entry holds "schema", "required", "optional", "etag" and "fetched_at".
+    """
+    path = os.path.join(CLI_HOME, "cache", org_slug() + "-user-schema.json")
+
+    # one entry per org, since 'on' can plan against several orgs at once
+    cached = userSchemas.get(path)
+
+    if cached is None:
+        try:
+            with open(path) as cache_file:
+                cached = json.load(cache_file)
+                cached["path"] = path
+                userSchemas[path] = cached
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if cached is not None and not refresh and time.time() - cached["fetched_at"] < SCHEMA_TTL:
+        return cached, None
+
+    headers = {}
+    if cached is not None and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+
+    started = time.perf_counter()
+
+    try:
+        status, response_headers, body = await api_request('GET', '/api/v1/meta/schemas/user/default',
+                                                           headers=headers)
+        record_phase("schema", started)
+    except Exception as error:
+        if cached is None:
+            return None, error
+
+        # a stale schema is still better than none when the org can't be reached
+        return cached, None
+
+    if status == 304:
+        cached["fetched_at"] = time.time()
+    elif 200 <= status <= 299:
+        cached = {
+            "path": path,
+            "etag": response_headers.get("ETag"),
+            "fetched_at": time.time(),
+            "schema": body,
+            **user_schema_attributes(body)
+        }
+    else:
+        message = body.get("errorSummary") if isinstance(body, dict) else None
+        return None, RuntimeError(message or f"Failed to load user schema (HTTP {status})")
+
+    userSchemas[path] = cached
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as cache_file:
+        json.dump({key: value for key, value in cached.items() if key != "path"}, cache_file)
+
+    return cached, None
+
+
+async def iterate(items):
+    """Iterate a plain or an async iterable"""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def ordered_map(items, worker, concurrency):
+    """Run worker(item) over items with at most `concurrency` calls in flight, yielding (item, result) in input order.
+
+    items may be an async iterable, so a paginated listing can feed the pool while it is still being fetched.
+    """
+    pending = collections.deque()
+
+    try:
+        async for item in iterate(items):
+            pending.append((item, asyncio.ensure_future(worker(item))))
+
+            if len(pending) >= concurrency:
+                item, task = pending.popleft()
+                yield item, await task
+
+        while pending:
+            item, task = pending.popleft()
+            yield item, await task
+    finally:
+        for item, task in pending:
+            task.cancel()
+
+
+def read_records(path):
+    """Yield (line number, record) from a CSV file with a header row, or from a JSONL file"""
+    if path.endswith((".jsonl", ".ndjson", ".json")):
+        # utf-8-sig drops the byte order mark Excel and some editors write, which would otherwise stick to the
+        # first header or record
+        with open(path, encoding="utf-8-sig") as records:
+            for number, record in enumerate(records, 1):
+                if record.strip():
+                    yield number, json.loads(record)
+    else:
+        with open(path, newline="", encoding="utf-8-sig") as records:
+            # line 1 is the header
+            for number, record in enumerate(csv.DictReader(records), 2):
+                yield number, record
+
+
+def profile_attribute_names(schema):
+    """Map every accepted spelling of a profile attribute (name, snake_case name or title, any case) to its name"""
+    names = {}
+
+    for attribute, title in schema["required"] + schema["optional"]:
+        snake_name = re.sub(r"(?<!^)(?=[A-Z])", "_", attribute)
+
+        for spelling in (attribute, snake_name, title):
+            names[spelling.lower()] = attribute
+
+    return names
+
+
+def user_profile_from_record(record, attribute_names, required):
+    """Map a CSV row or JSONL object onto profile attributes; returns (profile, list of problems)"""
+    if isinstance(record.get("profile"), dict):
+        record = record["profile"]
+
+    profile = {}
+    problems = []
+
+    for column, value in record.items():
+        if value is None or value == "":
+            continue
+
+        attribute = attribute_names.get(str(column).strip().lower())
+        if attribute is None:
+            problems.append(f"unknown attribute '{column}'")
+        else:
+            profile[attribute] = value
+
+    # like the interactive prompt, the email doubles as the username when no login is given
+    if "login" not in profile and "email" in profile:
+        profile["login"] = profile["email"]
+
+    for attribute, title in required:
+        if attribute not in profile:
+            problems.append(f"missing required attribute '{attribute}' ({title})")
+
+    return profile, problems
+
+
+async def create_users_from_file(path, options):
+    schema, err = await user_schema()
+    if err is not None:
+        print_error(err)
+        print("")
+        return
+
+    attribute_names = profile_attribute_names(schema)
+
+    # validate the whole file before creating anyone, so a bad row can't leave a half-imported wave behind
+    total = 0
+    invalid = 0
+
+    try:
+        with phase("validate"):
+            for number, record in read_records(path):
+                total += 1
+                profile, problems = user_profile_from_record(record, attribute_names, schema["required"])
+
+                if problems:
+                    invalid += 1
+                    if invalid <= 20:
+                        print(f"Line {number}: {'; '.join(problems)}")
+    except (OSError, ValueError) as error:
+        print_error(f"Could not read {path}: {error}\n")
+        return
+
+    if invalid:
+        print_error(f"\n{invalid} of {total} records are invalid; no users were created\n")
+        return
+
+    concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+    query_parameters = {'activate': 'false' if options.get("activate") in ("false", "no") else 'true'}
+
+    async def create(entry):
+        number, record = entry
+        profile, problems = user_profile_from_record(record, attribute_names, schema["required"])
+
+        try:
+            user, resp, err = await client.create_user({'profile': profile}, query_parameters)
+        except Exception as error:
+            user, err = None, error
+
+        result = {"line": number, "login": profile.get("login")}
+        if err is not None:
+            result.update({"status": "failed", "error": error_message(err)})
+        else:
+            result.update({"status": "created", "id": user.id})
+
+        return result
+
+    try:
+        results_file = open(options["results"], "w") if options.get("results") else None
+    except OSError as error:
+        print_error(f"Could not write {options['results']}: {error}\n")
+        return
+
+    created = 0
+    failed = 0
+
+    print(f"\nCreating {total} users from {path} ({concurrency} at a time)...")
+    started = time.perf_counter()
+
+    try:
+        async for entry, result in ordered_map(read_records(path), create, concurrency):
+            if result["status"] == "created":
+                created += 1
+            else:
+                failed += 1
+                print_error(f"Line {result['line']} ({result['login']}): {result['error']}")
+
+            if results_file is not None:
+                results_file.write(json.dumps(result) + "\n")
+    finally:
+        if results_file is not None:
+            results_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nCreated {created} of {total} users ({failed} failed) in {elapsed:.1f}s - "
+          f"{created / elapsed if elapsed else 0:.1f} users/sec\n")
+
+
+def read_desired_state(path):
+    """Load a desired-state file: a JSON object with optional "users", "groups" and "apps" lists"""
+    with open(path) as state_file:
+        state = json.load(state_file)
+
+    sections = ("users", "groups", "apps")
+    if not isinstance(state, dict) or not all(isinstance(state.get(section, []), list) for section in sections):
+        raise ValueError('expected an object with "users", "groups" and/or "apps" lists')
+
+    return state
+
+
+def object_key(kind, item):
+    """The login, group name or app label desired-state entries are matched on, lowercased"""
+    if kind == "app":
+        value = item.get("label")
+    else:
+        value = (item.get("profile") or {}).get("login" if kind == "user" else "name")
+
+    return (value or "").lower()
+
+
+async def current_objects(kind, keys, source="api"):
+    """The org's users, groups or apps whose lowercased login, name or label is in keys, by that key.
+
+    With source "index" they are read from the local index. Otherwise users and groups are searched for
+    LOOKUP_BATCH keys at a time ('profile.login eq "a" or profile.login eq "b" ...'), several searches at once, and
+    apps, which have no search, are matched against one full listing.
+    """
+    items = []
+
+    if not keys:
+        return {}
+
+    if source == "index":
+        items = org_index().lookup(kind, keys)
+    elif kind in SERVER_SEARCH:
+        attribute = "profile.login" if kind == "user" else "profile.name"
+        ordered = sorted(keys)
+
+        async def search(batch):
+            expression = filter_to_string(("or", [("compare", attribute, "eq", key) for key in batch]))
+            page, resp, err = await list_raw(OrgIndex.KINDS[kind][1], {'search': expression, 'limit': '200'})
+            matched = []
+
+            async for page, err in prefetch_pages(page, resp, err, depth=1):
+                if err is not None:
+                    return matched, err
+                matched += page
+
+            return matched, None
+
+        batches = [ordered[start:start + LOOKUP_BATCH] for start in range(0, len(ordered), LOOKUP_BATCH)]
+
+        async for batch, (matched, err) in ordered_map(batches, search, BULK_CONCURRENCY):
+            if err is not None:
+                raise RuntimeError(f"Could not look up {kind}s: {error_message(err).strip()}")
+
+            items += [item for item in matched if object_key(kind, item) in keys]
+    else:
+        page, resp, err = await list_raw(OrgIndex.KINDS[kind][1], {'limit': '200'})
+
+        async for page, err in prefetch_pages(page, resp, err):
+            if err is not None:
+                raise RuntimeError(f"Could not list {kind}s: {error_message(err).strip()}")
+
+            items += [item for item in page if object_key(kind, item) in keys]
+
+    found = {}
+    for item in items:
+        key = object_key(kind, item)
+        if key in found and found[key]["id"] != item["id"]:
+            raise RuntimeError(f"More than one {kind} is named '{key}' ({found[key]['id']}, {item['id']})")
+
+        found[key] = item
+
+    return found
+
+
+async def list_ids(path, key):
+    """Every item of a listing such as a group's members, as {key(item): item id}"""
+    found = {}
+    page, resp, err = await list_raw(path, {'limit': '200'})
+
+    async for page, err in prefetch_pages(page, resp, err, depth=1):
+        if err is not None:
+            raise RuntimeError(f"Could not list {path}: {error_message(err).strip()}")
+
+        for item in page:
+            found[key(item)] = item["id"]
+
+    return found
+
+
+def changed_attributes(current, desired):
+    """The attributes of desired that differ from current; logins compare case-insensitively"""
+    changed = {}
+
+    for name, value in desired.items():
+        if name == "login" and str(current.get(name, "")).lower() == str(value).lower():
+            continue
+        if current.get(name) != value:
+            changed[name] = value
+
+    return changed
+
+
+async def plan_changes(state, source="api"):
+    """Diff a desired state against the org; returns (changes, ids, problems).
+
+    Users are matched by login, groups by name and apps by label. A group's "members" and an app's "groups" are the
+    complete lists: anything else is removed. Existing apps are only assigned groups, never reconfigured. Each change
+    is a dict with "action", "kind" and the names of what it touches; ids maps kind -> lowercased name -> ID for
+    everything that already exists, and is filled in with created objects while the changes are applied.
+    """
+    schema, err = await user_schema()
+    if err is not None:
+        raise RuntimeError(error_message(err))
+
+    attribute_names = profile_attribute_names(schema)
+    problems = []
+
+    # desired kind -> lowercased name -> entry
+    desired = {"user": {}, "group": {}, "app": {}}
+
+    for number, entry in enumerate(state.get("users", []), 1):
+        profile, entry_problems = user_profile_from_record(entry, attribute_names, [])
+
+        if "login" not in profile:
+            entry_problems.append("no login or email")
+        if entry_problems:
+            problems.append(f"users[{number}]: {'; '.join(entry_problems)}")
+        elif profile["login"].lower() in desired["user"]:
+            problems.append(f"users[{number}]: {profile['login']} is listed more than once")
+        else:
+            desired["user"][profile["login"].lower()] = profile
+
+    for kind, section, name in (("group", "groups", "name"), ("app", "apps", "label")):
+        for number, entry in enumerate(state.get(section, []), 1):
+            if not isinstance(entry, dict) or not entry.get(name):
+                problems.append(f"{section}[{number}]: no {name}")
+            elif entry[name].lower() in desired[kind]:
+                problems.append(f"{section}[{number}]: {entry[name]} is listed more than once")
+            else:
+                desired[kind][entry[name].lower()] = entry
+
+    member_keys = {login.lower() for entry in desired["group"].values() for login in entry.get("members", [])}
+    assigned_keys = {name.lower() for entry in desired["app"].values() for name in entry.get("groups", [])}
+
+    users, groups, apps = await asyncio.gather(
+        current_objects("user", set(desired["user"]) | member_keys, source),
+        current_objects("group", set(desired["group"]) | assigned_keys, source),
+        current_objects("app", set(desired["app"]), source))
+
+    ids = {"user": {key: user["id"] for key, user in users.items()},
+           "group": {key: group["id"] for key, group in groups.items()},
+           "app": {key: app["id"] for key, app in apps.items()}}
+    changes = []
+
+    for key, profile in desired["user"].items():
+        if key not in users:
+            missing = [f"'{attribute}' ({title})" for attribute, title in schema["required"]
+                       if attribute not in profile]
+            if missing:
+                problems.append(f"user {profile['login']}: missing required attribute(s) {', '.join(missing)}")
+            else:
+                changes.append({"action": "create", "kind": "user", "name": profile["login"],
+                                "body": {"profile": profile}})
+            continue
+
+        current = users[key].get("profile") or {}
+        changed = changed_attributes(current, profile)
+        if changed:
+            changes.append({"action": "update", "kind": "user", "name": profile["login"], "id": users[key]["id"],
+                            "body": {"profile": changed}, "before": {name: current.get(name) for name in changed}})
+
+    for key, entry in desired["group"].items():
+        profile = {name: value for name, value in entry.items() if name != "members"}
+
+        if key not in groups:
+            changes.append({"action": "create", "kind": "group", "name": entry["name"], "body": {"profile": profile}})
+            continue
+
+        current = groups[key].get("profile") or {}
+        changed = changed_attributes(current, profile)
+        if changed and groups[key].get("type", "OKTA_GROUP") != "OKTA_GROUP":
+            problems.append(f"group {entry['name']}: is imported from an app, so its profile can't be changed")
+        elif changed:
+            # replacing a group's profile drops any attribute left out, so send the whole of it
+            changes.append({"action": "update", "kind": "group", "name": entry["name"], "id": groups[key]["id"],
+                            "body": {"profile": {**current, **profile}},
+                            "before": {name: current.get(name) for name in changed}})
+
+    for key, entry in desired["app"].items():
+        if key in apps:
+            continue
+
+        if not entry.get("name") or not entry.get("signOnMode"):
+            problems.append(f"app {entry['label']}: doesn't exist, and has no name and signOnMode to create it with")
+        else:
+            changes.append({"action": "create", "kind": "app", "name": entry["label"],
+                            "body": {name: value for name, value in entry.items() if name != "groups"}})
+
+    creating = {(change["kind"], change["name"].lower()) for change in changes if change["action"] == "create"}
+
+    def exists(kind, key):
+        return key in ids[kind] or (kind, key) in creating
+
+    async def current_members(key):
+        if key not in ids["group"]:
+            return {}
+        return await list_ids(f"/api/v1/groups/{ids['group'][key]}/users", lambda user: object_key("user", user))
+
+    managed = [key for key, entry in desired["group"].items() if "members" in entry]
+
+    async for key, members in ordered_map(managed, current_members, BULK_CONCURRENCY):
+        group = desired["group"][key]
+        wanted = {login.lower(): login for login in group["members"]}
+
+        for login_key, login in wanted.items():
+            if not exists("user", login_key):
+                problems.append(f"group {group['name']}: member {login} doesn't exist and isn't in the users list")
+            elif login_key not in members:
+                changes.append({"action": "add", "kind": "member", "group": group["name"], "user": login})
+
+        for login_key, user_id in members.items():
+            if login_key not in wanted:
+                changes.append({"action": "remove", "kind": "member", "group": group["name"], "user": login_key,
+                                "user_id": user_id})
+
+    group_names = {group_id: groups[key]["profile"]["name"] for key, group_id in ids["group"].items()}
+
+    async def current_assignments(key):
+        if key not in ids["app"]:
+            return {}
+        return await list_ids(f"/api/v1/apps/{ids['app'][key]}/groups", lambda assignment: assignment["id"])
+
+    managed = [key for key, entry in desired["app"].items() if "groups" in entry and exists("app", key)]
+
+    async for key, assigned in ordered_map(managed, current_assignments, BULK_CONCURRENCY):
+        app = desired["app"][key]
+        wanted = {name.lower(): name for name in app["groups"]}
+
+        for group_key, name in wanted.items():
+            if not exists("group", group_key):
+                problems.append(f"app {app['label']}: group {name} doesn't exist and isn't in the groups list")
+            elif ids["group"].get(group_key) not in assigned:
+                changes.append({"action": "assign", "kind": "app-group", "app": app["label"], "group": name})
+
+        wanted_ids = {ids["group"][group_key] for group_key in wanted if group_key in ids["group"]}
+        for group_id in assigned:
+            if group_id not in wanted_ids:
+                changes.append({"action": "unassign", "kind": "app-group", "app": app["label"],
+                                "group": group_names.get(group_id, group_id), "group_id": group_id})
+
+    return changes, ids, problems
+
+
+def describe_change(change):
+    action, kind = change["action"], change["kind"]
+
+    if kind == "member":
+        return f"+ add {change['user']} to group {change['group']}" if action == "add" else \
+            f"- remove {change['user']} from group {change['group']}"
+    if kind == "app-group":
+        return f"+ assign group {change['group']} to app {change['app']}" if action == "assign" else \
+            f"- unassign group {change['group']} from app {change['app']}"
+    if action == "create":
+        return f"+ create {kind} {change['name']}"
+
+    updates = ", ".join(f"{name}: {json.dumps(change['before'][name])} -> {json.dumps(value)}"
+                        for name, value in change["body"]["profile"].items() if name in change["before"])
+    return f"~ update {kind} {change['name']} ({updates})"
+
+
+def change_request(change, ids):
+    """(method, path, body) that makes a change; raises KeyError when it needs an object that was never created"""
+    action, kind = change["action"], change["kind"]
+
+    if kind == "member":
+        group_id = ids["group"][change["group"].lower()]
+        user_id = change.get("user_id") or ids["user"][change["user"].lower()]
+        return "PUT" if action == "add" else "DELETE", f"/api/v1/groups/{group_id}/users/{user_id}", None
+
+    if kind == "app-group":
+        app_id = ids["app"][change["app"].lower()]
+        group_id = change.get("group_id") or ids["group"][change["group"].lower()]
+        if action == "assign":
+            return "PUT", f"/api/v1/apps/{app_id}/groups/{group_id}", {}
+        return "DELETE", f"/api/v1/apps/{app_id}/groups/{group_id}", None
+
+    path = OBJECT_PATHS[kind].rstrip("/")
+    if action == "create":
+        return "POST", path + ("?activate=true" if kind == "user" else ""), change["body"]
+
+    # a user's profile can be updated partially with POST; a group's is replaced with PUT
+    return "POST" if kind == "user" else "PUT", f"{path}/{change['id']}", change["body"]
+
+
+async def send_change(method, path, body=None, idempotent=True):
+    """api_request for a change, retried up to APPLY_ATTEMPTS times.
+
+    429s are always retried; the session's scheduler holds them back until their reset. Idempotent requests (PUT,
+    DELETE, a profile update) are also retried after 5xx responses and raised errors (dropped connections,
+    timeouts), with a short backoff. A create is not, since it may have gone through and would be made twice.
+    Returns (status, error message or None, response body); status is None if the request never got a response.
+    """
+    for attempt in range(APPLY_ATTEMPTS):
+        try:
+            status, headers, response = await api_request(method, path, body)
+        except Exception as error:
+            status, response = None, {"errorSummary": str(error) or type(error).__name__}
+
+        if status == 429:
+            continue
+        if not idempotent or status is not None and status < 500:
+            break
+
+        if attempt + 1 < APPLY_ATTEMPTS:
+            await asyncio.sleep(0.5 * 2 ** attempt)
+
+    if status is not None and status < 300:
+        return status, None, response
+
+    summary = response.get("errorSummary") if isinstance(response, dict) else None
+    causes = [cause.get("errorSummary") for cause in response.get("errorCauses", [])] \
+        if isinstance(response, dict) else []
+
+    return status, "; ".join(filter(None, [summary] + causes)) or f"HTTP {status}", response
 
-    parser.add_argument('-l', '--login', metavar="", help='Log into your Okta org; specify your org URL', required=False)
-    parser.add_argument('-c', '--clientId', metavar="", help="OIDC client ID for CLI app; specify valid client ID", required=False)
-    parser.add_argument('-r', '--register', metavar="", help="Register for an Okta Developer org; specify your "
-                                                             "developer email address", required=False)
-    return parser
+
+async def apply_changes(changes, ids, options):
+    """Make planned changes, up to --concurrency at a time, in two waves: first users, groups and apps, then the
+    memberships and app assignments that may need their IDs. Changes that depend on a failed create are skipped."""
+    concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+    counts = {"applied": 0, "failed": 0, "skipped": 0}
+
+    async def apply(change):
+        result = {"change": describe_change(change)}
+
+        try:
+            method, path, body = change_request(change, ids)
+        except KeyError:
+            return {**result, "status": "skipped", "error": "something it needs wasn't created"}
+
+        status, error, response = await send_change(method, path, body, idempotent=change["action"] != "create")
+        if error is not None:
+            return {**result, "status": "failed", "error": error}
+
+        if change["action"] == "create":
+            ids[change["kind"]][change["name"].lower()] = response["id"]
+
+        return {**result, "status": "applied"}
+
+    waves = ([change for change in changes if change["kind"] in OBJECT_PATHS],
+             [change for change in changes if change["kind"] not in OBJECT_PATHS])
+
+    try:
+        results_file = open(options["results"], "w") if options.get("results") else None
+    except OSError as error:
+        print_error(f"Could not write {options['results']}: {error}\n")
+        return
+
+    started = time.perf_counter()
+
+    print(f"\nApplying {len(changes)} changes ({concurrency} at a time)...")
+
+    try:
+        for wave in waves:
+            async for change, result in ordered_map(wave, apply, concurrency):
+                counts[result["status"]] += 1
+
+                if result["status"] != "applied":
+                    print_error(f"{result['change']}: {result['status']}, {result['error']}")
+
+                if results_file is not None:
+                    results_file.write(json.dumps(result) + "\n")
+    finally:
+        if results_file is not None:
+            results_file.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"\nApplied {counts['applied']} of {len(changes)} changes ({counts['failed']} failed, "
+          f"{counts['skipped']} skipped) in {elapsed:.1f}s\n")
+
+
+async def resolve_users(entries, source="api"):
+    """Map users-file entries (logins or user IDs) to user IDs; entries that match no user are left out.
+
+    Logins already in the session cache cost nothing; the rest are resolved together by current_objects (a search
+    per LOOKUP_BATCH logins rather than a request per login) and cached for the rest of the session.
+    """
+    ids = {entry: entry for entry in entries if USER_ID.fullmatch(entry)}
+    logins = set()
+
+    for entry in entries:
+        if entry in ids:
+            continue
+
+        cached = objectCache.get("user", entry)
+        if cached is not None:
+            ids[entry] = cached["id"]
+        else:
+            logins.add(entry.lower())
+
+    found = await current_objects("user", logins, source)
+
+    for item in found.values():
+        objectCache.put("user", item)
+
+    for entry in entries:
+        if entry not in ids and entry.lower() in found:
+            ids[entry] = found[entry.lower()]["id"]
+
+    return ids
+
+
+def completed_members(path, group_id, action):
+    """Users a previous run's results log says were already added to (or removed from) the group"""
+    done = set()
+
+    try:
+        with open(path) as results_file:
+            for line in results_file:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue
+
+                if result.get("group_id") == group_id and result.get("action") == action \
+                        and result.get("status") == "done":
+                    done.add(result["user"])
+    except FileNotFoundError:
+        pass
+
+    return done
+
+
+async def change_memberships(group, action, entries, ids, options):
+    """Add users to (PUT) or remove them from (DELETE) a group, up to --concurrency at a time, logging every user's
+    outcome to --results (entries that resolved to no user as "not found"). Both calls are idempotent, so failed
+    attempts (429s, 5xx, dropped connections) are simply retried, and a re-run redoes nothing harmful."""
+    concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+    method = "PUT" if action == "add" else "DELETE"
+    counts = {"done": 0, "failed": 0}
+
+    async def change(entry):
+        result = {"user": entry, "user_id": ids[entry], "group_id": group["id"], "action": action}
+        status, error, response = await send_change(method, f"/api/v1/groups/{group['id']}/users/{ids[entry]}")
+        if error is not None:
+            return {**result, "status": "failed", "error": error}
+
+        return {**result, "status": "done"}
+
+    resume = options.get("resume") and options.get("results")
+    skipped = completed_members(options["results"], group["id"], action) if resume else set()
+    resolved = [entry for entry in entries if entry in ids]
+    pending = [entry for entry in resolved if entry not in skipped]
+
+    try:
+        results_file = open(options["results"], "a" if resume else "w") if options.get("results") else None
+    except OSError as error:
+        print_error(f"Could not write {options['results']}: {error}\n")
+        return
+
+    started = time.perf_counter()
+    name = group["profile"]["name"]
+    print(f"\n{'Adding' if action == 'add' else 'Removing'} {len(pending)} users "
+          f"{'to' if action == 'add' else 'from'} {name} ({concurrency} at a time)...")
+
+    try:
+        if results_file is not None:
+            for entry in entries:
+                if entry not in ids:
+                    results_file.write(json.dumps({"user": entry, "user_id": None, "group_id": group["id"],
+                                                   "action": action, "status": "not found",
+                                                   "error": "no such user"}) + "\n")
+
+        async for entry, result in ordered_map(pending, change, concurrency):
+            counts[result["status"]] += 1
+
+            if result["status"] != "done":
+                print_error(f"{entry}: {result['status']}, {result['error']}")
+
+            if results_file is not None:
+                results_file.write(json.dumps(result) + "\n")
+    finally:
+        if results_file is not None:
+            results_file.close()
+
+    elapsed = time.perf_counter() - started
+    rate = f" - {counts['done'] / elapsed:.0f} users/sec" if elapsed else ""
+    already = f", {len(resolved) - len(pending)} already done" if resume else ""
+
+    print(f"\n{'Added' if action == 'add' else 'Removed'} {counts['done']} of {len(pending)} users "
+          f"{'to' if action == 'add' else 'from'} {name} ({counts['failed']} failed{already}) in "
+          f"{elapsed:.1f}s{rate}\n")
+
+
+# stream: (listing path, or the parent stream and per-parent listing path)
+SNAPSHOT_STREAMS = {
+    "users": ("/api/v1/users", None),
+    "groups": ("/api/v1/groups", None),
+    "apps": ("/api/v1/apps", None),
+    "members": ("/api/v1/groups/{id}/users", "groups"),
+    "app-users": ("/api/v1/apps/{id}/users", "apps"),
+    "app-groups": ("/api/v1/apps/{id}/groups", "apps")
+}
+
+
+def snapshot_row(name, parent_id, item):
+    """The row a child stream writes for one item: a reference to the parent plus the assignment's own fields"""
+    if name == "members":
+        return {"groupId": parent_id, "userId": item["id"], "login": (item.get("profile") or {}).get("login")}
+    if name == "app-users":
+        return {"appId": parent_id, "userId": item["id"], "scope": item.get("scope"), "status": item.get("status"),
+                "userName": (item.get("credentials") or {}).get("userName")}
+
+    return {"appId": parent_id, "groupId": item["id"], "priority": item.get("priority")}
+
+
+class Snapshot:
+    """A resumable export of an org into a directory: a gzipped JSONL file per stream, plus checkpoint.json.
+
+    Every page is appended as its own gzip member, and the checkpoint records each stream's next-page URL (which
+    carries the 'after' cursor) together with the file size after that page. The checkpoint is replaced atomically
+    after every page, so on resume each file is cut back to its checkpointed size and picks up at the saved cursor:
+    no page is lost, written twice or fetched again.
+    """
+
+    def __init__(self, directory, streams, fresh=False):
+        self.directory = directory
+        self.path = os.path.join(directory, "checkpoint.json")
+        self.files = {}
+
+        os.makedirs(directory, exist_ok=True)
+
+        self.state = None
+        if not fresh and os.path.exists(self.path):
+            with open(self.path) as checkpoint_file:
+                self.state = json.load(checkpoint_file)
+
+            if self.state.get("org") != current_org()[0]:
+                raise ValueError(f"{directory} holds a snapshot of {self.state.get('org')}; use --fresh to replace it")
+
+        self.resumed = self.state is not None
+        if self.state is None:
+            self.state = {"org": current_org()[0], "started_at": time.time(), "streams": {}}
+
+        # a stream a resumed run adds with --types starts later than the rest, so each records when it started
+        started_at = time.time()
+        for name in streams:
+            self.state["streams"].setdefault(name, {
+                "offset": 0, "records": 0, "next": None, "done": False, "position": 0, "active": {}, "seconds": 0.0,
+                "started_at": started_at
+            })
+
+    def file_path(self, name):
+        return os.path.join(self.directory, name + ".jsonl.gz")
+
+    def stream(self, name):
+        return self.state["streams"][name]
+
+    def open(self, name):
+        """The stream's output file, cut back to the size the checkpoint last vouched for"""
+        if name not in self.files:
+            path = self.file_path(name)
+            offset = self.stream(name)["offset"]
+
+            if offset and not os.path.exists(path):
+                raise ValueError(f"{path} is missing; use --fresh to start the snapshot over")
+
+            output = open(path, "r+b" if os.path.exists(path) else "wb")
+            output.truncate(offset)
+            output.seek(offset)
+            self.files[name] = output
+
+        return self.files[name]
+
+    def append(self, name, records):
+        """Write one page as a complete gzip member; the caller moves the cursor on and saves the checkpoint"""
+        if not records:
+            return
+
+        with phase("output"):
+            blob = gzip.compress("".join(json.dumps(record) + "\n" for record in records).encode(), compresslevel=6)
+
+            output = self.open(name)
+            output.write(blob)
+            output.flush()
+
+        state = self.stream(name)
+        state["offset"] += len(blob)
+        state["records"] += len(records)
+
+    def save(self):
+        for output in self.files.values():
+            os.fsync(output.fileno())
+
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as checkpoint_file:
+            json.dump(self.state, checkpoint_file)
+        os.replace(temporary, self.path)
+
+    def read(self, name):
+        """Every record of a finished stream"""
+        with gzip.open(self.file_path(name), "rt") as stream_file:
+            for line in stream_file:
+                yield json.loads(line)
+
+    def close(self):
+        for output in self.files.values():
+            output.close()
+        self.files.clear()
+
+
+async def snapshot_pages(url):
+    """Yield (page, next page URL) from a listing URL onwards; ends early if the listing is gone, e.g. for a group
+    deleted since the groups were exported"""
+    while url:
+        page, resp, err = await list_raw(url, None)
+
+        if err is not None:
+            if getattr(err, "status", None) == 404:
+                return
+            raise RuntimeError(f"Could not list {url}: {error_message(err).strip()}")
+
+        # the SDK keeps the next page's relative URL, 'after' cursor included, in _next
+        url = getattr(resp, "_next", None)
+        yield page, url
+
+
+async def snapshot_stream(snapshot, name, concurrency):
+    state = snapshot.stream(name)
+    path, parent = SNAPSHOT_STREAMS[name]
+
+    if state["done"]:
+        return
+
+    started = time.perf_counter()
+
+    if parent is None:
+        async for page, next_url in snapshot_pages(state["next"] or path + "?limit=200"):
+            snapshot.append(name, page)
+            state["next"] = next_url
+            snapshot.save()
+    else:
+        parents = [item["id"] for item in snapshot.read(parent)]
+
+        # parents below "position" are finished; "active" holds the next page of each one started after it, or None
+        # once it's done, so a resumed run restarts only the parents that were in flight
+        active = state["active"]
+
+        async def export(index):
+            key = str(index)
+            if key in active and active[key] is None:
+                return
+
+            parent_id = parents[index]
+            url = active.get(key) or path.format(id=parent_id) + "?limit=200"
+
+            async for page, next_url in snapshot_pages(url):
+                snapshot.append(name, [snapshot_row(name, parent_id, item) for item in page])
+                active[key] = next_url
+                snapshot.save()
+
+            active[key] = None
+
+        async for index, result in ordered_map(range(state["position"], len(parents)), export, concurrency):
+            state["position"] = index + 1
+            active.pop(str(index), None)
+            snapshot.save()
+
+    # an empty stream still gets its (empty) file
+    snapshot.open(name)
+
+    state["done"] = True
+    state["seconds"] += time.perf_counter() - started
+    snapshot.save()
+
+
+def convert_to_parquet(snapshot, name):
+    """Rewrite a finished stream as <name>.parquet; returns an error message, or None"""
+    try:
+        import pyarrow.json
+        import pyarrow.parquet
+    except ImportError:
+        return "pyarrow isn't installed, so it was kept as gzipped JSONL"
+
+    try:
+        with pyarrow.input_stream(snapshot.file_path(name), compression="gzip") as stream_file:
+            table = pyarrow.json.read_json(stream_file)
+        pyarrow.parquet.write_table(table, os.path.join(snapshot.directory, name + ".parquet"), compression="zstd")
+    except (pyarrow.ArrowException, OSError) as error:
+        return f"couldn't convert it to Parquet ({error}), so it was kept as gzipped JSONL"
+
+    return None
+
+
+# what 'stats' counts by when no --by is given
+STATS_FIELDS = {"user": "status", "group": "type", "app": "signOnMode"}
+
+
+def group_label(value):
+    if value is None or value == "":
+        return "(none)"
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True)
+
+    return str(value)
+
+
+def count_groups(paths, records, node=None):
+    """Group-by count of a batch of records, raw dicts or the JSON text the index stores, optionally only those
+    matching a parsed filter. Returns a Counter of value tuples; module-level so --workers can run it elsewhere."""
+    counts = collections.Counter()
+
+    for record in records:
+        if isinstance(record, str):
+            record = json.loads(record)
+
+        if node is None or filter_matches(node, record):
+            counts[tuple(group_label(field_value(record, path)) for path in paths)] += 1
+
+    return counts
+
+
+async def stats_batches(kind, options):
+    """Yield (batch of records, filter for count_groups to apply) from the API or, with --source index, the index"""
+    if options.get("source") == "index":
+        conditions = [parse_filter(options[name]) for name in ("filter", "search") if options.get(name)]
+        node = conditions[0] if len(conditions) == 1 else ("and", conditions) if conditions else None
+
+        for batch in org_index().bodies(kind):
+            yield batch, node
+        return
+
+    query_parameters, predicate = list_query(kind, options)
+    items, resp, err = await list_raw(OrgIndex.KINDS[kind][1], query_parameters)
+
+    async for items, err in prefetch_pages(items, resp, err):
+        if err is not None:
+            raise RuntimeError(error_message(err).strip())
+
+        yield items if predicate is None else [item for item in items if predicate(item)], None
+
+
+def print_group_counts(names, counts, top=None):
+    """Print group-by counts as a table, largest first; groups beyond the top N are folded into one row"""
+    total = sum(counts.values())
+    rows = counts.most_common()
+
+    if top and len(rows) > top:
+        rest = rows[top:]
+        rows = rows[:top] + [((f"({len(rest)} more)",) + ("",) * (len(names) - 1), sum(count for key, count in rest))]
+
+    widths = [max([len(name)] + [len(key[position]) for key, count in rows]) for position, name in enumerate(names)]
+    count_width = max(5, len(str(total)))
+
+    print("  ".join(name.ljust(width) for name, width in zip(names, widths)) + f"  {'count':>{count_width}}      %")
+
+    for key, count in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(key, widths)) +
+              f"  {count:>{count_width}}  {count * 100 / total if total else 0:5.1f}")
 
 
 class OktaCLI(cmd.Cmd):
     prompt = '>>'
     intro = '\nWelcome to the Okta CLI. Type \'help\' for available commands'
 
+    trace = None
+
+    def precmd(self, line):
+        if line.strip():
+            # 'timing' itself isn't timed, so 'timing off' doesn't report on itself
+            if line.split()[0] != "timing":
+                self.trace = tracer.start(line.strip())
+
+            # commands that don't call the org (help, find, orgs, exit, ...) still work without a token
+            try:
+                runtime.run(connect())
+            except RuntimeError as error:
+                print_error(f"{error}\n")
+
+        return line
+
+    def postcmd(self, stop, line):
+        if self.trace is not None:
+            tracer.finish(self.trace)
+            self.trace.print_summary(sys.stderr)
+            self.trace = None
+
+        return stop
+
+    def preloop(self):
+        # readline splits arguments at '@', '-' and more by default; complete whole arguments instead
+        try:
+            import readline
+            readline.set_completer_delims(" \t\n\"'")
+        except ImportError:
+            pass
+
+    def complete_arguments(self, command, line, begidx, endidx):
+        """Complete subcommands, options and their values, and user logins, group names and app labels (from the
+        local index, so names complete once it has been synced)"""
+        subcommands, flags, valued = COMPLETIONS[command]
+        positional, words, argument, opening, start = completion_context(line, endidx, flags)
+
+        if argument.startswith("-"):
+            return [option for option in (f"--{name}" for name in flags + valued) if option.startswith(argument)]
+
+        if words and words[-1].startswith("-") and words[-1].lstrip("-") in valued:
+            values = OPTION_VALUES.get(words[-1].lstrip("-"), ())
+            return completions([value for value in values if value.startswith(argument)], opening, start, begidx)
+
+        if not positional or command in ("sync", "stats"):
+            return completions([name for name in subcommands if name.startswith(argument)], opening, start, begidx)
+
+        # 'group add|remove' takes a group name
+        kind = "group" if command == "group" else positional[0]
+        if command == "create" or kind not in OrgIndex.KINDS or command == "group" and len(positional) > 1:
+            return []
+
+        names = completionIndex.complete(kind, argument)
+
+        # groups and apps are listed by ID, so a name narrowed down to one completes to its ID (when readline lets
+        # the whole argument be replaced)
+        if command == "list" and kind != "user" and begidx - start == len(opening):
+            exact = [name for name in names if name.lower() == argument.lower()]
+
+            if len(exact) == 1 or len(names) == 1:
+                found = org_index().lookup(kind, exact or names)
+                if len(found) == 1:
+                    return completions([found[0]["id"]], opening, start, begidx)
+
+        if command == "list" and len(positional) == 1 and "all".startswith(argument):
+            names = ["all"] + names
+
+        return completions(names, opening, start, begidx)
+
+    def complete_list(self, text, line, begidx, endidx):
+        return self.complete_arguments("list", line, begidx, endidx)
+
+    def complete_create(self, text, line, begidx, endidx):
+        return self.complete_arguments("create", line, begidx, endidx)
+
+    def complete_find(self, text, line, begidx, endidx):
+        return self.complete_arguments("find", line, begidx, endidx)
+
+    def complete_sync(self, text, line, begidx, endidx):
+        return self.complete_arguments("sync", line, begidx, endidx)
+
+    def complete_stats(self, text, line, begidx, endidx):
+        return self.complete_arguments("stats", line, begidx, endidx)
+
+    def complete_group(self, text, line, begidx, endidx):
+        return self.complete_arguments("group", line, begidx, endidx)
+
     def do_list(self, line):
-        """List objects in your org; valid options are users, groups, or apps"""
+        """List objects in your org; valid options are users, groups, or apps
+
+        'list user|group|app all' and 'list group groupIdentifier' accept --output table|ndjson|csv|tsv and
+        --fields name,name,... (e.g. 'list user all --output csv --fields id,login,status').
+        'list group all --with-members' exports every group's members as groupId,userId,login rows
+        (--concurrency N groups at a time, default 8).
+        'list user|group|app id id ...' looks up many objects at once, in input order; add --from ids.txt (one per
+        line) for more, and --concurrency N (default 8). Groups are listed as their membership rows.
+        'list user|group|app [all]' also selects with -q prefix, --filter 'status eq "ACTIVE"' and
+        --search 'profile.department eq "Sales"' (Okta expressions), sent to the API where it supports them and
+        applied as the pages stream in where it doesn't (e.g. most app attributes)"""
+        runtime.run(self.run_list(line))
+
+    async def run_list(self, line):
+        try:
+            words, options = parse_options(line, flags=("with-members",), aliases={"-q": "q"})
+            options["concurrency"] = int(options.get("concurrency") or BULK_CONCURRENCY)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        line = " ".join(words)
+
+        # 'list user --search ...' means every user the search selects
+        if line in ("user", "group", "app") and any(options.get(name) for name in ("q", "filter", "search")):
+            line += " all"
+
+        # several IDs, an ID file, or one user or app as a row, are looked up concurrently; one ID alone keeps the
+        # detailed view
+        kind, identifiers = (words[0], words[1:]) if words else (None, [])
+        lookup = kind in ("user", "group", "app") and identifiers != ["all"] and (
+            len(identifiers) > 1 or options.get("from") or
+            (kind != "group" and identifiers and (options.get("output") or options.get("fields"))))
 
         async def run():
-            if line == "user":
+            if lookup:
+                await list_by_ids(kind, identifiers, options)
+
+            elif line == "user":
                 print("Proper syntax is 'list user all' or 'list user userIdentifier' - the user identifier can be "
                       "the unique ID or username of the user\n")
             elif line == "user all":
-                print("")
-                query_parameters = {'limit': '200'}
-                users, resp, err = await client.list_users(query_parameters)
-
-                list_users = True
-                while list_users:
-                    for user in users:
-                        print(user.profile.first_name, user.profile.last_name + " - " + user.profile.login + " - " + user.id)
-
-                    if resp.has_next():
-                        users, err = await resp.next()
-                    else:
-                        print("")
-                        list_users = False
+                await list_all("user", '/api/v1/users', options)
 
             elif "user" in line:
                 print("")
                 x = line.split()
-                user, resp, err = await client.get_user(x[1])
+                import okta.models as models
+
+                item, err = await get_object("user", x[1])
+
+                user = models.User(item) if item is not None else None
 
                 try:
                     print(f"User information for {user.profile.firstName} {user.profile.lastName}")
@@ -73,31 +3113,22 @@ class OktaCLI(cmd.Cmd):
 
                     print("")
                 except Exception:
-                    print(err.message)
+                    print_error(err)
 
             elif line == "app":
                 print("Proper syntax is 'list app all' or 'list app appIdentifier' - the app identifier is the "
                       "the unique ID of the app (ex: 0oahj8jgm39sTthic5d7)\n")
             elif line == "app all":
-                print("")
-                query_parameters = {'limit': '200'}
-                apps, resp, err = await client.list_applications(query_parameters)
-
-                list_apps = True
-                while list_apps:
-                    for app in apps:
-                        print(app.label + " - " + app.id)
-
-                    if resp.has_next():
-                        apps, err = await resp.next()
-                    else:
-                        print("")
-                        list_apps = False
+                await list_all("app", '/api/v1/apps', options)
 
             elif "app" in line:
                 x = line.split()
 
-                app, resp, err = await client.get_application(x[1])
+                import okta.models as models
+
+                item, err = await get_object("app", x[1])
+
+                app = models.Application(item) if item is not None else None
 
                 try:
                     print("")
@@ -111,150 +3142,112 @@ class OktaCLI(cmd.Cmd):
                     print("")
 
                 except Exception:
-                    print(err.message)
+                    print_error(err)
 
             elif line == "group":
                 print("Proper syntax is 'list group all' or 'list user groupIdentifier' - the group identifier is the "
                       "the unique ID of the group (ex: 00ghjamc0wdUHSI8B5d7)\n")
-            elif line == "group all":
-                print("")
-                query_parameters = {'limit': '200'}
-                groups, resp, err = await client.list_groups(query_parameters)
+            elif line == "group all" and options.get("with-members"):
+                await export_group_memberships(options)
 
-                list_groups = True
-                while list_groups:
-                    for group in groups:
-                        print(group.profile.name + " - " + group.id)
-
-                    if resp.has_next():
-                        groups, err = await resp.next()
-                    else:
-                        print("")
-                        list_groups = False
+            elif line == "group all":
+                await list_all("group", '/api/v1/groups', options)
 
             elif "group" in line:
                 x = line.split()
 
-                group, resp, err = await client.get_group(x[1])
+                import okta.models as models
 
-                try:
+                item, err = await get_object("group", x[1])
+
+                group = models.Group(item) if item is not None else None
+
+                if err is not None:
                     print("")
-                    print(f"Group membership for {group.profile.name}")
-                    print("---")
+                    print_error(err)
+                    print("")
+                    return
 
-                    membership_href = group.links
-                    url = membership_href["users"]["href"]
+                writer = create_row_writer("member", options)
+                if writer is None:
+                    return
 
-                    request, error = await client.get_request_executor().create_request(
-                        method='GET',
-                        url=url,
-                        body={},
-                        headers={},
-                        oauth=False
-                    )
+                if writer.output == "table":
+                    print("")
+                    print(f"Group membership for {group.profile.name}")
+                    print("---")
+                else:
+                    writer.open()
 
-                    response, error = await client.get_request_executor().execute(request, models.User)
-                    members = (response.get_body())
+                count, err = await list_group_members(group.id, writer)
+                writer.flush()
 
-                    for member in members:
-                        print(f"{member['profile']['firstName']} {member['profile']['lastName']} - {member['profile']['login']} ")
+                if err is not None:
+                    print_error(err)
 
+                if writer.output == "table":
                     print("")
-                except Exception:
-                    print("")
-                    print(err.message)
 
             else:
                 print(line)
-                print("Please specify what objects you would like to list.")
+                print_error("Please specify what objects you would like to list.")
                 print("Valid options are 'user', 'group', or 'app'\n")
 
-        asyncio.run(run())
+        await run()
 
     def do_create(self, line):
-        """Create objects in your org; valid options are user, group, or app"""
+        """Create objects in your org; valid options are user, group, or app
 
+        'create user --from users.csv|users.jsonl' creates users in bulk; columns are profile attribute names or
+        titles. Also accepts --concurrency N (default 8), --activate true|false and --results results.jsonl"""
+        runtime.run(self.run_create(line))
+
+    async def run_create(self, line):
         async def run():
             if "user" in line:
                 email = None
 
-                x = line.split()
+                try:
+                    x, options = parse_options(line)
+                    options["concurrency"] = int(options.get("concurrency") or BULK_CONCURRENCY)
+                except ValueError as error:
+                    print_error(f"Could not parse command: {error}\n")
+                    return
+
+                if options.get("from"):
+                    await create_users_from_file(options["from"], options)
+                    return
 
                 if len(x) > 1:
                     email = x[1]
 
-                schema, resp, error = await client.get_user_schema("default")
-
-                # default attributes
-                default = {
-                    "first_name": "firstName",
-                    "last_name": "lastName",
-                    "email": "email",
-                    "login": "login",
-                    "middle_name": "middleName",
-                    "honorific_prefix": "honorificPrefix",
-                    "honorific_suffix": "honorificSuffix",
-                    "title": "title",
-                    "display_name": "displayName",
-                    "nick_name": "nickName",
-                    "profile_url": "profileUrl",
-                    "second_email": "secondEmail",
-                    "mobile_phone": "mobilePhone",
-                    "primary_phone": "primaryPhone",
-                    "street_address": "streetAddress",
-                    "city": "city",
-                    "state": "state",
-                    "zip_code": "zipCode",
-                    "country_code": "countryCode",
-                    "postal_address": "postalAddress",
-                    "preferred_language": "preferredLanguage",
-                    "locale": "locale",
-                    "timezone": "timezone",
-                    "user_type": "userType",
-                    "employee_number": "employeeNumber",
-                    "cost_center": "costCenter",
-                    "organization": "organization",
-                    "division": "division",
-                    "department": "department",
-                    "manager_id": "managerId",
-                    "manager": "manager"
-                }
+                schema, err = await user_schema()
+
+                if err is not None:
+                    print("")
+                    print_error(err)
+                    print("")
+                    return
 
                 set_attributes = {}
 
                 print("")
 
                 # set required attributes
-                for item in default.keys():
-                    schema_property = (getattr(schema.definitions.base.properties, item))
-
-                    if schema_property.required:
-                        if item == "email" and email is not None:
-                            set_value = email
-                        elif item == "login" and email is not None:
-                            set_value = email
-                        else:
-                            set_value = input(schema_property.title + ": ")
-
-                        set_attributes[default[item]] = set_value
-
-                for item in schema.definitions.custom.properties.keys():
-                    schema_property = (schema.definitions.custom.properties[item])
-
-                    try:
-                        if schema_property["required"]:
-                            set_value = input(schema_property["title"] + ": ")
-                            set_attributes[item] = set_value
+                for attribute, title in schema["required"]:
+                    if attribute in ("email", "login") and email is not None:
+                        set_value = email
+                    else:
+                        set_value = ask(title + ": ")
 
-                    except Exception:
-                        pass
+                    set_attributes[attribute] = set_value
 
                 load_optional = False
 
                 validate_input = False
 
                 while not validate_input:
-                    input_optional = input("Populate non-required attributes? (y/n): ")
+                    input_optional = ask("Populate non-required attributes? (y/n): ")
 
                     if input_optional.lower() == "y":
                         load_optional = True
@@ -263,22 +3256,9 @@ class OktaCLI(cmd.Cmd):
                         validate_input = True
 
                 if load_optional:
-                    for item in default.keys():
-                        schema_property = (getattr(schema.definitions.base.properties, item))
-
-                        if not schema_property.required:
-                            set_value = input(schema_property.title + ": ")
-                            set_attributes[default[item]] = set_value
-
-                    for item in schema.definitions.custom.properties.keys():
-                        schema_property = (schema.definitions.custom.properties[item])
-
-                        try:
-                            schema_property["required"]
-                        except Exception:
-                            pass
-                            set_value = input(schema_property["title"] + ": ")
-                            set_attributes[item] = set_value
+                    for attribute, title in schema["optional"]:
+                        set_value = ask(title + ": ")
+                        set_attributes[attribute] = set_value
 
                 body = {
                     'profile': set_attributes
@@ -290,7 +3270,7 @@ class OktaCLI(cmd.Cmd):
                     print(f"\nCreated user '{response[0].profile.login}' with ID {response[0].id}\n")
                 except Exception as error:
                     print("")
-                    print(response[2].message)
+                    print_error(response[2])
 
             elif "group" in line:
                 print("")
@@ -307,7 +3287,9 @@ class OktaCLI(cmd.Cmd):
                                 group_name = group_name + " " + item
 
                 if group_name is None:
-                    group_name = input("Group Name: ")
+                    group_name = ask("Group Name: ")
+
+                import okta.models as models
 
                 group_profile = models.GroupProfile({
                     'name': group_name
@@ -322,10 +3304,10 @@ class OktaCLI(cmd.Cmd):
                     print(f"Group '{group.profile.name}' created with ID {group.id}")
                 except Exception:
                     print("")
-                    print(err.message)
+                    print_error(err)
 
             elif line == "app":
-                app_name = input('Application name: ')
+                app_name = ask('Application name: ')
 
                 print("Please select from one of the following application types")
                 print('''
@@ -344,7 +3326,7 @@ class OktaCLI(cmd.Cmd):
 
                 while menu_loop:
 
-                    menu_choice = input('Enter your choice: ')
+                    menu_choice = ask('Enter your choice: ')
 
                     if menu_choice == "1":
                         app_type = "WEB"
@@ -367,7 +3349,7 @@ class OktaCLI(cmd.Cmd):
                 app_redirect = ""
 
                 if app_type != "SERVICE":
-                    app_redirect = input('Enter your Redirect URI: ')
+                    app_redirect = ask('Enter your Redirect URI: ')
 
                 app_body = {
                     "name": "oidc_client",
@@ -396,285 +3378,1354 @@ class OktaCLI(cmd.Cmd):
                     print(f"Created app '{app.label}' with client ID {app.id}\n")
                 except Exception:
                     print("")
-                    print(err.message)
+                    print_error(err)
                     print("")
 
             else:
-                print("Please specify what type of object you would like to create.")
+                print_error("Please specify what type of object you would like to create.")
                 print("Valid options are 'user', 'group', or 'app'\n")
 
-        asyncio.run(run())
+        await run()
+
+    def do_sync(self, line):
+        """Mirror users, groups and apps into the local index; 'sync [user|group|app] [--full]'
+
+        After the first full load only objects changed since the last sync are fetched (apps are always reloaded
+        since the apps API can't filter on lastUpdated). Use --full to rebuild, e.g. to drop deleted objects.
+        The index also serves tab completion of user logins, group names and app labels."""
+        runtime.run(self.run_sync(line))
+
+    async def run_sync(self, line):
+        try:
+            words, options = parse_options(line, flags=("full",))
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        kinds = [kind for kind in OrgIndex.KINDS if not words or kind in words]
+
+        if not kinds:
+            print_error("Valid options are 'user', 'group', or 'app'\n")
+            return
+
+        index = org_index()
+
+        print("")
+        for kind in kinds:
+            started = time.perf_counter()
+
+            try:
+                written, incremental = await index.sync(kind, full=bool(options.get("full")))
+            except Exception as error:
+                print_error(f"Failed to sync {kind}s: {error}")
+                continue
+
+            mode = "changed" if incremental else "loaded"
+            print(f"{kind}s: {written} {mode}, {index.count(kind)} indexed "
+                  f"({time.perf_counter() - started:.1f}s)")
+        print("")
+
+    def do_plan(self, line):
+        """Show what it would take to make the org match a desired-state file: 'plan state.json [--out plan.json]'
+
+        The file is JSON: {"users": [{"login": ..., "firstName": ..., ...}], "groups": [{"name": ...,
+        "description": ..., "members": [logins]}], "apps": [{"label": ..., "groups": [group names]}]}. Users are
+        matched by login, groups by name and apps by label; "members" and an app's "groups" are complete lists, so
+        anything else is removed. Apps that don't exist are created from their entry (name, signOnMode, settings...).
+        Current state comes from the API, or from the local index with --source index ('sync' it first).
+        --out saves the plan for 'apply'."""
+        runtime.run(self.run_plan(line))
+
+    async def run_plan(self, line):
+        try:
+            words, options = parse_options(line)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        if len(words) != 1 or options.get("source", "api") not in ("api", "index"):
+            print_error("Usage: plan state.json [--source api|index] [--out plan.json]\n")
+            return
+
+        plan = await self.make_plan(words[0], options.get("source", "api"))
+        if plan is None:
+            return
+
+        for change in plan["changes"]:
+            print(describe_change(change))
+
+        if not plan["changes"]:
+            print("The org already matches " + words[0])
+
+        if options.get("out"):
+            try:
+                with open(options["out"], "w") as plan_file:
+                    json.dump(plan, plan_file, indent=2)
+            except OSError as error:
+                print_error(f"Could not write {options['out']}: {error}\n")
+                return
+
+            print(f"\nSaved the plan to {options['out']}; run 'apply {options['out']}' to make the changes")
+
+        print("")
+
+    async def make_plan(self, path, source):
+        """Plan a desired-state file and print a summary; returns None (after printing why) if it can't be applied"""
+        try:
+            state = read_desired_state(path)
+        except (OSError, ValueError) as error:
+            print_error(f"Could not read {path}: {error}\n")
+            return None
+
+        started = time.perf_counter()
+
+        try:
+            changes, ids, problems = await plan_changes(state, source)
+        except Exception as error:
+            print_error(f"Could not plan {path}: {error}\n")
+            return None
+
+        for problem in problems[:20]:
+            print(problem)
+
+        if problems:
+            print_error(f"\n{len(problems)} problem(s) in {path}; nothing can be applied until they're fixed\n")
+            return None
+
+        counts = collections.Counter(change["action"] for change in changes)
+        summary = ", ".join(f"{count} to {action}" for action, count in counts.items()) or "no changes"
+        print(f"\nPlanned {summary} in {time.perf_counter() - started:.1f}s\n")
+
+        return {"state": path, "source": source, "planned_at": time.time(), "changes": changes, "ids": ids}
+
+    def do_apply(self, line):
+        """Make the org match a desired-state file, or apply a plan saved with 'plan --out': 'apply state.json'
+
+        Shows the plan and asks before changing anything; --yes skips the question (and is required in batch
+        mode). Users, groups and apps are created and updated first, then memberships and app assignments, up to
+        --concurrency N (default 8) requests at a time. --results results.jsonl logs the outcome of every change.
+        A saved plan is applied as it was planned, so re-plan if the org may have changed since."""
+        runtime.run(self.run_apply(line))
+
+    async def run_apply(self, line):
+        try:
+            words, options = parse_options(line, flags=("yes",))
+            options["concurrency"] = int(options.get("concurrency") or BULK_CONCURRENCY)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        if len(words) != 1:
+            print_error("Usage: apply state.json|plan.json [--yes] [--concurrency N] [--results results.jsonl]\n")
+            return
+
+        try:
+            with open(words[0]) as plan_file:
+                plan = json.load(plan_file)
+        except (OSError, ValueError) as error:
+            print_error(f"Could not read {words[0]}: {error}\n")
+            return
+
+        if isinstance(plan, dict) and "changes" in plan:
+            for change in plan["changes"]:
+                print(describe_change(change))
+            print("")
+        else:
+            plan = await self.make_plan(words[0], options.get("source", "api"))
+            if plan is None:
+                return
+
+            for change in plan["changes"]:
+                print(describe_change(change))
+            print("")
+
+        if not plan["changes"]:
+            print("Nothing to apply\n")
+            return
+
+        confirmed = options.get("yes") or ask(f"Apply {len(plan['changes'])} changes? [y/N] ").lower() in ("y", "yes")
+        if not confirmed:
+            print("Nothing was changed\n")
+            return
+
+        await apply_changes(plan["changes"], plan["ids"], options)
+
+    def do_group(self, line):
+        """Add users to or remove them from a group: 'group add|remove GROUP --users users.txt'
+
+        GROUP is a group name or ID; users.txt has one login or user ID per line. Logins are resolved in bulk (from
+        the local index with --source index), then memberships change --concurrency N (default 8) at a time.
+        Removing asks first unless --yes (required in batch mode). --results results.jsonl logs every user's
+        outcome; with --resume, users it records as done are skipped. Adding or removing twice is harmless, so a
+        run can always be repeated."""
+        runtime.run(self.run_group(line))
+
+    async def run_group(self, line):
+        try:
+            words, options = parse_options(line, flags=("yes", "resume"))
+            options["concurrency"] = int(options.get("concurrency") or BULK_CONCURRENCY)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        if len(words) != 2 or words[0] not in ("add", "remove") or not options.get("users") \
+                or options.get("source", "api") not in ("api", "index"):
+            print_error("Usage: group add|remove GROUP --users users.txt [--source api|index] [--yes] "
+                        "[--concurrency N] [--results results.jsonl [--resume]]\n")
+            return
+
+        action, identifier = words
+
+        try:
+            entries, duplicates = read_identifiers([], options["users"])
+        except OSError as error:
+            print_error(f"Could not read {options['users']}: {error}\n")
+            return
+
+        try:
+            if GROUP_ID.fullmatch(identifier):
+                group, err = await get_object("group", identifier)
+                if err is not None:
+                    print_error(f"Could not find group {identifier}: {error_message(err).strip()}\n")
+                    return
+            else:
+                found = await current_objects("group", {identifier.lower()}, options.get("source", "api"))
+                group = found.get(identifier.lower())
+                if group is None:
+                    print_error(f"There is no group named '{identifier}'\n")
+                    return
+
+            ids = await resolve_users(entries, options.get("source", "api"))
+        except (RuntimeError, sqlite3.Error) as error:
+            print_error(f"{error}\n")
+            return
+
+        print(f"\n{len(ids)} of {len(entries)} users found" +
+              (f" ({duplicates} duplicate lines ignored)" if duplicates else ""))
+
+        missing = [entry for entry in entries if entry not in ids]
+        if missing:
+            more = f" and {len(missing) - 20} more" if len(missing) > 20 else ""
+            print_error(f"{len(missing)} not found: {', '.join(missing[:20])}{more}")
+
+        if action == "remove" and not options.get("yes") and ask(
+                f"Remove {len(ids)} users from {group['profile']['name']}? [y/N] ").lower() not in ("y", "yes"):
+            print("Nothing was changed\n")
+            return
+
+        await change_memberships(group, action, entries, ids, options)
+
+    def do_snapshot(self, line):
+        """Export the whole org into a directory, resumably: 'snapshot dir [--types users,groups,...] [--fresh]'
+
+        Users, groups, apps, group members (members), app user assignments (app-users) and app group assignments
+        (app-groups) are exported side by side into <dir>/<type>.jsonl.gz, with up to --concurrency N (default 8)
+        groups or apps listed at a time for the assignment types. Progress is checkpointed after every page, so the
+        same command resumes an interrupted snapshot where it stopped; --fresh starts over. With --format parquet
+        each finished type is also written as <type>.parquet, if pyarrow is installed."""
+        runtime.run(self.run_snapshot(line))
+
+    async def run_snapshot(self, line):
+        try:
+            words, options = parse_options(line, flags=("fresh",))
+            concurrency = int(options.get("concurrency") or BULK_CONCURRENCY)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        types = [name.strip() for name in options.get("types", ",".join(SNAPSHOT_STREAMS)).split(",") if name.strip()]
+        unknown = [name for name in types if name not in SNAPSHOT_STREAMS]
+
+        if len(words) != 1 or unknown or options.get("format", "jsonl") not in ("jsonl", "parquet"):
+            print_error(f"Usage: snapshot dir [--types {','.join(SNAPSHOT_STREAMS)}] [--format jsonl|parquet] "
+                        "[--concurrency N] [--fresh]\n")
+            return
+
+        # assignments are listed per group or app, so their parents are exported too
+        streams = [name for name in SNAPSHOT_STREAMS
+                   if name in types or any(SNAPSHOT_STREAMS[child][1] == name for child in types)]
+
+        try:
+            snapshot = Snapshot(words[0], streams, fresh=bool(options.get("fresh")))
+        except (OSError, ValueError) as error:
+            print_error(f"Could not open the snapshot in {words[0]}: {error}\n")
+            return
+
+        states = {name: snapshot.stream(name) for name in streams}
+
+        if all(state["done"] for state in states.values()):
+            print(f"\nThe snapshot in {words[0]} is already complete; use --fresh to take a new one\n")
+            snapshot.close()
+            return
+
+        if snapshot.resumed:
+            progress = ", ".join(f"{name} {'done' if state['done'] else str(state['records']) + ' records'}"
+                                 for name, state in states.items())
+            print(f"\nResuming the snapshot in {words[0]}: {progress}")
+
+        records_before = sum(state["records"] for state in states.values())
+        started = time.perf_counter()
+
+        async def export(name):
+            await snapshot_stream(snapshot, name, concurrency)
+            print(f"{name}: {states[name]['records']} records, {states[name]['offset'] / 1048576:.1f} MiB")
+
+            await asyncio.gather(*(export(child) for child in streams if SNAPSHOT_STREAMS[child][1] == name))
+
+        print("")
+        tasks = [asyncio.ensure_future(export(name)) for name in streams if SNAPSHOT_STREAMS[name][1] is None]
+
+        try:
+            await asyncio.gather(*tasks)
+        except Exception as error:
+            print_error(f"\nThe snapshot stopped: {error}\nRun the same command again to resume it\n")
+            return
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            snapshot.close()
+
+        elapsed = time.perf_counter() - started
+        written = sum(state["records"] for state in states.values()) - records_before
+        print(f"\nExported {written} records in {elapsed:.1f}s - {written / elapsed if elapsed else 0:.0f} "
+              f"records/sec")
+
+        if options.get("format") == "parquet":
+            for name in streams:
+                problem = convert_to_parquet(snapshot, name)
+                if problem:
+                    print(f"{name}: {problem}")
+        print("")
+
+    def do_stats(self, line):
+        """Count users, groups or apps by one or more fields: 'stats user|group|app [--by field,field,...]'
+
+        e.g. 'stats user --by status,department' or 'stats app --by signOnMode'; the default is status for users,
+        type for groups and signOnMode for apps. Records stream from the API, selected with -q/--filter/--search as
+        for 'list', or from the local index with --source index, and are counted as they arrive, so memory stays
+        flat however big the org. --workers N counts in N processes, which pays off where parsing dominates (a
+        large index). --top N shows the N biggest groups; --output json prints the counts as one JSON object."""
+        runtime.run(self.run_stats(line))
+
+    async def run_stats(self, line):
+        try:
+            words, options = parse_options(line, aliases={"-q": "q"})
+            workers = int(options.get("workers") or 1)
+            top = int(options["top"]) if options.get("top") else None
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        if len(words) != 1 or words[0] not in STATS_FIELDS or options.get("source", "api") not in ("api", "index") \
+                or options.get("output", "table") not in ("table", "json"):
+            print_error("Usage: stats user|group|app [--by field,field] [--source api|index] [--output table|json] "
+                        "[--workers N] [--top N]\n")
+            return
+
+        if options.get("source") == "index" and options.get("q"):
+            print_error("-q needs the API; use --filter or --search with --source index\n")
+            return
+
+        kind = words[0]
+        names = [name.strip() for name in (options.get("by") or STATS_FIELDS[kind]).split(",") if name.strip()]
+        paths = [field_path(kind, name) for name in names]
+
+        loop = asyncio.get_running_loop()
+        counts = collections.Counter()
+        scanned = 0
+
+        pool = None
+        if workers > 1:
+            import concurrent.futures
+            pool = concurrent.futures.ProcessPoolExecutor(workers)
+
+        # at most two batches per worker in flight, so memory doesn't grow with the org
+        pending = collections.deque()
+        started = time.perf_counter()
+
+        try:
+            async for batch, node in stats_batches(kind, options):
+                scanned += len(batch)
+
+                if pool is None:
+                    with phase("count"):
+                        counts.update(count_groups(paths, batch, node))
+                    continue
+
+                pending.append(loop.run_in_executor(pool, count_groups, paths, batch, node))
+                if len(pending) >= workers * 2:
+                    counts.update(await pending.popleft())
+
+            while pending:
+                counts.update(await pending.popleft())
+        except (ValueError, RuntimeError, sqlite3.Error) as error:
+            print_error(f"Could not count {kind}s: {error}\n")
+            return
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - started
+        counted = sum(counts.values())
+        rate = scanned / elapsed if elapsed else 0
+
+        if options.get("output") == "json":
+            print(json.dumps({
+                "kind": kind, "by": names, "source": options.get("source", "api"), "records": counted,
+                "scanned": scanned, "seconds": round(elapsed, 3), "records_per_second": round(rate, 1),
+                "groups": [{**dict(zip(names, key)), "count": count} for key, count in counts.most_common(top)]
+            }))
+            summary = sys.stderr
+        else:
+            print("")
+            print_group_counts(names, counts, top)
+            summary = sys.stdout
+
+        print(f"\nCounted {counted} {kind}s (of {scanned} read) by {len(counts)} distinct {', '.join(names)} in "
+              f"{elapsed:.1f}s - {rate:.0f} records/sec\n", file=summary)
+
+    def do_find(self, line):
+        """Search the local index by login, name, label or ID prefix without calling the org; 'find [user|group|app] text'
+
+        Accepts --limit (default 50) and the same --output/--fields options as 'list'. Run 'sync' first."""
+        try:
+            words, options = parse_options(line)
+            limit = int(options.get("limit") or 50)
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        kinds = list(OrgIndex.KINDS)
+        if words and words[0] in OrgIndex.KINDS:
+            kinds = [words.pop(0)]
+
+        if not words:
+            print_error("Proper syntax is 'find [user|group|app] text' - matches are by prefix\n")
+            return
+
+        text = " ".join(words)
+        index = org_index()
+
+        for kind in kinds:
+            if index.watermark(kind) is None and index.count(kind) == 0:
+                continue
+
+            writer = create_row_writer(kind, options)
+            if writer is None:
+                return
+
+            started = time.perf_counter()
+            matches = index.find(kind, text, limit)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            if not matches:
+                continue
+
+            writer.open()
+            for match in matches:
+                writer.write(match)
+            writer.close()
+
+            if writer.output == "table":
+                print(f"{len(matches)} {kind} match(es) in {elapsed:.1f} ms\n")
+
+    # commands 'on' may run against several orgs: they only read from the org
+    FAN_OUT_COMMANDS = ("list", "find", "plan", "stats")
+
+    def do_orgs(self, line):
+        """Manage the saved org profiles 'on' runs commands against: 'orgs [list]', 'orgs add NAME ORG_URL CLIENT_ID',
+        'orgs login NAME' or 'orgs remove NAME'
+
+        A profile is an org URL plus the client ID of the org's CLI app. Its token shares the token cache with
+        logging in by -l/-c, so an org is logged into once and refreshed from then on. --org NAME starts the CLI on
+        a saved profile."""
+        runtime.run(self.run_orgs(line))
+
+    async def run_orgs(self, line):
+        words = line.split()
+        profiles = load_org_profiles()
+
+        if words in ([], ["list"]):
+            if not profiles:
+                print("\nNo org profiles yet; add one with 'orgs add NAME ORG_URL CLIENT_ID'\n")
+                return
+
+            tokens = load_token_cache()
+
+            print("")
+            for name, profile in sorted(profiles.items()):
+                cached = tokens.get(in_org(name, profile).run(token_cache_key))
+
+                if cached is None:
+                    status = f"not logged in ('orgs login {name}')"
+                elif cached["expires_at"] - TOKEN_EXPIRY_MARGIN > time.time():
+                    status = f"token valid for {(cached['expires_at'] - time.time()) / 60:.0f} min"
+                elif cached.get("refresh_token"):
+                    status = "token expired, will be refreshed"
+                else:
+                    status = f"token expired ('orgs login {name}')"
+
+                print(f"{name}: {profile['org']} (client {profile['client_id']}) - {status}")
+            print("")
+
+        elif words[0] == "add" and len(words) == 4:
+            name = words[1]
+            if name == "all" or "," in name:
+                print_error("Profile names can't be 'all' or contain commas\n")
+                return
+
+            profiles[name] = {"org": words[2], "client_id": words[3]}
+            orgClients.pop(name, None)
+            save_org_profiles(profiles)
+            print(f"\nSaved org profile '{name}'; log into it with 'orgs login {name}'\n")
+
+        elif words[0] in ("login", "remove") and len(words) == 2:
+            name = words[1]
+            if name not in profiles:
+                print_error(f"There is no org profile named '{name}'\n")
+                return
+
+            if words[0] == "remove":
+                del profiles[name]
+                orgClients.pop(name, None)
+                save_org_profiles(profiles)
+                print(f"\nRemoved org profile '{name}'\n")
+            elif await in_org(name, profiles[name]).run(asyncio.ensure_future, okta_login(None)) is not None:
+                print(f"\nLogged into {name}\n")
+            else:
+                print_error(f"\nCould not log into {name}\n")
+
+        else:
+            print_error("Valid options are 'orgs list', 'orgs add NAME ORG_URL CLIENT_ID', 'orgs login NAME' or "
+                        "'orgs remove NAME'\n")
+
+    def do_on(self, line):
+        """Run a read command against several saved orgs at once: 'on NAME,NAME,...|all COMMAND'
+
+        e.g. 'on all list app all --output ndjson' or 'on prod,staging list user jdoe@example.com'. The orgs run
+        concurrently, so the whole command takes about as long as the slowest one. Output is merged as it arrives
+        and tagged by org: an "org" field in NDJSON, an org column in CSV/TSV and an [org] prefix otherwise. An org
+        that fails doesn't stop the others; each org's time, output and errors are summarized at the end.
+        Works with list, find, plan and stats. Add orgs with 'orgs add'."""
+        runtime.run(self.run_on(line))
+
+    async def run_on(self, line):
+        words = line.split(None, 1)
+        profiles = load_org_profiles()
+
+        if len(words) != 2:
+            print_error("Proper syntax is 'on NAME,NAME,...|all COMMAND', e.g. 'on all list app all'\n")
+            return
+
+        names = sorted(profiles) if words[0] == "all" else list(dict.fromkeys(words[0].split(",")))
+        unknown = [name for name in names if name not in profiles]
+        command, arg, command_line = self.parseline(words[1])
+
+        if unknown or not names:
+            print_error(f"Unknown org profile(s): {', '.join(unknown)}\n" if unknown else
+                        "No org profiles yet; add one with 'orgs add NAME ORG_URL CLIENT_ID'\n")
+            return
+
+        if command not in self.FAN_OUT_COMMANDS:
+            print_error(f"'on' runs {', '.join(self.FAN_OUT_COMMANDS)}, not '{command}'\n")
+            return
+
+        try:
+            output = parse_options(arg)[1].get("output", "table")
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        stdout = sys.stdout
+        destination = commandOutput.get() or stdout
+        headers = set()
+
+        async def run_org(name):
+            # each org runs in its own task, so these only apply to this org's part of the command
+            profile = {"name": name, **profiles[name]}
+            activeOrg.set(profile)
+
+            buffer = OrgOutput(name, output, destination, headers)
+            errors = []
+            commandOutput.set(buffer)
+            commandErrors.set(errors)
+
+            started = time.perf_counter()
+
+            try:
+                profile["client"] = await org_client(name)
+
+                if hasattr(self, "run_" + command):
+                    await getattr(self, "run_" + command)(arg)
+                else:
+                    getattr(self, "do_" + command)(arg)
+            except Exception as error:
+                errors.append(str(error) or type(error).__name__)
+
+            buffer.close()
+            return {"org": name, "seconds": time.perf_counter() - started, "lines": buffer.lines, "errors": errors}
+
+        # route print() through commandOutput, as batch mode does
+        if not isinstance(stdout, CommandOutput):
+            sys.stdout = CommandOutput(stdout)
+
+        started = time.perf_counter()
+
+        try:
+            results = await asyncio.gather(*(run_org(name) for name in names))
+        finally:
+            sys.stdout = stdout
+
+        elapsed = time.perf_counter() - started
+        summary = sys.stdout if output == "table" else sys.stderr
+
+        print("", file=summary)
+        for result in results:
+            status = "failed" if result["errors"] else "ok"
+            print(f"{result['org']}: {status} in {result['seconds']:.1f}s, {result['lines']} lines", file=summary)
+
+        # after the per-org lines, so a failed org also fails the command (e.g. in batch mode)
+        for result in results:
+            for error in result["errors"][:5]:
+                print_error(f"{result['org']}: {error.strip()}", file=summary)
+
+        print(f"Ran '{command_line}' on {len(names)} orgs in {elapsed:.1f}s "
+              f"({sum(result['seconds'] for result in results):.1f}s one after another)\n", file=summary)
+
+    def do_pool(self, line):
+        """Show connection pool statistics for this session"""
+        stats = runtime.pool_stats()
+
+        print("")
+        print(f"Requests: {stats['requests']}")
+        print(f"New connections: {stats['new_connections']} (avg connect {stats['avg_connect_ms']:.1f} ms)")
+        print(f"Reused connections: {stats['reused_connections']} ({stats['reuse_ratio']:.0%} reuse)")
+        print(f"Idle keep-alive connections: {stats['idle_connections']}")
+        print("")
+
+    def do_limits(self, line):
+        """Show the rate limit budget seen for each endpoint and how often requests were held back"""
+        scheduler = runtime.scheduler
+        now = time.time()
+
+        print("")
+        print(f"Concurrency: {scheduler.concurrency} of {scheduler.max_concurrency} "
+              f"({scheduler.in_flight} in flight)")
+        print(f"Throttled: {scheduler.stats['throttled']} waits ({scheduler.stats['throttled_seconds']:.1f}s), "
+              f"429 responses: {scheduler.stats['rate_limited']}")
+
+        if scheduler.buckets:
+            print("---")
+
+        for key, state in sorted(scheduler.buckets.items()):
+            resets_in = max(0.0, state["reset"] - now)
+            print(f"{key}: {state['remaining']:.0f}/{state['limit']:.0f} remaining, resets in {resets_in:.0f}s")
+
+        print("")
+
+    def do_cache(self, line):
+        """Show or manage the lookup cache: 'cache stats', 'cache clear', 'cache size N' or 'cache ttl SECONDS'
+
+        Users, groups and apps read by ID (or login) are kept for the TTL, so repeated lookups cost no request.
+        Anything this session changes through the API is dropped from the cache as soon as the change succeeds."""
+        words = line.split()
+
+        if words in ([], ["stats"]):
+            stats = objectCache.stats
+            lookups = stats["hits"] + stats["misses"]
+
+            print("")
+            print(f"Entries: {len(objectCache.entries)} of {objectCache.max_entries} (TTL {objectCache.ttl:g}s)")
+            print(f"Hits: {stats['hits']}, misses: {stats['misses']} "
+                  f"({stats['hits'] / lookups if lookups else 0:.0%} hit rate), expired: {stats['expired']}")
+            print(f"Evictions: {stats['evictions']}, invalidations: {stats['invalidations']}")
+            print("")
+        elif words == ["clear"]:
+            entries = len(objectCache.entries)
+            objectCache.clear()
+            print(f"\nCleared {entries} cached object(s)\n")
+        elif len(words) == 2 and words[0] in ("size", "ttl"):
+            try:
+                value = int(words[1]) if words[0] == "size" else float(words[1])
+            except ValueError:
+                print_error(f"'{words[1]}' isn't a number\n")
+                return
+
+            if words[0] == "size":
+                objectCache.max_entries = value
+                objectCache.trim()
+            else:
+                objectCache.ttl = value
+
+            print(f"\nCache {words[0]} set to {words[1]}\n")
+        else:
+            print_error("Proper syntax is 'cache stats', 'cache clear', 'cache size N' or 'cache ttl SECONDS'\n")
+
+    def do_timing(self, line):
+        """Time every following command: 'timing on|off', or 'timing' to show the current setting
+
+        Each command is followed by its phases (fetch, wait, render, output, ...) and its HTTP requests per
+        endpoint: statuses, bytes, p50/p99 latency, time queued by rate limiting and the rate limit left.
+        'timing on --profile' also runs each command under cProfile. 'timing on --file trace.json' saves every
+        request and phase when timing is turned off or the CLI exits; add --format chrome for a trace that opens
+        in chrome://tracing or ui.perfetto.dev"""
+        try:
+            words, options = parse_options(line, flags=("profile",))
+        except ValueError as error:
+            print_error(f"Could not parse command: {error}\n")
+            return
+
+        if words == ["on"]:
+            trace_format = options.get("format") or "json"
+            if trace_format not in ("json", "chrome"):
+                print_error(f"Unknown trace format '{trace_format}'; valid options are json, chrome\n")
+                return
+
+            tracer.enable(bool(options.get("profile")), options.get("file"), trace_format)
+        elif words == ["off"]:
+            tracer.disable()
+        elif words:
+            print_error("Proper syntax is 'timing on [--profile] [--file trace.json] [--format json|chrome]' "
+                        "or 'timing off'\n")
+            return
+
+        print(f"\nTiming is {'on' if tracer.enabled else 'off'}"
+              f"{' with profiling' if tracer.enabled and tracer.profile else ''}"
+              f"{f'; traces go to {tracer.path} ({tracer.format})' if tracer.enabled and tracer.path else ''}\n")
+
+    def do_logout(self, line):
+        """Forget the cached access and refresh tokens for this org; the next launch starts a new device login"""
+        if forget_token():
+            print("Removed the cached tokens for this org\n")
+        else:
+            print("No cached tokens for this org\n")
 
     def do_exit(self, line):
         """Exit the CLI."""
         return True
 
 
-def okta_login(args):
-    authorizeUri = "https://" + oktaOrgUrl + "/oauth2/v1/device/authorize"
+def read_batch_script(source):
+    """Split a batch script into groups of commands; a 'wait' line ends a group, and groups run one after another"""
+    script = sys.stdin if source == "-" else open(source)
+    groups = [[]]
+
+    try:
+        for number, line in enumerate(script, 1):
+            line = line.strip()
+
+            if not line or line.startswith("#"):
+                continue
+
+            if line == "wait":
+                groups.append([])
+            else:
+                groups[-1].append((number, line))
+    finally:
+        if script is not sys.stdin:
+            script.close()
+
+    return [group for group in groups if group]
+
+
+async def run_batch_command(cli, entry):
+    number, line = entry
+    name, arg, line = cli.parseline(line)
+
+    output = io.StringIO()
+    errors = []
+    commandOutput.set(output)
+    commandErrors.set(errors)
+
+    started = time.perf_counter()
+    trace = tracer.start(line) if name != "timing" else None
+
+    # a long script can outlive the access token it started with; commands that call the org then fail on their own
+    try:
+        await connect()
+    except RuntimeError as error:
+        print(error, file=sys.stderr)
+
+    try:
+        if name is None or not hasattr(cli, "do_" + name):
+            print_error(f"Unknown command '{line}'")
+        elif hasattr(cli, "run_" + name):
+            await getattr(cli, "run_" + name)(arg)
+        else:
+            getattr(cli, "do_" + name)(arg)
+    except Exception as error:
+        errors.append(str(error) or type(error).__name__)
+
+    result = {
+        "line": number,
+        "command": line,
+        "status": "failed" if errors else "ok",
+        "exit_code": 1 if errors else 0,
+        "seconds": round(time.perf_counter() - started, 3),
+        "errors": errors,
+        "output": output.getvalue()
+    }
+
+    if trace is not None:
+        tracer.finish(trace)
+        trace.print_summary(sys.stderr)
+        result["timing"] = trace.totals()
+
+    return result
+
+
+async def run_batch(cli, source, jobs=1, output_format="jsonl"):
+    """Run a batch script against the current session; returns the process exit code (1 if any command failed).
+
+    Up to `jobs` commands run at once on the shared client. Results are written in script order either as one
+    JSON object per command or as each command's plain output.
+    """
+    global batchMode
+
+    try:
+        groups = read_batch_script(source)
+    except OSError as error:
+        print(f"Could not read batch script: {error}")
+        return 2
+
+    await connect()
+
+    stdout = sys.stdout
+    batchMode = True
+    sys.stdout = CommandOutput(stdout)
+    exit_code = 0
+
+    try:
+        for group in groups:
+            async for entry, result in ordered_map(group, lambda entry: run_batch_command(cli, entry), jobs):
+                exit_code = max(exit_code, result["exit_code"])
+
+                if output_format == "jsonl":
+                    stdout.write(json.dumps(result) + "\n")
+                else:
+                    stdout.write(result["output"])
+                    for error in result["errors"]:
+                        if error not in result["output"]:
+                            print(error, file=sys.stderr)
+
+                stdout.flush()
+    finally:
+        sys.stdout = stdout
+        batchMode = False
+
+    return exit_code
+
+
+def org_base_url():
+    """The org's base URL; -l takes a host name, or a full URL such as a local mock org's http://127.0.0.1:8765"""
+    org = current_org()[0]
+    return org if "://" in org else "https://" + org
+
+
+def token_cache_key():
+    org, client_id, okta_client = current_org()
+    return org + "|" + client_id
+
+
+def load_token_cache():
+    try:
+        with open(TOKEN_CACHE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_token_cache(tokens):
+    """Write the token cache atomically, readable by the current user only"""
+    os.makedirs(os.path.dirname(TOKEN_CACHE), mode=0o700, exist_ok=True)
+
+    temporary_path = TOKEN_CACHE + ".tmp"
+    descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+
+    with os.fdopen(descriptor, "w") as cache_file:
+        json.dump(tokens, cache_file)
+
+    os.replace(temporary_path, TOKEN_CACHE)
+
+
+def cache_token(response_text):
+    # several orgs' tokens can be refreshed at once by 'on'; don't let one write drop another's token
+    with tokenCacheLock:
+        tokens = load_token_cache()
+        previous = tokens.get(token_cache_key(), {})
+
+        tokens[token_cache_key()] = {
+            "access_token": response_text["access_token"],
+            # refresh tokens may or may not be rotated; keep the old one if no new one was issued
+            "refresh_token": response_text.get("refresh_token", previous.get("refresh_token")),
+            "expires_at": time.time() + int(response_text.get("expires_in", 3600)),
+            "scope": response_text.get("scope")
+        }
+
+        save_token_cache(tokens)
+
+
+def forget_token():
+    tokens = load_token_cache()
+
+    if tokens.pop(token_cache_key(), None) is not None:
+        save_token_cache(tokens)
+        return True
+
+    return False
+
+
+def load_org_profiles():
+    """Saved org profiles: {name: {"org": org URL, "client_id": client ID}}"""
+    try:
+        with open(ORG_PROFILES) as profiles_file:
+            return json.load(profiles_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_org_profiles(profiles):
+    os.makedirs(os.path.dirname(ORG_PROFILES), mode=0o700, exist_ok=True)
+
+    temporary_path = ORG_PROFILES + ".tmp"
+    with open(temporary_path, "w") as profiles_file:
+        json.dump(profiles, profiles_file, indent=2)
+
+    os.replace(temporary_path, ORG_PROFILES)
+
+
+def in_org(name, profile):
+    """A context in which current_org() is the saved profile; a task started in it (e.g. okta_login) keeps it"""
+    context = contextvars.copy_context()
+    context.run(activeOrg.set, {"name": name, "org": profile["org"], "client_id": profile["client_id"]})
+
+    return context
+
+
+async def org_client(name):
+    """The OktaClient for the current (saved profile) org, built from its cached token on the shared session"""
+    token = await cached_access_token()
+    if token is None:
+        raise RuntimeError(f"not logged in; run 'orgs login {name}'")
+
+    built = orgClients.get(name)
+
+    if built is None or built[0] != token:
+        from okta.client import Client as OktaClient
+
+        config = {'authorizationMode': 'Bearer', 'orgUrl': org_base_url(), 'token': token}
+        orgClients[name] = (token, await runtime.attach(OktaClient(config)))
+
+    return orgClients[name][1]
+
+
+class OrgOutput:
+    """Stand-in output buffer for one org's part of an 'on' command: complete lines are passed straight on, tagged
+    with the org. NDJSON records gain an "org" field, CSV and TSV rows an org column (with one header for all
+    orgs), and anything else an [org] prefix."""
+
+    def __init__(self, name, output, stream, headers):
+        self.name = name
+        self.output = output
+        self.stream = stream
+        self.headers = headers
+        self.pending = ""
+        self.lines = 0
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split("\n")
+
+        for line in lines:
+            self.emit(line)
+
+        return len(text)
+
+    def emit(self, line):
+        if self.output in ("ndjson", "json") and line.startswith("{"):
+            line = '{"org": ' + json.dumps(self.name) + (", " + line[1:] if line != "{}" else "}")
+        elif self.output in ("csv", "tsv"):
+            separator = "," if self.output == "csv" else "\t"
+
+            if self.lines == 0:
+                # every org writes the same header; only the first one is kept
+                if line in self.headers:
+                    self.lines += 1
+                    return
+                self.headers.add(line)
+                line = "org" + separator + line
+            else:
+                line = self.name + separator + line
+        elif line:
+            line = f"[{self.name}] {line}"
+
+        self.lines += 1
+        self.stream.write(line + "\n")
+
+    def close(self):
+        if self.pending:
+            self.emit(self.pending)
+            self.pending = ""
+
+
+async def refresh_access_token(refresh_token):
+    request_body = {
+        'client_id': current_org()[1],
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+        'scope': LOGIN_SCOPES
+    }
+
+    status, response_text = await http_request("POST", org_base_url() + "/oauth2/v1/token", form=request_body)
+
+    if status != 200:
+        return None
+
+    cache_token(response_text)
+
+    return response_text["access_token"]
+
+
+async def cached_access_token():
+    """An access token for the org from the token cache, refreshed if it has expired; None if there isn't one"""
+    cached = load_token_cache().get(token_cache_key())
+
+    if cached is None:
+        return None
+
+    # a token that is still valid starts the CLI without any network round-trip
+    if cached["expires_at"] - TOKEN_EXPIRY_MARGIN > time.time():
+        return cached["access_token"]
+
+    if cached.get("refresh_token"):
+        return await refresh_access_token(cached["refresh_token"])
+
+    return None
+
+
+async def okta_login(args):
+    """Get an access token for the org, from the token cache if possible, otherwise via the device authorization grant"""
+    access_token = await cached_access_token()
+    if access_token is not None:
+        return access_token
+
+    authorizeUri = org_base_url() + "/oauth2/v1/device/authorize"
 
     request_body = {
-        'client_id': clientId,
-        'scope': 'openid okta.users.manage okta.apps.manage okta.groups.manage okta.schemas.read'
+        'client_id': current_org()[1],
+        'scope': LOGIN_SCOPES
     }
 
-    response = requests.post(authorizeUri, data=request_body)
-    response_text = json.loads(response.text)
+    status, response_text = await http_request("POST", authorizeUri, form=request_body)
+
+    if status != 200:
+        print(response_text.get("error_description") or response_text.get("errorSummary") or
+              f"Device authorization failed with HTTP {status}")
+        return None
+
     deviceUrl = response_text["verification_uri_complete"]
     deviceCode = response_text["device_code"]
+    interval = int(response_text.get("interval", 5))
+    expires_at = time.time() + int(response_text.get("expires_in", 600))
 
     print(
         f'Open your browser and navigate to the following URL to begin the Okta device authorization for the Okta CLI: {deviceUrl}')
 
-    poll = True
+    request_body = {
+        'client_id': current_org()[1],
+        'device_code': deviceCode,
+        'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
+    }
 
-    while True:
-        try:
-            request_body = {
-                'client_id': clientId,
-                'device_code': deviceCode,
-                'grant_type': 'urn:ietf:params:oauth:grant-type:device_code',
-            }
+    # poll no faster than the authorization server asks for (RFC 8628 section 3.5)
+    while time.time() < expires_at:
+        await asyncio.sleep(interval)
 
-            response = requests.post("https://" + oktaOrgUrl + "/oauth2/v1/token", data=request_body)
-            status_code = response.status_code
-            if status_code != 200:
-                """Continue polling"""
-            else:
-                response_text = json.loads(response.text)
-                access_token = response_text["access_token"]
-                break
+        status, response_text = await http_request("POST", org_base_url() + "/oauth2/v1/token", form=request_body)
 
-        except Exception as error:
-            print(error)
-            raise error
+        if status == 200:
+            cache_token(response_text)
+            return response_text["access_token"]
 
-    return access_token
+        error = response_text.get("error")
 
+        if error == "authorization_pending":
+            continue
+        elif error == "slow_down":
+            interval += 5
+        elif status is None:
+            # a dropped connection doesn't end the login; the device code is still good until it expires
+            continue
+        else:
+            print(response_text.get("error_description") or error)
+            return None
 
-async def main():
-    parser = create_parser()
-    args = parser.parse_args()
+    print("The device authorization request expired before it was approved")
+    return None
 
-    global oktaOrgUrl
-    global clientId
-    global client
 
-    if args.register and (args.login or args.clientId):
-        parser.print_help()
-    elif args.register:
-        email = args.register
-        print(email)
-
-        first_name = input("First name: ")
-        last_name = input("Last name: ")
-        country = input("Country: ")
-
-        body = {
-            "userProfile": {
-                "firstName": first_name,
-                "lastName": last_name,
-                "email": email,
-                "country": country,
-                "okta_oie": True
-            }
-        }
+async def timed_step(steps, name, coroutine):
+    """Await a provisioning step, recording when it started (relative to the first step) and how long it took"""
+    started = time.perf_counter()
+
+    try:
+        return await coroutine
+    finally:
+        steps.append((name, started, time.perf_counter() - started))
+
 
-        bodyJSON = json.dumps(body)
+def print_steps(steps):
+    if not steps:
+        return
+
+    origin = min(started for name, started, elapsed in steps)
+
+    print("\nProvisioning steps (start, duration):")
+    for name, started, elapsed in sorted(steps, key=lambda step: step[1]):
+        print(f"  {name:<32} {started - origin:>7.2f}s {elapsed:>7.2f}s")
+
+
+async def redeem_developer_org(devorg_url):
+    """Poll the redeem endpoint until the new org stops being PENDING, backing off between polls"""
+    delay = 2
+    deadline = time.time() + REGISTRATION_TIMEOUT
+
+    while True:
+        status, response_text = await http_request("GET", devorg_url)
+
+        if status is not None and response_text.get("status") != "PENDING":
+            return response_text
+
+        if time.time() > deadline:
+            raise TimeoutError("Timed out waiting for the Okta Organization to be created")
+
+        await asyncio.sleep(delay)
+        delay = min(delay * 1.5, 15)
+
+
+async def grant_scope(org_client, app_id, issuer, scope):
+    request, error = await org_client.get_request_executor().create_request(
+        method='POST',
+        url='/api/v1/apps/' + app_id + '/grants',
+        body={"issuer": issuer, "scopeId": scope},
+        headers={},
+        oauth=False
+    )
+    if error is not None:
+        raise RuntimeError(error_message(error))
+
+    response, error = await org_client.get_request_executor().execute(request, None)
+    if error is not None:
+        raise RuntimeError(f"Failed to grant {scope}: {error_message(error)}")
+
+
+async def assign_user(org_client, app_id, email, first_name, last_name, country):
+    user, resp, err = await org_client.get_user(email)
+    if err is not None:
+        raise RuntimeError(f"Failed to look up {email}: {error_message(err)}")
+
+    body = {
+        "id": user.id,
+        "credentials": {
+            "userName": email
+        },
+        "profile": {
+            "country": country,
+            "given_name": first_name,
+            "name": first_name + " " + last_name,
+            "family_name": last_name,
+            "email": email
+        }
+    }
 
-        headers = {
-            "Content-Type": "application/json",
-            "Accept": "application/json"
+    request, error = await org_client.get_request_executor().create_request(
+        method='POST',
+        url='/api/v1/apps/' + app_id + '/users',
+        body=body,
+        headers={},
+        oauth=False
+    )
+    if error is not None:
+        raise RuntimeError(error_message(error))
+
+    response, error = await org_client.get_request_executor().execute(request, None)
+    if error is not None:
+        raise RuntimeError(f"Failed to assign {email} to the CLI app: {error_message(error)}")
+
+
+async def register_developer_org(email):
+    """Sign up for a developer org, then provision the CLI app in it.
+
+    Once the org exists the CLI app is created first; its scope grants, and the user lookup plus app assignment,
+    depend only on the app and run concurrently.
+    """
+    print(email)
+
+    first_name = input("First name: ")
+    last_name = input("Last name: ")
+    country = input("Country: ")
+
+    body = {
+        "userProfile": {
+            "firstName": first_name,
+            "lastName": last_name,
+            "email": email,
+            "country": country,
+            "okta_oie": True
         }
+    }
 
-        reg_id = "reg405abrRAkn0TRf5d6"
-        reg_url = "https://okta-devok12.okta.com/api/v1/registration/" + reg_id + "/register"
-        response = requests.post(reg_url, data=bodyJSON, headers=headers)
+    steps = []
 
-        response_text = json.loads(response.text)
+    reg_url = REGISTRATION_ORG + "/api/v1/registration/" + REGISTRATION_ID + "/register"
+    status, response_text = await timed_step(steps, "register", http_request("POST", reg_url, body=body))
 
-        try:
-            devorg_token = response_text["developerOrgCliToken"]
+    if "developerOrgCliToken" not in response_text:
+        print(response_text.get("errorCauses") or response_text.get("error_description") or f"HTTP {status}")
+        print("Failed to create Okta Organization. You can register manually by going to "
+              "https://developer.okta.com/signup")
+        return
 
-            devorg_url = "https://okta-devok12.okta.com/api/internal/v1/developer/redeem/" + devorg_token
-            response = requests.get(devorg_url)
+    devorg_url = REGISTRATION_ORG + "/api/internal/v1/developer/redeem/" + response_text["developerOrgCliToken"]
 
-            response_text = json.loads(response.text)
+    print("Creating new Okta Organization, this may take a minute...")
+    print("An account activation email has been sent to you")
+    print("Check your email to continue...")
 
-            try:
-                status = response_text["status"]
-
-                print("Creating new Okta Organization, this may take a minute...")
-                print("An account activation email has been sent to you")
-                print("Check your email to continue...")
-
-                while status == "PENDING":
-                    time.sleep(4)
-                    response = requests.get(devorg_url)
-                    response_text = json.loads(response.text)
-                    status = response_text["status"]
-
-                    if status != "PENDING":
-                        api_token = response_text["apiToken"]
-                        dev_org = response_text["orgUrl"]
-
-                        app_grant = ["authorization_code", "urn:ietf:params:oauth:grant-type:device_code"]
-                        app_response_type = ["code"]
-
-                        app_body = {
-                            "name": "oidc_client",
-                            "label": "Okta CLI",
-                            "signOnMode": "OPENID_CONNECT",
-                            "credentials": {
-                                "oauthClient": {
-                                    "token_endpoint_auth_method": "none"
-                                }
-                            },
-                            "settings": {
-                                "oauthClient": {
-                                    "redirect_uris": [
-                                        "com.okta.developer://callback"
-                                    ],
-                                    "response_types": app_response_type,
-                                    "grant_types": app_grant,
-                                    "application_type": "NATIVE"
-                                }
-                            }
-                        }
-                        config = {
-                            'authorizationMode': 'SSWS',
-                            'orgUrl': dev_org,
-                            'token': api_token
-                        }
+    try:
+        response_text = await timed_step(steps, "wait for org", redeem_developer_org(devorg_url))
 
-                        print("Creating CLI app...\n\n")
-                        client = OktaClient(config)
-                        app, resp, err = await client.create_application(app_body)
+        api_token = response_text["apiToken"]
+        dev_org = response_text["orgUrl"]
 
-                        body = {
-                            "issuer": dev_org,
-                            "scopeId": "okta.apps.manage"
-                        }
+        app_grant = ["authorization_code", "urn:ietf:params:oauth:grant-type:device_code"]
+        app_response_type = ["code"]
 
-                        request, error = await client.get_request_executor().create_request(
-                            method='POST',
-                            url='/api/v1/apps/' + app.id + '/grants',
-                            body=body,
-                            headers={},
-                            oauth=False
-                        )
+        app_body = {
+            "name": "oidc_client",
+            "label": "Okta CLI",
+            "signOnMode": "OPENID_CONNECT",
+            "credentials": {
+                "oauthClient": {
+                    "token_endpoint_auth_method": "none"
+                }
+            },
+            "settings": {
+                "oauthClient": {
+                    "redirect_uris": [
+                        "com.okta.developer://callback"
+                    ],
+                    "response_types": app_response_type,
+                    "grant_types": app_grant,
+                    "application_type": "NATIVE"
+                }
+            }
+        }
+        config = {
+            'authorizationMode': 'SSWS',
+            'orgUrl': dev_org,
+            'token': api_token
+        }
 
-                        response, error = await client.get_request_executor().execute(request, None)
-                        response_body = response.get_body()
+        from okta.client import Client as OktaClient
 
-                        body = {
-                            "issuer": dev_org,
-                            "scopeId": "okta.users.manage"
-                        }
+        print("Creating CLI app...\n\n")
+        org_client = await runtime.attach(OktaClient(config))
+        app, resp, err = await timed_step(steps, "create CLI app", org_client.create_application(app_body))
 
-                        request, error = await client.get_request_executor().create_request(
-                            method='POST',
-                            url='/api/v1/apps/' + app.id + '/grants',
-                            body=body,
-                            headers={},
-                            oauth=False
-                        )
+        if err is not None:
+            raise RuntimeError(error_message(err))
 
-                        response, error = await client.get_request_executor().execute(request, None)
-                        response_body = response.get_body()
+        provisioning = [timed_step(steps, "grant " + scope, grant_scope(org_client, app.id, dev_org, scope))
+                        for scope in CLI_APP_SCOPES]
+        provisioning.append(timed_step(steps, "assign user to CLI app",
+                                       assign_user(org_client, app.id, email, first_name, last_name, country)))
 
-                        body = {
-                            "issuer": dev_org,
-                            "scopeId": "okta.groups.manage"
-                        }
+        results = await asyncio.gather(*provisioning, return_exceptions=True)
+        failures = [result for result in results if isinstance(result, Exception)]
 
-                        request, error = await client.get_request_executor().create_request(
-                            method='POST',
-                            url='/api/v1/apps/' + app.id + '/grants',
-                            body=body,
-                            headers={},
-                            oauth=False
-                        )
+        print_steps(steps)
 
-                        response, error = await client.get_request_executor().execute(request, None)
-                        response_body = response.get_body()
+        for failure in failures:
+            print(failure)
 
-                        body = {
-                            "issuer": dev_org,
-                            "scopeId": "okta.schemas.read"
-                        }
+        print("")
+        print(f"New Okta Account created!\nYour Okta Domain: {dev_org}\nYour CLI Client ID: {app.id}"
+              f"\n\nPlease relaunch the CLI and specify your org and client ID to authenticate.")
 
-                        request, error = await client.get_request_executor().create_request(
-                            method='POST',
-                            url='/api/v1/apps/' + app.id + '/grants',
-                            body=body,
-                            headers={},
-                            oauth=False
-                        )
-
-                        response, error = await client.get_request_executor().execute(request, None)
-                        response_body = response.get_body()
-
-                        user, resp, err = await client.get_user(email)
-
-                        body = {
-                            "id": user.id,
-                            "credentials": {
-                                "userName": email
-                            },
-                            "profile": {
-                                "country": country,
-                                "given_name": first_name,
-                                "name": first_name + " " + last_name,
-                                "family_name": last_name,
-                                "email": email
-                            }
-                        }
+    except Exception as error:
+        print_steps(steps)
+        print(error)
+        print("Failed to create Okta Organization. You can register manually by going to "
+              "https://developer.okta.com/signup")
 
-                        request, error = await client.get_request_executor().create_request(
-                            method='POST',
-                            url='/api/v1/apps/' + app.id + '/users',
-                            body=body,
-                            headers={},
-                            oauth=False
-                        )
 
-                        response, error = await client.get_request_executor().execute(request, None)
-                        response_body = response.get_body()
+async def main():
+    parser = create_parser()
+    args = parser.parse_args()
+
+    global oktaOrgUrl
+    global clientId
+    global clientConfig
+    global prefetchDepth
 
-                        client = None
+    prefetchDepth = args.prefetch
+    objectCache.max_entries = args.cache_size
+    objectCache.ttl = args.cache_ttl
 
-                        print(f"New Okta Account created!\nYour Okta Domain: {dev_org}\nYour CLI Client ID: {app.id}"
-                              f"\n\nPlease relaunch the CLI and specify your org and client ID to authenticate.")
+    if args.trace is not None or args.profile:
+        tracer.enable(args.profile, args.trace, args.trace_format)
 
-            except Exception:
-                print("Failed to create Okta Organization. You can register manually by going to "
-                      "https://developer.okta.com/signup")
+    if args.org:
+        profile = load_org_profiles().get(args.org)
 
-        except Exception:
-            error_causes = response_text["errorCauses"]
-            print(error_causes)
-            print("Failed to create Okta Organization. You can register manually by going to "
-                  "https://developer.okta.com/signup")
+        if profile is None or args.login or args.clientId:
+            print(f"There is no org profile named '{args.org}'" if profile is None else "--org replaces -l and -c")
+            return args
 
+        args.login, args.clientId = profile["org"], profile["client_id"]
+
+    if args.register and (args.login or args.clientId):
+        parser.print_help()
+    elif args.register:
+        await register_developer_org(args.register)
     elif args.login and args.clientId:
         oktaOrgUrl = args.login
         clientId = args.clientId
 
-        token = okta_login(args.login)
+        token = await okta_login(args.login)
 
-        config = {
+        if token is None:
+            oktaOrgUrl = None
+            return args
+
+        clientConfig = {
             'authorizationMode': 'Bearer',
-            'orgUrl': 'https://' + oktaOrgUrl,
+            'orgUrl': org_base_url(),
             'token': token
         }
 
-        client = OktaClient(config)
+        # the client is built by the first command; load the SDK in the background while the prompt comes up
+        threading.Thread(target=importlib.import_module, args=("okta.client",), daemon=True).start()
     else:
         parser.print_help()
 
+    return args
+
 
 if __name__ == "__main__":
-    asyncio.get_event_loop().run_until_complete(main())
-    if oktaOrgUrl is not None:
-        OktaCLI().cmdloop()
+    exit_code = 0
+
+    try:
+        args = runtime.run(main())
+        if oktaOrgUrl is not None:
+            if args.batch:
+                exit_code = runtime.run(run_batch(OktaCLI(), args.batch, args.jobs, args.batch_format))
+            else:
+                OktaCLI().cmdloop()
+    finally:
+        tracer.write()
+        runtime.close()
+
+    sys.exit(exit_code)
@@ -0,0 +1,20 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from main import parse_options
+
+
+def test_quoted_option_value():
+    words, options = parse_options("user all --search 'profile.department eq \"Sales\"'")
+
+    assert words == ["user", "all"]
+    assert options == {"search": 'profile.department eq "Sales"'}
+
+
+def test_apostrophe_in_login():
+    words, options = parse_options("user o'brien@example.com --concurrency 4")
+
+    assert words == ["user", "o'brien@example.com"]
+    assert options == {"concurrency": "4"}